@@ -1,45 +1,252 @@
 # -*- coding: utf-8 -*-
 
+import bisect
+import hashlib
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 import config # Импортируем конфигурацию
 
-def find_swing_points(data, n=5):
+_analysis_cache = OrderedDict() # LRU-кэш результатов анализа {ключ: результат}
+
+
+def _cache_get(key):
+    """Возвращает результат из кэша анализа (и отмечает его как недавно использованный) или None."""
+    result = _analysis_cache.get(key)
+    if result is not None:
+        _analysis_cache.move_to_end(key)
+    return result
+
+def _cache_put(key, result):
+    """Сохраняет результат в кэш анализа, вытесняя самые давно использованные записи."""
+    _analysis_cache[key] = result
+    _analysis_cache.move_to_end(key)
+    while len(_analysis_cache) > config.ANALYSIS_CACHE_SIZE:
+        _analysis_cache.popitem(last=False)
+
+def clear_analysis_cache():
+    """Очищает кэш анализа."""
+    _analysis_cache.clear()
+
+def _bars_key(data, symbol, timeframe):
+    """
+    Ключ набора свечей: символ, таймфрейм, количество свечей, первая и последняя свеча и хэш всех high/low.
+    Хэш нужен, потому что меняться может не только последняя (незакрытая) свеча: исправления истории
+    при объединении с кэшем или правка набора в исследовании меняют свечи в середине.
+    """
+    highs, lows = data['high'].to_numpy(), data['low'].to_numpy()
+    digest = hashlib.blake2b(np.ascontiguousarray(highs, dtype=np.float64).tobytes(), digest_size=16)
+    digest.update(np.ascontiguousarray(lows, dtype=np.float64).tobytes())
+    if 'timestamp' in data.columns:
+        timestamps = data['timestamp'].array
+        timestamps = getattr(timestamps, 'asi8', timestamps) # Целые значения datetime без создания Timestamp
+        bounds = (timestamps[0], timestamps[-1]) if len(data) else (None, None)
+    else:
+        bounds = (None, None) # Без колонки timestamp свечи различает только хэш
+    return (symbol, timeframe, len(data)) + bounds + (digest.hexdigest(),)
+
+SHIFTED_WINDOW_MAX_N = 12 # До такого n окно считается сдвигами массива, для больших - van Herk/Gil-Werman
+
+def _centered_window_extreme(values, n, accumulate, fill):
+    """
+    Экстремум в центрированном окне 2*n+1 по последней оси. accumulate - np.fmax/np.fmin (NaN пропускаются).
+    Малые окна: 2*n проходов по сдвинутым срезам. Большие окна - алгоритм van Herk/Gil-Werman:
+    массив делится на блоки длины окна, в каждом блоке считаются префиксный и суффиксный экстремумы,
+    экстремум окна [j-n, j+n] равен экстремуму суффикса одного блока и префикса следующего (O(N) при любом n).
+    Окна, где меньше n+1 значений не NaN, дают NaN (min_periods=n+1 у rolling).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    length = values.shape[-1]
+    window_size = 2 * n + 1
+    if length < n + 1:
+        # Как min_periods=n+1 у rolling: окно ни одной свечи не набирает n+1 значений
+        return np.full(values.shape, np.nan)
+
+    if n <= SHIFTED_WINDOW_MAX_N:
+        padded = np.full(values.shape[:-1] + (length + 2 * n,), fill)
+        padded[..., n:n + length] = values
+        result = padded[..., :length].copy()
+        for shift in range(1, window_size):
+            accumulate(result, padded[..., shift:shift + length], out=result)
+    else:
+        # Дополняем n значениями слева и справа и до кратного длине окна
+        padded_length = -(-(length + 2 * n) // window_size) * window_size
+        padded = np.full(values.shape[:-1] + (padded_length,), fill)
+        padded[..., n:n + length] = values
+        blocks = padded.reshape(values.shape[:-1] + (-1, window_size))
+        prefix = accumulate.accumulate(blocks, axis=-1).reshape(padded.shape)
+        suffix = accumulate.accumulate(blocks[..., ::-1], axis=-1)[..., ::-1].reshape(padded.shape)
+        del padded, blocks
+        result = accumulate(suffix[..., :length], prefix[..., window_size - 1:window_size - 1 + length])
+
+    result[np.isinf(result)] = np.nan # Окно без значений (только NaN и дополнение)
+    missing = np.isnan(values)
+    if missing.any():
+        # Кол-во значений в окне по префиксным суммам; без NaN в данных каждое окно набирает не меньше n+1
+        valid = np.zeros(values.shape[:-1] + (length + 2 * n + 1,), dtype=np.int64)
+        np.cumsum(~missing, axis=-1, out=valid[..., n + 1:n + 1 + length])
+        valid[..., n + 1 + length:] = valid[..., n + length:n + 1 + length]
+        result[valid[..., window_size:window_size + length] - valid[..., :length] < n + 1] = np.nan
+    return result
+
+def centered_window_max(values, n):
+    """Максимум в центрированном окне 2*n+1 (как rolling(2*n+1, center=True, min_periods=n+1).max())."""
+    return _centered_window_extreme(values, n, np.fmax, -np.inf)
+
+def centered_window_min(values, n):
+    """Минимум в центрированном окне 2*n+1 (как rolling(2*n+1, center=True, min_periods=n+1).min())."""
+    return _centered_window_extreme(values, n, np.fmin, np.inf)
+
+def swing_point_indices(high, low, n):
+    """
+    Позиции свингов по массивам high/low: (индексы swing high, индексы swing low).
+    Та же логика, что в find_swing_points, но без DataFrame - подходит для длинной истории.
+    """
+    high = np.ascontiguousarray(high, dtype=np.float64)
+    low = np.ascontiguousarray(low, dtype=np.float64)
+    return np.flatnonzero(high == centered_window_max(high, n)), np.flatnonzero(low == centered_window_min(low, n))
+
+def confirmed_swing_events(high, low, n):
+    """
+    Свинги в порядке их подтверждения (как их выдает SwingTracker при подаче свечей по одной).
+    Возвращает массивы (индекс подтверждающей свечи, индекс свечи свинга, тип: +1 high / -1 low, цена);
+    при одновременном подтверждении high идет раньше low. Неподтвержденные последние n свечей не входят.
+    """
+    high = np.ascontiguousarray(high, dtype=np.float64)
+    low = np.ascontiguousarray(low, dtype=np.float64)
+    high_indices, low_indices = swing_point_indices(high, low, n)
+    high_indices = high_indices[high_indices < len(high) - n]
+    low_indices = low_indices[low_indices < len(low) - n]
+    bar_indices = np.concatenate([high_indices, low_indices])
+    kinds = np.concatenate([np.ones(len(high_indices), dtype=np.int8), -np.ones(len(low_indices), dtype=np.int8)])
+    prices = np.concatenate([high[high_indices], low[low_indices]])
+    order = np.lexsort((-kinds, bar_indices))
+    bar_indices, kinds, prices = bar_indices[order], kinds[order], prices[order]
+    return bar_indices + n, bar_indices, kinds, prices
+
+def _rolling_extremes(data, n, symbol=None, timeframe=None):
+    """
+    Максимум high и минимум low в центрированном окне 2*n+1 (min_periods=n+1) в виде numpy-массивов.
+    Результат общий для свингов и фракталов с одинаковым n.
+    """
+    key = ('extremes', n) + _bars_key(data, symbol, timeframe)
+    result = _cache_get(key)
+    if result is None:
+        result = (centered_window_max(data['high'].to_numpy(), n), centered_window_min(data['low'].to_numpy(), n))
+        _cache_put(key, result)
+    return result
+
+def _extreme_masks(data, n, symbol=None, timeframe=None):
+    """Маски свечей, у которых high - максимум окна и low - минимум окна."""
+    rolling_max, rolling_min = _rolling_extremes(data, n, symbol, timeframe)
+    return data['high'].to_numpy() == rolling_max, data['low'].to_numpy() == rolling_min
+
+def find_swing_points(data, n=5, symbol=None, timeframe=None):
     """
     Находит точки свингов (High/Low) с использованием rolling window.
     Swing High: High является максимальным в окне из 2*n+1 свечей (n слева, n справа, текущая).
     Swing Low: Low является минимальным в окне из 2*n+1 свечей.
+    Результат кэшируется по набору свечей (symbol/timeframe уточняют ключ); возвращаемые Series не изменяйте.
     """
-    data = data.copy() # Создаем копию, чтобы не изменять исходный DataFrame
+    if data.empty:
+        return data['high'], data['low']
+    key = ('swings', n) + _bars_key(data, symbol, timeframe)
+    result = _cache_get(key)
+    if result is None:
+        is_swing_high, is_swing_low = _extreme_masks(data, n, symbol, timeframe)
+        # Возвращаем Series со значениями high/low в точках свингов
+        result = (data['high'][is_swing_high], data['low'][is_swing_low])
+        _cache_put(key, result)
+    return result
 
-    # Рассчитываем максимум и минимум в скользящем окне
-    # center=True гарантирует, что окно центрировано на текущей свече
-    # min_periods=n+1 требует, чтобы было достаточно данных по краям
-    window_size = 2 * n + 1
-    data['rolling_max'] = data['high'].rolling(window=window_size, center=True, min_periods=n + 1).max()
-    data['rolling_min'] = data['low'].rolling(window=window_size, center=True, min_periods=n + 1).min()
+class SwingTracker:
+    """
+    Инкрементальный поиск свингов: свечи подаются по одной (update), стоимость - O(1) на свечу.
+    Максимум/минимум окна 2*n+1 поддерживаются монотонными очередями. Свинг свечи i
+    подтверждается, когда пришли n свечей справа (окно слева обрезается у начала ряда,
+    как min_periods в find_swing_points). Неподтвержденные последние n свечей не считаются свингами.
+    Свинги хранятся в swing_highs/swing_lows как кортежи (индекс свечи, timestamp, цена).
+    """
+
+    def __init__(self, n=5, max_swings=None):
+        self.n = n
+        self.bar_count = 0 # Сколько свечей обработано
+        self.last_timestamp = None # timestamp последней обработанной свечи
+        self.swing_highs = deque(maxlen=max_swings)
+        self.swing_lows = deque(maxlen=max_swings)
+        self._window_max = deque() # (индекс, high) с убывающими high
+        self._window_min = deque() # (индекс, low) с возрастающими low
+        self._candidates = deque(maxlen=n + 1) # Последние n+1 свечей (индекс, timestamp, high, low)
+
+    def update(self, high, low, timestamp=None):
+        """
+        Добавляет закрытую свечу. Возвращает (swing_high, swing_low) подтвержденной этим баром
+        свечи (кортежи как в swing_highs/swing_lows или None).
+        """
+        index = self.bar_count
+        self.bar_count += 1
+        self.last_timestamp = timestamp
+
+        while self._window_max and self._window_max[-1][1] < high:
+            self._window_max.pop()
+        self._window_max.append((index, high))
+        while self._window_min and self._window_min[-1][1] > low:
+            self._window_min.pop()
+        self._window_min.append((index, low))
+        # Окно свечи-кандидата: [index - 2n, index]
+        window_start = index - 2 * self.n
+        if self._window_max[0][0] < window_start:
+            self._window_max.popleft()
+        if self._window_min[0][0] < window_start:
+            self._window_min.popleft()
 
-    # Точка является Swing High, если ее high равен максимуму в окне
-    data['is_swing_high'] = data['high'] == data['rolling_max']
-    # Точка является Swing Low, если ее low равен минимуму в окне
-    data['is_swing_low'] = data['low'] == data['rolling_min']
+        self._candidates.append((index, timestamp, high, low))
+        if len(self._candidates) <= self.n:
+            return None, None # Для первой свечи еще нет n свечей справа
 
-    # Выбираем только те строки, где есть свинг
-    swing_highs = data[data['is_swing_high']]
-    swing_lows = data[data['is_swing_low']]
+        candidate_index, candidate_timestamp, candidate_high, candidate_low = self._candidates[0]
+        swing_high = swing_low = None
+        if candidate_high == self._window_max[0][1]:
+            swing_high = (candidate_index, candidate_timestamp, candidate_high)
+            self.swing_highs.append(swing_high)
+        if candidate_low == self._window_min[0][1]:
+            swing_low = (candidate_index, candidate_timestamp, candidate_low)
+            self.swing_lows.append(swing_low)
+        return swing_high, swing_low
 
-    # Возвращаем Series со значениями high/low в точках свингов
-    return swing_highs['high'], swing_lows['low']
+    def update_from_dataframe(self, data):
+        """
+        Подает свечи DataFrame (колонки high, low, timestamp), которые новее уже обработанных.
+        Последняя свеча DataFrame должна быть закрытой. Возвращает количество добавленных свечей.
+        """
+        if data is None or data.empty:
+            return 0
+        if self.last_timestamp is not None:
+            data = data[data['timestamp'] > self.last_timestamp]
+        for timestamp, high, low in zip(data['timestamp'], data['high'].to_numpy(), data['low'].to_numpy()):
+            self.update(high, low, timestamp)
+        return len(data)
 
+    def to_series(self):
+        """Свинги в формате find_swing_points: (Series high, Series low), индекс - номер свечи."""
+        highs = pd.Series([price for _, _, price in self.swing_highs],
+                          index=[index for index, _, _ in self.swing_highs], dtype=float, name='high')
+        lows = pd.Series([price for _, _, price in self.swing_lows],
+                         index=[index for index, _, _ in self.swing_lows], dtype=float, name='low')
+        return highs, lows
 
-def determine_context(h4_data, h1_data):
+
+def determine_context(h4_data, h1_data, symbol=None):
     """
     Определяет рыночный контекст (Бычий/Медвежий) на основе H1 структуры.
     (Упрощенная логика - требует доработки для учета H4 и слома структуры)
     """
     print("Определение рыночного контекста...")
     # Получаем точки свингов для H1
-    h1_swing_highs, h1_swing_lows = find_swing_points(h1_data, n=config.SWING_POINTS_LOOKBACK_H1)
+    h1_swing_highs, h1_swing_lows = find_swing_points(
+        h1_data, n=config.SWING_POINTS_LOOKBACK_H1, symbol=symbol, timeframe=config.TIMEFRAME_CONTEXT_H1
+    )
 
     # Пример очень упрощенной логики: проверяем последние 2 свинга на H1
     last_h1_lows = h1_swing_lows.dropna().tail(2)
@@ -79,28 +286,246 @@ def determine_context(h4_data, h1_data):
         print("Контекст не определен (боковик или недостаточные данные).")
         return None
 
-def find_h1_fractals(h1_data, n=config.FRACTAL_LOOKBACK_H1):
+def stack_bars(frames, count=None):
+    """
+    Складывает свечи нескольких символов в 2-D массивы (символы x свечи) для determine_context_batch.
+    frames - {symbol: DataFrame}. Ряды выравниваются по последней свече, недостающие слева - NaN.
+    Возвращает (symbols, highs, lows).
+    """
+    symbols = [symbol for symbol, df in frames.items() if df is not None and not df.empty]
+    width = max((len(frames[symbol]) for symbol in symbols), default=0)
+    if count is not None:
+        width = min(width, count)
+    highs = np.full((len(symbols), width), np.nan)
+    lows = np.full((len(symbols), width), np.nan)
+    for row, symbol in enumerate(symbols):
+        df = frames[symbol]
+        length = min(len(df), width)
+        if length:
+            highs[row, width - length:] = df['high'].to_numpy()[-length:]
+            lows[row, width - length:] = df['low'].to_numpy()[-length:]
+    return symbols, highs, lows
+
+def _last_two_swings(values, mask):
+    """Значения двух последних свингов в каждой строке: (последний, предпоследний, есть ли оба)."""
+    rows = np.arange(values.shape[0])
+    width = values.shape[1]
+    last = width - 1 - mask[:, ::-1].argmax(axis=1)
+    has_last = mask[rows, last]
+    mask = mask.copy()
+    mask[rows, last] = False
+    previous = width - 1 - mask[:, ::-1].argmax(axis=1)
+    has_both = has_last & mask[rows, previous]
+    return values[rows, last], values[rows, previous], has_both
+
+def _context_labels(highs, lows, n):
+    """Контекст по двум последним свингам для каждой строки (логика determine_context)."""
+    swing_high_mask = highs == centered_window_max(highs, n)
+    swing_low_mask = lows == centered_window_min(lows, n)
+    # Ряд короче n+1 свечей (без NaN-дополнения) не дает свингов, как min_periods в rolling
+    too_short = (np.count_nonzero(~np.isnan(highs), axis=1) < n + 1)[:, None]
+    swing_high_mask &= ~too_short
+    swing_low_mask &= ~too_short
+
+    last_high, previous_high, has_highs = _last_two_swings(highs, swing_high_mask)
+    last_low, previous_low, has_lows = _last_two_swings(lows, swing_low_mask)
+    enough = has_highs & has_lows
+    bullish = enough & (last_high > previous_high) & (last_low > previous_low)
+    bearish = enough & ~bullish & (last_high < previous_high) & (last_low < previous_low)
+
+    labels = np.full(highs.shape[0], None, dtype=object)
+    labels[bullish] = "BULLISH"
+    labels[bearish] = "BEARISH"
+    return labels
+
+def determine_context_batch(highs, lows, n=config.SWING_POINTS_LOOKBACK_H1, processes=None, chunk_size=256):
+    """
+    determine_context для многих символов сразу: highs/lows - 2-D массивы (символы x свечи),
+    например из stack_bars. Возвращает список меток "BULLISH"/"BEARISH"/None по строкам.
+    processes > 1 распределяет блоки по chunk_size строк по пулу процессов (имеет смысл для больших вселенных).
+    """
+    highs = np.asarray(highs, dtype=np.float64)
+    lows = np.asarray(lows, dtype=np.float64)
+    if highs.ndim != 2 or highs.shape != lows.shape:
+        print(f"Ошибка: Ожидаются 2-D массивы high/low одинаковой формы, получены {highs.shape} и {lows.shape}.")
+        return []
+    if highs.shape[0] == 0:
+        return []
+
+    if not processes or processes <= 1 or highs.shape[0] <= chunk_size:
+        return list(_context_labels(highs, lows, n))
+
+    starts = range(0, highs.shape[0], chunk_size)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        chunks = executor.map(
+            _context_labels,
+            [highs[start:start + chunk_size] for start in starts],
+            [lows[start:start + chunk_size] for start in starts],
+            [n] * len(starts),
+        )
+        return [label for chunk in chunks for label in chunk]
+
+def find_h1_fractals(h1_data, n=config.FRACTAL_LOOKBACK_H1, symbol=None, timeframe=None):
     """
     Находит фракталы Билла Вильямса на H1.
     Фрактал вверх: High выше n предыдущих и n следующих свечей.
     Фрактал вниз: Low ниже n предыдущих и n следующих свечей.
+    Результат кэшируется так же, как в find_swing_points; возвращаемые DataFrame не изменяйте.
     """
     print(f"Поиск фракталов H1 (n={n})...")
-    data = h1_data.copy()
-    window_size = 2 * n + 1
-
-    # Используем rolling для поиска локальных максимумов/минимумов
-    data['rolling_max'] = data['high'].rolling(window=window_size, center=True, min_periods=n + 1).max()
-    data['rolling_min'] = data['low'].rolling(window=window_size, center=True, min_periods=n + 1).min()
-
-    # Фрактал вверх: high текущей свечи равен максимуму в окне
-    data['is_fractal_up'] = data['high'] == data['rolling_max']
-    # Фрактал вниз: low текущей свечи равен минимуму в окне
-    data['is_fractal_down'] = data['low'] == data['rolling_min']
-
-    fractal_up_points = data[data['is_fractal_up']]
-    fractal_down_points = data[data['is_fractal_down']]
+    if h1_data.empty:
+        return h1_data, h1_data
+    key = ('fractals', n) + _bars_key(h1_data, symbol, timeframe)
+    result = _cache_get(key)
+    if result is None:
+        # Фрактал вверх/вниз: high/low текущей свечи равен максимуму/минимуму в окне
+        is_fractal_up, is_fractal_down = _extreme_masks(h1_data, n, symbol, timeframe)
+        result = (h1_data[is_fractal_up], h1_data[is_fractal_down])
+        _cache_put(key, result)
+    fractal_up_points, fractal_down_points = result
 
     print(f"Найдено {len(fractal_up_points)} фракталов вверх, {len(fractal_down_points)} фракталов вниз.")
     # Возвращаем DataFrames с фрактальными точками
     return fractal_up_points, fractal_down_points
+
+
+class _MaxSegmentTree:
+    """
+    Дерево отрезков максимумов с добавлением в конец.
+    Находит первую/последнюю позицию >= start со значением больше порога за O(log n).
+    """
+
+    def __init__(self, values=(), capacity=1):
+        values = list(values)
+        self.count = len(values)
+        self._size = 1
+        while self._size < max(self.count, capacity):
+            self._size *= 2
+        self._tree = [float('-inf')] * (2 * self._size)
+        self._tree[self._size:self._size + self.count] = values
+        for node in range(self._size - 1, 0, -1):
+            self._tree[node] = max(self._tree[2 * node], self._tree[2 * node + 1])
+
+    def append(self, value):
+        if self.count == self._size:
+            # Удваиваем емкость и перестраиваем дерево по листьям
+            self.__init__(self._tree[self._size:self._size + self.count], capacity=2 * self._size)
+        node = self._size + self.count
+        self.count += 1
+        self._tree[node] = value
+        node //= 2
+        while node:
+            self._tree[node] = max(self._tree[2 * node], self._tree[2 * node + 1])
+            node //= 2
+
+    def value(self, position):
+        return self._tree[self._size + position]
+
+    def find_first(self, start, threshold):
+        """Наименьшая позиция >= start со значением > threshold или None."""
+        return self._find(1, 0, self._size, start, threshold, from_right=False)
+
+    def find_last(self, start, threshold):
+        """Наибольшая позиция >= start со значением > threshold или None."""
+        return self._find(1, 0, self._size, start, threshold, from_right=True)
+
+    def _find(self, node, low, high, start, threshold, from_right):
+        if high <= start or self._tree[node] <= threshold:
+            return None
+        if high - low == 1:
+            return low
+        middle = (low + high) // 2
+        children = ((2 * node + 1, middle, high), (2 * node, low, middle)) if from_right else \
+                   ((2 * node, low, middle), (2 * node + 1, middle, high))
+        for child, child_low, child_high in children:
+            position = self._find(child, child_low, child_high, start, threshold, from_right)
+            if position is not None:
+                return position
+        return None
+
+
+class FractalIndex:
+    """
+    Постоянный индекс подтвержденных фракталов в порядке времени.
+    Пополняется по мере закрытия свечей (update/update_from_dataframe) или готовыми фракталами
+    (add_fractal_up/add_fractal_down, from_arrays). Запросы для TP выполняются за O(log n):
+    first_up_above - самый ранний фрактал вверх после момента after с high выше цены,
+    last_down_below - самый поздний фрактал вниз после момента after с low ниже цены.
+    """
+
+    def __init__(self, n=config.FRACTAL_LOOKBACK_H1):
+        self.n = n
+        self.tracker = SwingTracker(n, max_swings=1) # Нужен только для подтверждения новых фракталов
+        self._up_times = []
+        self._up_prices = _MaxSegmentTree()
+        self._down_times = []
+        self._down_prices = _MaxSegmentTree() # Хранит -low, чтобы искать минимумы деревом максимумов
+
+    @classmethod
+    def from_arrays(cls, high, low, timestamps, n=config.FRACTAL_LOOKBACK_H1):
+        """
+        Строит индекс по всей истории сразу (swing_point_indices, O(N)).
+        Последние n свечей не считаются подтвержденными; дальнейшие свечи добавлять через update нельзя.
+        """
+        index = cls(n)
+        high = np.asarray(high, dtype=np.float64)
+        low = np.asarray(low, dtype=np.float64)
+        up, down = swing_point_indices(high, low, n)
+        up, down = up[up < len(high) - n], down[down < len(low) - n]
+        index._up_times = [timestamps[i] for i in up]
+        index._up_prices = _MaxSegmentTree(high[up].tolist())
+        index._down_times = [timestamps[i] for i in down]
+        index._down_prices = _MaxSegmentTree((-low[down]).tolist())
+        return index
+
+    @property
+    def up_count(self):
+        return len(self._up_times)
+
+    @property
+    def down_count(self):
+        return len(self._down_times)
+
+    def update(self, high, low, timestamp):
+        """Добавляет закрытую свечу; подтвержденные ею фракталы попадают в индекс."""
+        fractal_up, fractal_down = self.tracker.update(high, low, timestamp)
+        if fractal_up is not None:
+            self.add_fractal_up(fractal_up[1], fractal_up[2])
+        if fractal_down is not None:
+            self.add_fractal_down(fractal_down[1], fractal_down[2])
+
+    def update_from_dataframe(self, data):
+        """Подает закрытые свечи DataFrame (timestamp, high, low), которые новее уже обработанных."""
+        if data is None or data.empty:
+            return 0
+        if self.tracker.last_timestamp is not None:
+            data = data[data['timestamp'] > self.tracker.last_timestamp]
+        for timestamp, high, low in zip(data['timestamp'], data['high'].to_numpy(), data['low'].to_numpy()):
+            self.update(high, low, timestamp)
+        return len(data)
+
+    def add_fractal_up(self, timestamp, price):
+        """Добавляет фрактал вверх (timestamp не раньше уже добавленных)."""
+        self._up_times.append(timestamp)
+        self._up_prices.append(float(price))
+
+    def add_fractal_down(self, timestamp, price):
+        """Добавляет фрактал вниз (timestamp не раньше уже добавленных)."""
+        self._down_times.append(timestamp)
+        self._down_prices.append(-float(price))
+
+    def first_up_above(self, price, after=None):
+        """Самый ранний фрактал вверх с timestamp >= after и high > price: (timestamp, high) или None."""
+        start = 0 if after is None else bisect.bisect_left(self._up_times, after)
+        position = self._up_prices.find_first(start, price)
+        if position is None:
+            return None
+        return self._up_times[position], self._up_prices.value(position)
+
+    def last_down_below(self, price, after=None):
+        """Самый поздний фрактал вниз с timestamp >= after и low < price: (timestamp, low) или None."""
+        start = 0 if after is None else bisect.bisect_left(self._down_times, after)
+        position = self._down_prices.find_last(start, -price)
+        if position is None:
+            return None
+        return self._down_times[position], -self._down_prices.value(position)
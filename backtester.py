@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Бэктест стратегии main_bot на исторических свечах (например, из локального архива).
+
+Повторяет логику run_trading_cycle: контекст H1/H4 (market_structure) -> вход на открытии
+первой свечи азиатской сессии -> SL за последним свингом H1 -> TP на ближайшем фрактале H1,
+одна сделка в день. Свинги и фракталы вычисляются один раз на весь ряд (analysis.confirmed_swing_events)
+и подаются в StructureEngine в момент подтверждения, поэтому прогон идет за один проход по свечам
+без нарезки DataFrame. SL/TP/объем считаются пакетными функциями trading_logic.
+Касание SL и TP внутри одной свечи H1 разрешается по свечам M1 (если переданы), иначе считается SL.
+"""
+
+import time
+import numpy as np
+import pandas as pd
+import config # Импортируем конфигурацию
+import analysis # Свинги и фракталы
+import trading_logic # SL, TP и размер позиции
+import market_structure # Рыночная структура и контекст
+import bar_archive # Загрузка истории из архива
+
+NS_PER_MINUTE = 60 * 1000 * 1000 * 1000
+MINUTES_PER_DAY = 24 * 60
+EXIT_SCAN_CHUNK = 64 # Начальный размер блока свечей при поиске выхода (далее удваивается)
+
+
+def _bars_to_arrays(data):
+    """DataFrame свечей в словарь numpy-массивов; время - int64 наносекунды UTC начала свечи."""
+    return {
+        'time': pd.DatetimeIndex(data['timestamp']).as_unit('ns').asi8,
+        'open': data['open'].to_numpy(dtype=np.float64),
+        'high': data['high'].to_numpy(dtype=np.float64),
+        'low': data['low'].to_numpy(dtype=np.float64),
+        'close': data['close'].to_numpy(dtype=np.float64),
+    }
+
+
+def _minutes_of_day(value):
+    return value.hour * 60 + value.minute
+
+
+class Backtester:
+    """
+    Прогон стратегии на фиксированном наборе свечей H1/H4 (и опционально M1).
+    Свинги кэшируются по (таймфрейм, n), поэтому повторные run() с другими параметрами
+    (перебор параметров) не пересчитывают их.
+    """
+
+    def __init__(self, h1_data, h4_data, m1_data=None):
+        m1_arrays = _bars_to_arrays(m1_data) if m1_data is not None and not m1_data.empty else None
+        self._setup(_bars_to_arrays(h1_data), _bars_to_arrays(h4_data), m1_arrays)
+
+    @classmethod
+    def from_arrays(cls, h1_arrays, h4_arrays, m1_arrays=None):
+        """Создает Backtester из словарей массивов (time, open, high, low, close) без копирования (например, в общей памяти)."""
+        backtester = cls.__new__(cls)
+        backtester._setup(h1_arrays, h4_arrays, m1_arrays)
+        return backtester
+
+    def _setup(self, h1_arrays, h4_arrays, m1_arrays):
+        self.h1 = h1_arrays
+        self.h4 = h4_arrays
+        self.m1 = m1_arrays
+        self.bar_count = len(self.h1['time'])
+
+        h1_close_time = self.h1['time'] + 60 * NS_PER_MINUTE
+        h4_close_time = self.h4['time'] + 240 * NS_PER_MINUTE
+        # Сколько свечей H4 закрыто к закрытию каждой свечи H1
+        self._h4_closed_by_h1 = np.searchsorted(h4_close_time, h1_close_time, side='right')
+        minutes = self.h1['time'] // NS_PER_MINUTE
+        self._minute_of_day = minutes % MINUTES_PER_DAY
+        self._day = minutes // MINUTES_PER_DAY
+        self._swing_events = {} # {(timeframe, n): confirmed_swing_events}
+        self._session_masks = {} # {(начало, конец в минутах): маска свечей окна входа}
+        self._entries = {} # {(n H1, n H4, подтверждение H4, окно): кандидаты входа} - не зависят от SL/TP/риска
+
+    def session_mask(self, session_window=None):
+        """Маска свечей H1, открывающихся в окне входа (start, end) - объекты datetime.time UTC."""
+        start, end = session_window or (config.ASIAN_SESSION_START_UTC, config.ASIAN_SESSION_END_UTC)
+        key = (_minutes_of_day(start), _minutes_of_day(end))
+        if key not in self._session_masks:
+            self._session_masks[key] = (self._minute_of_day >= key[0]) & (self._minute_of_day < key[1])
+        return self._session_masks[key]
+
+    def swing_events(self, timeframe, n):
+        """Подтвержденные свинги таймфрейма ('H1'/'H4') в порядке подтверждения (кэшируются по n)."""
+        key = (timeframe, n)
+        if key not in self._swing_events:
+            bars = self.h1 if timeframe == 'H1' else self.h4
+            self._swing_events[key] = analysis.confirmed_swing_events(bars['high'], bars['low'], n)
+        return self._swing_events[key]
+
+    def run(self, swing_n_h1=config.SWING_POINTS_LOOKBACK_H1, swing_n_h4=config.SWING_POINTS_LOOKBACK_H4,
+            fractal_n=config.FRACTAL_LOOKBACK_H1, sl_offset_points=config.SL_OFFSET_POINTS,
+            risk_percent=config.RISK_PER_TRADE_PERCENT, require_h4_confirmation=config.REQUIRE_H4_CONFIRMATION,
+            history_bars=config.HISTORICAL_DATA_COUNT_H1, balance=config.INITIAL_ACCOUNT_BALANCE,
+            pip_value=config.PIP_VALUE_GER40, session_window=None):
+        """
+        Прогоняет стратегию. Возвращает (DataFrame сделок, dict статистики trade_statistics).
+        Объем рассчитывается от фиксированного balance (без реинвестирования).
+        session_window - (начало, конец) окна входа UTC, по умолчанию азиатская сессия из config.
+        """
+        session_mask = self.session_mask(session_window)
+        entries_key = (swing_n_h1, swing_n_h4, require_h4_confirmation, id(session_mask))
+        if entries_key not in self._entries:
+            self._entries[entries_key] = self._find_entries(swing_n_h1, swing_n_h4, require_h4_confirmation, session_mask)
+        bars, signs = self._entries[entries_key]
+        trades = self._build_trades(bars, signs, swing_n_h1, fractal_n, sl_offset_points,
+                                    risk_percent, history_bars, balance, pip_value)
+        return trades, trade_statistics(trades)
+
+    def _find_entries(self, swing_n_h1, swing_n_h4, require_h4_confirmation, session_mask):
+        """Свечи сессии с определенным контекстом: (индексы свечей H1, направления +1/-1)."""
+        h1_engine = market_structure.StructureEngine(swing_n_h1, 'H1')
+        h4_engine = market_structure.StructureEngine(swing_n_h4, 'H4')
+        h1_confirm, h1_bars, h1_kinds, h1_prices = (a.tolist() for a in self.swing_events('H1', swing_n_h1))
+        h4_confirm, h4_bars, h4_kinds, h4_prices = (a.tolist() for a in self.swing_events('H4', swing_n_h4))
+        h1_close = self.h1['close'].tolist()
+        h4_close = self.h4['close'].tolist()
+        h4_closed_by_h1 = self._h4_closed_by_h1.tolist()
+        session_bar = session_mask.tolist()
+
+        entry_bars, entry_signs = [], []
+        h1_event = h4_event = h4_bar = 0
+        for i in range(self.bar_count):
+            # Решение о входе принимается на открытии свечи по уже закрытым свечам
+            if session_bar[i]:
+                context = market_structure.combine_context(h1_engine.context, h4_engine.context, require_h4_confirmation)
+                if context == "BULLISH":
+                    entry_bars.append(i)
+                    entry_signs.append(1)
+                elif context == "BEARISH":
+                    entry_bars.append(i)
+                    entry_signs.append(-1)
+
+            # Закрытие свечи H1 i: свинги, подтвержденные ею, затем проверка BOS
+            while h1_event < len(h1_confirm) and h1_confirm[h1_event] == i:
+                if h1_kinds[h1_event] > 0:
+                    h1_engine.add_swing_high(h1_prices[h1_event], h1_bars[h1_event])
+                else:
+                    h1_engine.add_swing_low(h1_prices[h1_event], h1_bars[h1_event])
+                h1_event += 1
+            h1_engine.check_break(h1_close[i], i)
+
+            # Свечи H4, закрывшиеся к этому моменту
+            while h4_bar < h4_closed_by_h1[i]:
+                while h4_event < len(h4_confirm) and h4_confirm[h4_event] == h4_bar:
+                    if h4_kinds[h4_event] > 0:
+                        h4_engine.add_swing_high(h4_prices[h4_event], h4_bars[h4_event])
+                    else:
+                        h4_engine.add_swing_low(h4_prices[h4_event], h4_bars[h4_event])
+                    h4_event += 1
+                h4_engine.check_break(h4_close[h4_bar], h4_bar)
+                h4_bar += 1
+        return np.array(entry_bars, dtype=np.int64), np.array(entry_signs, dtype=np.int64)
+
+    def _build_trades(self, bars, signs, swing_n_h1, fractal_n, sl_offset_points,
+                      risk_percent, history_bars, balance, pip_value):
+        """SL/TP/объем для кандидатов, одна сделка в день, поиск выхода."""
+        entry_prices = self.h1['open'][bars]
+
+        # SL: последний свинг H1, подтвержденный до открытия свечи входа (индекс свечи <= i - 1 - n)
+        _, swing_bars, swing_kinds, swing_prices = self.swing_events('H1', swing_n_h1)
+        highs, lows = swing_kinds > 0, swing_kinds < 0
+        sl_prices = trading_logic.get_stop_loss_levels(
+            signs, entry_prices, swing_prices[highs], swing_prices[lows],
+            swing_bars[highs], swing_bars[lows], bars - 1 - swing_n_h1, sl_offset_points
+        )
+        # TP: фракталы в окне последних history_bars свечей, уже подтвержденные к моменту входа
+        _, fractal_bars, fractal_kinds, fractal_prices = self.swing_events('H1', fractal_n)
+        ups, downs = fractal_kinds > 0, fractal_kinds < 0
+        tp_prices = trading_logic.get_take_profit_levels(
+            signs, entry_prices, sl_prices, fractal_prices[ups], fractal_prices[downs],
+            fractal_bars[ups], fractal_bars[downs], after_times=bars - history_bars, before_times=bars - fractal_n
+        )
+        sl_distances = signs * (entry_prices - sl_prices)
+        volumes = trading_logic.calculate_position_size_batch(balance, risk_percent, sl_distances, pip_value)
+
+        # Как в main_bot: без SL или с неположительным расстоянием вход отменяется; одна сделка в день
+        valid = ~np.isnan(sl_prices) & (sl_distances > 0) & (volumes >= 0.01)
+        candidates = np.flatnonzero(valid)
+        _, first_of_day = np.unique(self._day[bars[candidates]], return_index=True)
+        chosen = candidates[first_of_day]
+
+        rows = []
+        for k in chosen.tolist():
+            i, sign = int(bars[k]), int(signs[k])
+            exit_bar, exit_price, reason = self._find_exit(i, sign, sl_prices[k], tp_prices[k])
+            rows.append((i, exit_bar, sign, entry_prices[k], sl_prices[k], tp_prices[k], volumes[k], exit_price, reason))
+        return self._trades_frame(rows, pip_value)
+
+    def _find_exit(self, i, sign, sl_price, tp_price):
+        """Первая свеча начиная с i, где задет SL или TP: (индекс свечи, цена выхода, причина)."""
+        high, low, open_ = self.h1['high'], self.h1['low'], self.h1['open']
+        has_tp = not np.isnan(tp_price)
+        start, chunk = i, EXIT_SCAN_CHUNK
+        while start < self.bar_count:
+            stop = min(start + chunk, self.bar_count)
+            if sign > 0:
+                sl_hit = low[start:stop] <= sl_price
+                tp_hit = high[start:stop] >= tp_price if has_tp else np.zeros(stop - start, dtype=bool)
+            else:
+                sl_hit = high[start:stop] >= sl_price
+                tp_hit = low[start:stop] <= tp_price if has_tp else np.zeros(stop - start, dtype=bool)
+            hit = sl_hit | tp_hit
+            if hit.any():
+                offset = int(hit.argmax())
+                bar = start + offset
+                if sl_hit[offset] and tp_hit[offset]:
+                    reason = self._resolve_intrabar(bar, sign, sl_price, tp_price)
+                else:
+                    reason = 'SL' if sl_hit[offset] else 'TP'
+                if reason == 'TP':
+                    return bar, tp_price, reason
+                # Гэп за SL на открытии свечи (кроме свечи входа) исполняется по цене открытия
+                exit_price = sl_price
+                if bar > i and sign * (open_[bar] - sl_price) < 0:
+                    exit_price = open_[bar]
+                return bar, exit_price, reason
+            start, chunk = stop, chunk * 2
+        return self.bar_count - 1, self.h1['close'][-1], 'OPEN'
+
+    def _resolve_intrabar(self, bar, sign, sl_price, tp_price):
+        """Что задето раньше внутри свечи H1 - по свечам M1; без M1 или в одной M1 - SL (консервативно)."""
+        if self.m1 is None:
+            return 'SL'
+        bar_start = self.h1['time'][bar]
+        first, last = np.searchsorted(self.m1['time'], [bar_start, bar_start + 60 * NS_PER_MINUTE])
+        if first == last:
+            return 'SL'
+        if sign > 0:
+            sl_hit = self.m1['low'][first:last] <= sl_price
+            tp_hit = self.m1['high'][first:last] >= tp_price
+        else:
+            sl_hit = self.m1['high'][first:last] >= sl_price
+            tp_hit = self.m1['low'][first:last] <= tp_price
+        hit = sl_hit | tp_hit
+        if not hit.any():
+            return 'SL'
+        offset = int(hit.argmax())
+        return 'TP' if tp_hit[offset] and not sl_hit[offset] else 'SL'
+
+    def _trades_frame(self, rows, pip_value):
+        columns = ['entry_bar', 'exit_bar', 'sign', 'entry_price', 'stop_loss', 'take_profit', 'volume', 'exit_price', 'exit_reason']
+        trades = pd.DataFrame(rows, columns=columns)
+        times = self.h1['time']
+        trades['entry_time'] = pd.to_datetime(times[trades['entry_bar'].to_numpy(dtype=np.int64)], unit='ns', utc=True)
+        trades['exit_time'] = pd.to_datetime(times[trades['exit_bar'].to_numpy(dtype=np.int64)], unit='ns', utc=True)
+        trades['direction'] = np.where(trades['sign'] > 0, "BUY", "SELL")
+        points = trades['sign'] * (trades['exit_price'] - trades['entry_price'])
+        trades['pnl'] = points * trades['volume'] * pip_value
+        trades['r_multiple'] = points / (trades['entry_price'] - trades['stop_loss']).abs()
+        return trades
+
+
+def trade_statistics(trades):
+    """Статистика сделок: количество, доля прибыльных, PnL, profit factor, максимальная просадка, средний R."""
+    closed = trades[trades['exit_reason'] != 'OPEN'] if not trades.empty else trades
+    pnl = closed['pnl'].to_numpy() if not closed.empty else np.zeros(0)
+    if len(pnl) == 0:
+        return {'trades': 0, 'win_rate': 0.0, 'total_pnl': 0.0, 'average_pnl': 0.0,
+                'profit_factor': 0.0, 'max_drawdown': 0.0, 'average_r': 0.0, 'open_trades': len(trades)}
+    # Просадка по кривой капитала в порядке закрытия сделок
+    equity = np.cumsum(pnl[np.argsort(closed['exit_bar'].to_numpy(), kind='stable')])
+    drawdown = np.maximum.accumulate(np.maximum(equity, 0.0)) - equity
+    gross_profit = pnl[pnl > 0].sum()
+    gross_loss = -pnl[pnl < 0].sum()
+    return {
+        'trades': len(pnl),
+        'win_rate': float((pnl > 0).mean()),
+        'total_pnl': float(pnl.sum()),
+        'average_pnl': float(pnl.mean()),
+        'profit_factor': float(gross_profit / gross_loss) if gross_loss > 0 else float('inf'),
+        'max_drawdown': float(drawdown.max()),
+        'average_r': float(closed['r_multiple'].mean()),
+        'open_trades': len(trades) - len(pnl),
+    }
+
+
+def run_backtest(h1_data, h4_data, m1_data=None, **params):
+    """Одиночный прогон: Backtester(...).run(**params)."""
+    return Backtester(h1_data, h4_data, m1_data).run(**params)
+
+
+if __name__ == "__main__":
+    print(f"Бэктест {config.SYMBOL} по локальному архиву ({config.BAR_ARCHIVE_DIR})...")
+    h1_data = bar_archive.load_bars(config.SYMBOL, config.TIMEFRAME_CONTEXT_H1)
+    h4_data = bar_archive.load_bars(config.SYMBOL, config.TIMEFRAME_CONTEXT_H4)
+    m1_data = bar_archive.load_bars(config.SYMBOL, config.TIMEFRAME_ENTRY)
+    if h1_data.empty or h4_data.empty:
+        print("Ошибка: В архиве нет свечей H1/H4. Загрузите историю через ctrader_api.get_historical_range.")
+    else:
+        print(f"Свечей: H1={len(h1_data)}, H4={len(h4_data)}, M1={len(m1_data)}")
+        started = time.perf_counter()
+        trades, stats = run_backtest(h1_data, h4_data, m1_data)
+        print(f"Прогон занял {time.perf_counter() - started:.2f} сек.")
+        for name, value in stats.items():
+            print(f"  {name}: {value}")
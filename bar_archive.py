@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import os
+import numpy as np
+import pandas as pd
+import config # Импортируем конфигурацию
+
+# Структура записи одной свечи в архиве. timestamp хранится в минутах UTC (как utcTimestampInMinutes)
+BAR_DTYPE = np.dtype([
+    ('timestamp', '<i8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<i8'),
+])
+
+# Таймфреймы короче часа храним по дням, остальные - по месяцам
+DAILY_PARTITION_TIMEFRAMES = ('M1', 'M2', 'M3', 'M4', 'M5', 'M10', 'M15', 'M30')
+
+
+def _series_dir(symbol, timeframe):
+    """Каталог архива для пары (символ, ProtoOATrendbarPeriod)."""
+    return os.path.join(config.BAR_ARCHIVE_DIR, symbol, timeframe.upper())
+
+def _to_minutes(value):
+    """datetime/pandas.Timestamp (naive считается UTC) -> минуты UTC."""
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize('UTC')
+    return int(ts.timestamp()) // 60
+
+def _partition_names(ts_minutes, timeframe):
+    """Имена партиций ('YYYY-MM' или 'YYYY-MM-DD') для массива времени в минутах."""
+    unit = 'D' if timeframe.upper() in DAILY_PARTITION_TIMEFRAMES else 'M'
+    return np.datetime_as_string(ts_minutes.astype('datetime64[m]').astype(f'datetime64[{unit}]'))
+
+def _list_partitions(symbol, timeframe):
+    """Отсортированный по времени список файлов партиций."""
+    series_dir = _series_dir(symbol, timeframe)
+    if not os.path.isdir(series_dir):
+        return []
+    names = sorted(name for name in os.listdir(series_dir) if name.endswith('.npy'))
+    return [os.path.join(series_dir, name) for name in names]
+
+def _read_partition(path, mmap=True):
+    """Читает партицию (по умолчанию через memory-map). Возвращает None при повреждении файла."""
+    try:
+        records = np.load(path, mmap_mode='r' if mmap else None, allow_pickle=False)
+    except (OSError, ValueError) as e:
+        print(f"Предупреждение: Не удалось прочитать партицию архива {path}: {e}")
+        return None
+    if records.dtype != BAR_DTYPE:
+        print(f"Предупреждение: Неожиданный формат партиции архива {path}, пропуск.")
+        return None
+    return records
+
+def frame_to_records(df):
+    """DataFrame (timestamp, open, high, low, close, volume) -> структурированный массив BAR_DTYPE."""
+    timestamps = pd.DatetimeIndex(df['timestamp'])
+    if timestamps.tz is None:
+        timestamps = timestamps.tz_localize('UTC')
+    records = np.empty(len(df), dtype=BAR_DTYPE)
+    records['timestamp'] = timestamps.tz_convert('UTC').tz_localize(None).values.astype('datetime64[m]').astype(np.int64)
+    for column in ('open', 'high', 'low', 'close', 'volume'):
+        records[column] = df[column].to_numpy()
+    return records
+
+def records_to_frame(records):
+    """Структурированный массив BAR_DTYPE -> DataFrame в формате ctrader_api.get_historical_data."""
+    if len(records) == 0:
+        return pd.DataFrame()
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(records['timestamp'] * 60_000_000_000, unit='ns', utc=True),
+        'open': records['open'],
+        'high': records['high'],
+        'low': records['low'],
+        'close': records['close'],
+        'volume': records['volume'],
+    })
+
+def append_bars(symbol, timeframe, df):
+    """
+    Добавляет свечи в архив. Свечи с уже существующим временем перезаписываются
+    (так обновляется незакрытая последняя свеча). Затрагиваются только партиции новых свечей,
+    каждая записывается во временный файл и атомарно подменяется.
+    """
+    if df is None or df.empty:
+        return 0
+    new_records = frame_to_records(df)
+    series_dir = _series_dir(symbol, timeframe)
+    os.makedirs(series_dir, exist_ok=True)
+
+    partition_names = _partition_names(new_records['timestamp'], timeframe)
+    for name in np.unique(partition_names):
+        part_new = new_records[partition_names == name]
+        path = os.path.join(series_dir, f"{name}.npy")
+        existing = _read_partition(path, mmap=False) if os.path.exists(path) else None
+        if existing is not None and len(existing) > 0:
+            # Старые свечи с тем же временем заменяются новыми
+            keep = ~np.isin(existing['timestamp'], part_new['timestamp'])
+            merged = np.concatenate([existing[keep], part_new])
+        else:
+            merged = part_new
+        merged = merged[np.argsort(merged['timestamp'], kind='stable')]
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, merged, allow_pickle=False)
+        os.replace(tmp_path, path)
+    return len(new_records)
+
+def load_records(symbol, timeframe, from_time=None, to_time=None, count=None):
+    """
+    Загружает свечи из архива как структурированный массив BAR_DTYPE за [from_time, to_time).
+    Партиции открываются через memory-map, нужный диапазон выбирается срезом без копирования,
+    копирование происходит один раз при склейке партиций. count ограничивает результат последними свечами.
+    """
+    from_minutes = _to_minutes(from_time) if from_time is not None else None
+    to_minutes = _to_minutes(to_time) if to_time is not None else None
+
+    parts = []
+    total = 0
+    # Идем от новых партиций к старым, чтобы для count не читать лишнее
+    for path in reversed(_list_partitions(symbol, timeframe)):
+        records = _read_partition(path)
+        if records is None or len(records) == 0:
+            continue
+        timestamps = records['timestamp']
+        if from_minutes is not None and timestamps[-1] < from_minutes:
+            break
+        if to_minutes is not None and timestamps[0] >= to_minutes:
+            continue
+        start = 0 if from_minutes is None else np.searchsorted(timestamps, from_minutes, side='left')
+        end = len(records) if to_minutes is None else np.searchsorted(timestamps, to_minutes, side='left')
+        if end > start:
+            parts.append(records[start:end])
+            total += end - start
+        if count is not None and total >= count:
+            break
+
+    if not parts:
+        return np.empty(0, dtype=BAR_DTYPE)
+    parts.reverse()
+    records = np.concatenate(parts) if len(parts) > 1 else np.array(parts[0])
+    if count is not None and len(records) > count:
+        records = records[-count:]
+    return records
+
+def load_bars(symbol, timeframe, from_time=None, to_time=None, count=None):
+    """Загружает свечи из архива в DataFrame того же вида, что возвращает get_historical_data."""
+    return records_to_frame(load_records(symbol, timeframe, from_time, to_time, count))
+
+def last_timestamp(symbol, timeframe):
+    """Время последней свечи в архиве (pandas.Timestamp UTC) или None, если архив пуст."""
+    for path in reversed(_list_partitions(symbol, timeframe)):
+        records = _read_partition(path)
+        if records is not None and len(records) > 0:
+            return pd.Timestamp(int(records['timestamp'][-1]) * 60_000_000_000, unit='ns', tz='UTC')
+    return None
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from collections import deque
+import numpy as np
+import pandas as pd
+import bar_archive # Преобразование свечей между DataFrame и массивами
+
+# Длительность периодов ProtoOATrendbarPeriod в минутах (MN1 - приблизительно)
+TIMEFRAME_MINUTES = {
+    'M1': 1, 'M2': 2, 'M3': 3, 'M4': 4, 'M5': 5, 'M10': 10, 'M15': 15, 'M30': 30,
+    'H1': 60, 'H4': 240, 'H12': 720, 'D1': 1440, 'W1': 10080, 'MN1': 43200,
+}
+DEFAULT_MAX_BARS = 500 # Сколько свечей каждого таймфрейма хранить в памяти
+
+# Индексы полей свечи в списке [start_minutes, open, high, low, close, volume]
+_START, _OPEN, _HIGH, _LOW, _CLOSE, _VOLUME = range(6)
+
+
+class BarBuilder:
+    """
+    Потоково строит OHLCV-свечи нескольких таймфреймов одного символа.
+    Младший таймфрейм обновляется тиками (on_tick) или живыми свечами (on_trendbar),
+    старшие таймфреймы собираются из него. Свечи отдаются в формате get_historical_data.
+    """
+
+    def __init__(self, timeframes, max_bars=DEFAULT_MAX_BARS):
+        self.timeframes = sorted({tf.upper() for tf in timeframes}, key=lambda tf: TIMEFRAME_MINUTES[tf])
+        self.base_timeframe = self.timeframes[0]
+        self._periods = {tf: TIMEFRAME_MINUTES[tf] for tf in self.timeframes}
+        self._offsets = {tf: 0 for tf in self.timeframes} # Сдвиг начала свечей относительно эпохи (по данным брокера)
+        if isinstance(max_bars, dict):
+            self._bars = {tf: deque(maxlen=max_bars.get(tf, DEFAULT_MAX_BARS)) for tf in self.timeframes}
+        else:
+            self._bars = {tf: deque(maxlen=max_bars) for tf in self.timeframes}
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def add_bar_close_listener(self, callback):
+        """Регистрирует callback(timeframe, bar_start), вызываемый при закрытии свечи любого таймфрейма."""
+        self._listeners.append(callback)
+
+    def seed(self, timeframe, df):
+        """Заполняет таймфрейм историческими свечами (DataFrame из get_historical_data)."""
+        tf = timeframe.upper()
+        if df is None or df.empty:
+            return
+        records = bar_archive.frame_to_records(df)
+        period = self._periods[tf]
+        with self._lock:
+            bars = self._bars[tf]
+            bars.clear()
+            for record in records:
+                bars.append([int(record['timestamp']), float(record['open']), float(record['high']),
+                             float(record['low']), float(record['close']), int(record['volume'])])
+            # Запоминаем выравнивание свечей брокера (например, H4 может начинаться не с 00:00 UTC)
+            self._offsets[tf] = bars[-1][_START] % period
+
+    def on_tick(self, timestamp_ms, price, volume=1):
+        """Обновляет свечи тиком (цена bid). volume - вклад тика в объем (по умолчанию число тиков)."""
+        minute = int(timestamp_ms) // 60000
+        with self._lock:
+            closed = self._update(minute, price, price, price, price, volume, replace=False)
+        self._notify(closed)
+
+    def on_trendbar(self, start_minutes, open_price, high, low, close, volume):
+        """Заменяет текущую свечу младшего таймфрейма живой свечей от сервера (с точным объемом)."""
+        with self._lock:
+            closed = self._update(int(start_minutes), open_price, high, low, close, int(volume), replace=True)
+        self._notify(closed)
+
+    def bar_count(self, timeframe):
+        """Количество свечей таймфрейма в памяти."""
+        return len(self._bars[timeframe.upper()])
+
+    def get_dataframe(self, timeframe, count=None):
+        """Последние count свечей таймфрейма в виде DataFrame (timestamp, open, high, low, close, volume)."""
+        tf = timeframe.upper()
+        with self._lock:
+            rows = list(self._bars[tf])
+            if count is not None:
+                rows = rows[-count:]
+            rows = [tuple(row) for row in rows]
+        records = np.array(rows, dtype=bar_archive.BAR_DTYPE)
+        return bar_archive.records_to_frame(records)
+
+    def _bar_start(self, timeframe, minute):
+        period = self._periods[timeframe]
+        return minute - (minute - self._offsets[timeframe]) % period
+
+    def _update(self, minute, open_price, high, low, close, volume, replace):
+        """Обновляет младший таймфрейм и сворачивает изменение в старшие. Возвращает закрытые свечи."""
+        closed = []
+        base_tf = self.base_timeframe
+        base = self._bars[base_tf]
+        start = self._bar_start(base_tf, minute)
+
+        if base and base[-1][_START] > start:
+            return closed # Запоздавшее обновление уже закрытой свечи
+        if base and base[-1][_START] == start:
+            bar = base[-1]
+            if replace:
+                volume_delta = volume - bar[_VOLUME]
+                bar[_HIGH], bar[_LOW], bar[_CLOSE], bar[_VOLUME] = high, low, close, volume
+            else:
+                volume_delta = volume
+                bar[_HIGH] = max(bar[_HIGH], high)
+                bar[_LOW] = min(bar[_LOW], low)
+                bar[_CLOSE] = close
+                bar[_VOLUME] += volume
+        else:
+            if base:
+                closed.append((base_tf, base[-1][_START]))
+            bar = [start, open_price, high, low, close, volume]
+            base.append(bar)
+            volume_delta = volume
+
+        for tf in self.timeframes[1:]:
+            bars = self._bars[tf]
+            tf_start = self._bar_start(tf, minute)
+            if bars and bars[-1][_START] > tf_start:
+                continue
+            if bars and bars[-1][_START] == tf_start:
+                higher = bars[-1]
+                higher[_HIGH] = max(higher[_HIGH], bar[_HIGH])
+                higher[_LOW] = min(higher[_LOW], bar[_LOW])
+                higher[_CLOSE] = bar[_CLOSE]
+                higher[_VOLUME] += volume_delta
+            else:
+                if bars:
+                    closed.append((tf, bars[-1][_START]))
+                bars.append([tf_start, bar[_OPEN], bar[_HIGH], bar[_LOW], bar[_CLOSE], bar[_VOLUME]])
+        return closed
+
+    def _notify(self, closed):
+        """Вызывает слушателей вне блокировки."""
+        for timeframe, start_minutes in closed:
+            bar_start = pd.Timestamp(start_minutes * 60, unit='s', tz='UTC')
+            for callback in self._listeners:
+                try:
+                    callback(timeframe, bar_start)
+                except Exception as e:
+                    print(f"Ошибка в обработчике закрытия свечи {timeframe}: {e}")
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарки горячих путей: разбор ProtoOAGetTrendbarsRes, поиск свингов и фракталов,
+обмен запросами с сервером через ctrader_api.
+
+Работает без сети: свечи GER40 синтетические с фиксированным зерном, запросы идут к локальному
+mock_server. Для каждого замера - время p50/p99, пропускная способность и пиковая память (tracemalloc).
+Результаты сохраняются в JSON и сравниваются с сохраненной базовой линией:
+
+    python benchmarks.py --save benchmarks_baseline.json
+    python benchmarks.py --baseline benchmarks_baseline.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+import config # Импортируем конфигурацию
+import analysis # Свинги и фракталы
+import bar_archive # Преобразование записей свечей в DataFrame
+import ctrader_api # Путь запросов и разбор свечей
+import mock_server # Локальный заменитель API и синтетические свечи
+
+DEFAULT_SIZES = (100, 1000, 10000, 100000, 1000000) # Размеры наборов свечей
+DEFAULT_MAX_SECONDS = 2.0 # Ограничение времени одного замера (повторы прекращаются после него)
+DEFAULT_REPEAT = 50 # Максимум повторов одного замера
+MIN_REPEAT = 3 # Минимум повторов независимо от времени
+DEFAULT_REQUESTS = 20 # Кол-во запросов в замерах обмена с сервером
+REQUEST_BARS = 1000 # Кол-во свечей в замере get_historical_data
+DEFAULT_TOLERANCE = 0.25 # Допустимое ухудшение p50 относительно базовой линии (доля)
+BENCHMARK_SEED = 42
+BENCHMARK_TIMEFRAME = "M1" # 10^6 свечей M1 - около двух лет, время остается после 1970 года
+BENCHMARK_END_MINUTES = 29_000_000 # Фиксированное время последней свечи (минуты UTC), чтобы наборы не зависели от запуска
+_devnull = open(os.devnull, "w")
+
+
+def synthetic_bars(count, timeframe=BENCHMARK_TIMEFRAME):
+    """Синтетические свечи GER40 (BAR_DTYPE) с фиксированным зерном."""
+    return mock_server.synthetic_records(
+        timeframe, count, mock_server.SYMBOL_BASE_PRICES[config.SYMBOL],
+        seed=BENCHMARK_SEED, end_minutes=BENCHMARK_END_MINUTES,
+    )
+
+
+def trendbars_payload(records, timeframe=BENCHMARK_TIMEFRAME):
+    """Сериализованный ProtoOAGetTrendbarsRes для записей свечей."""
+    response = ctrader_api.ProtoOAGetTrendbarsRes(
+        ctidTraderAccountId=1, period=ctrader_api.ProtoOATrendbarPeriod.Value(timeframe),
+        timestamp=BENCHMARK_END_MINUTES * 60000, symbolId=1,
+    )
+    response.trendbar.extend(mock_server.encode_trendbars(records, timeframe))
+    return response.SerializeToString()
+
+
+def _quiet(function):
+    """Оборачивает function, подавляя ее вывод (анализ печатает отчет на каждый вызов)."""
+    def wrapper():
+        with contextlib.redirect_stdout(_devnull):
+            return function()
+    return wrapper
+
+
+def measure(name, size, function, setup=None, items=None, repeat=DEFAULT_REPEAT, max_seconds=DEFAULT_MAX_SECONDS):
+    """
+    Замеряет function(): повторы до repeat или max_seconds (не меньше MIN_REPEAT), затем один прогон под
+    tracemalloc для пиковой памяти. setup() выполняется перед каждым прогоном вне замера.
+    items - сколько элементов обрабатывает прогон (для пропускной способности, по умолчанию size).
+    """
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < repeat and (len(timings) < MIN_REPEAT or time.perf_counter() - started < max_seconds):
+        if setup is not None:
+            setup()
+        run_started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - run_started)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    timings = np.array(timings)
+    p50 = float(np.percentile(timings, 50))
+    return {
+        'name': name,
+        'size': size,
+        'runs': len(timings),
+        'p50_ms': p50 * 1000,
+        'p99_ms': float(np.percentile(timings, 99)) * 1000,
+        'mean_ms': float(timings.mean()) * 1000,
+        'throughput_per_s': (items if items is not None else size) / p50 if p50 > 0 else float('inf'),
+        'peak_memory_mb': peak / (1024 * 1024),
+    }
+
+
+def offline_benchmarks(sizes, repeat, max_seconds):
+    """Разбор свечей и анализ на наборах разного размера."""
+    results = []
+    for size in sizes:
+        records = synthetic_bars(size)
+        payload = trendbars_payload(records)
+        bars = bar_archive.records_to_frame(records)
+        print(f"  {size} свечей (ответ {len(payload) / 1024:.0f} КБ)...")
+
+        def decode():
+            # Полный путь ответа: разбор protobuf и преобразование в DataFrame
+            response = ctrader_api.ProtoOAGetTrendbarsRes()
+            response.ParseFromString(payload)
+            return ctrader_api._decode_trendbars(response)
+
+        results.append(measure('decode_trendbars', size, decode, repeat=repeat, max_seconds=max_seconds))
+        results.append(measure(
+            'find_swing_points', size, _quiet(lambda: analysis.find_swing_points(bars, config.SWING_POINTS_LOOKBACK_H1)),
+            setup=analysis.clear_analysis_cache, repeat=repeat, max_seconds=max_seconds,
+        ))
+        results.append(measure(
+            'find_swing_points_cached', size, _quiet(lambda: analysis.find_swing_points(bars, config.SWING_POINTS_LOOKBACK_H1)),
+            repeat=repeat, max_seconds=max_seconds,
+        ))
+        results.append(measure(
+            'find_h1_fractals', size, _quiet(lambda: analysis.find_h1_fractals(bars, config.FRACTAL_LOOKBACK_H1)),
+            setup=analysis.clear_analysis_cache, repeat=repeat, max_seconds=max_seconds,
+        ))
+    analysis.clear_analysis_cache()
+    return results
+
+
+def request_benchmarks(requests, latency_ms=0.0):
+    """
+    Обмен с локальным mock_server через ctrader_api: последовательные запросы (задержка ответа),
+    пачка одновременных запросов (пропускная способность) и get_historical_data с разбором свечей.
+    """
+    port, listening_port, factory = mock_server.start_in_background(0, latency_ms=latency_ms, seed=BENCHMARK_SEED)
+    saved = (config.API_HOST, config.API_PORT, config.USE_BAR_ARCHIVE)
+    config.API_HOST, config.API_PORT, config.USE_BAR_ARCHIVE = "localhost", port, False # Архив на диске не трогаем
+    results = []
+    try:
+        with contextlib.redirect_stdout(_devnull): # Подробный журнал подключения в отчет не выводим
+            connected = ctrader_api.connect_to_ctrader(max_retries=1, retry_delay=1)
+        if not connected:
+            print("Ошибка: Не удалось подключиться к mock_server, замеры запросов пропущены.")
+            return results
+        account_id = int(config.ACCOUNT_ID)
+        symbols_request = ctrader_api.ProtoOASymbolsListReq(ctidTraderAccountId=account_id)
+
+        results.append(measure(
+            'send_request', 1, lambda: ctrader_api.send_request(symbols_request, "GET_SYMBOLS"),
+            repeat=requests, max_seconds=float('inf'),
+        ))
+
+        def burst():
+            futures = [ctrader_api.send_request_future(symbols_request, "GET_SYMBOLS")[1] for _ in range(requests)]
+            for future in futures:
+                future.result(timeout=60)
+
+        results.append(measure('send_request_burst', requests, burst, repeat=MIN_REPEAT, max_seconds=0.0))
+        results.append(measure(
+            'get_historical_data', REQUEST_BARS,
+            lambda: ctrader_api.get_historical_data(ctrader_api.client, config.SYMBOL, config.TIMEFRAME_CONTEXT_H1,
+                                                    REQUEST_BARS, use_cache=False),
+            repeat=requests, max_seconds=float('inf'),
+        ))
+    finally:
+        with contextlib.redirect_stdout(_devnull):
+            ctrader_api.disconnect_from_ctrader()
+            mock_server.stop_in_background(listening_port, factory)
+        config.API_HOST, config.API_PORT, config.USE_BAR_ARCHIVE = saved
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Сравнивает p50 с базовой линией. Возвращает список строк (имя, размер, было, стало, изменение, регрессия)."""
+    previous = {(item['name'], item['size']): item for item in baseline.get('results', [])}
+    rows = []
+    for item in results:
+        old = previous.get((item['name'], item['size']))
+        if old is None or old['p50_ms'] <= 0:
+            continue
+        change = item['p50_ms'] / old['p50_ms'] - 1
+        rows.append((item['name'], item['size'], old['p50_ms'], item['p50_ms'], change, change > tolerance))
+    return rows
+
+
+def print_results(results):
+    print(f"{'замер':<26}{'размер':>9}{'повт.':>7}{'p50, мс':>12}{'p99, мс':>12}{'в сек.':>14}{'память, МБ':>12}")
+    for item in results:
+        print(f"{item['name']:<26}{item['size']:>9}{item['runs']:>7}{item['p50_ms']:>12.3f}{item['p99_ms']:>12.3f}"
+              f"{item['throughput_per_s']:>14.0f}{item['peak_memory_mb']:>12.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарки разбора свечей, анализа и обмена с API")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Размеры наборов свечей через запятую")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Максимум повторов замера")
+    parser.add_argument("--max-seconds", type=float, default=DEFAULT_MAX_SECONDS, help="Ограничение времени замера (сек)")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="Кол-во запросов к mock_server")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Задержка ответов mock_server (мс)")
+    parser.add_argument("--skip-requests", action="store_true", help="Без замеров обмена с mock_server")
+    parser.add_argument("--save", default=None, help="Сохранить результаты в JSON")
+    parser.add_argument("--baseline", default=None, help="JSON базовой линии для сравнения")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Допустимое ухудшение p50 (доля)")
+    args = parser.parse_args()
+
+    sizes = [int(value) for value in args.sizes.split(",") if value.strip()]
+    print(f"Бенчмарки: свечи {sizes}, до {args.repeat} повторов / {args.max_seconds} сек на замер")
+    results = offline_benchmarks(sizes, args.repeat, args.max_seconds)
+    if not args.skip_requests:
+        print(f"Обмен с mock_server ({args.requests} запросов, задержка {args.latency_ms} мс)...")
+        results.extend(request_benchmarks(args.requests, args.latency_ms))
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({
+                'created': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': results,
+            }, f, indent=2)
+        print(f"Результаты сохранены в {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args.tolerance)
+        print(f"\nСравнение p50 с {args.baseline} (допуск {args.tolerance:.0%}):")
+        for name, size, old, new, change, regression in rows:
+            print(f"  {name:<26}{size:>9}{old:>12.3f} -> {new:>10.3f} мс  {change:+.1%}" + ("  РЕГРЕССИЯ" if regression else ""))
+        if any(row[5] for row in rows):
+            sys.exit(1)
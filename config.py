@@ -8,6 +8,17 @@ import pytz
 CLIENT_ID = "14986_ZLe0gRtRLpgWrBGa7RTSP3hdQoyEjmhl8UI4DAOVWix3GR5R60"
 CLIENT_SECRET = "qdpwxTlxbROhu9ZBDQdhhxh16ckk749XzSAqgyUH9q7V3A7tBu"
 ACCOUNT_ID = "7378494" # Убедитесь, что этот номер счета корректен и связан с API ключами
+ACCESS_TOKEN = "" # OAuth access token с доступом к счету ACCOUNT_ID (обязателен для авторизации счета)
+API_HOST = "live.ctraderapi.com" # Сервер Open API ("localhost" - локальный mock_server.py)
+API_PORT = 5035
+
+# --- Переподключение ---
+USE_RECONNECT_SUPERVISOR = True # Фоновый поток переподключается сразу после разрыва и повторяет прерванные запросы чтения
+RECONNECT_BACKOFF_INITIAL_SECONDS = 1.0 # Задержка перед второй попыткой (первая - сразу), далее удваивается
+RECONNECT_BACKOFF_MAX_SECONDS = 60.0 # Максимальная задержка между попытками
+RECONNECT_BACKOFF_JITTER = 0.5 # Доля задержки, случайно вычитаемая из нее (разносит попытки во времени)
+RECONNECT_CONNECT_TIMEOUT_SECONDS = 15 # Ожидание TCP соединения в одной попытке супервизора
+RECONNECT_WAIT_SECONDS = 30 # Сколько операция ждет восстановления соединения супервизором
 
 # --- Торговые параметры ---
 SYMBOL = "GER40" # Или точное название символа в вашем брокере
@@ -21,6 +32,10 @@ PIP_VALUE_GER40 = 1.0 # Стоимость пункта для GER40 (уточн
 SWING_POINTS_LOOKBACK_H4 = 3 # n для find_swing_points на H4
 SWING_POINTS_LOOKBACK_H1 = 5 # n для find_swing_points на H1
 FRACTAL_LOOKBACK_H1 = 2      # n для find_h1_fractals
+USE_FRACTAL_INDEX = True     # TP по постоянному индексу подтвержденных фракталов (analysis.FractalIndex)
+ANALYSIS_CACHE_SIZE = 32     # Сколько результатов анализа (свинги, фракталы, экстремумы окон) хранить в LRU-кэше
+USE_MARKET_STRUCTURE = True  # Контекст из потоковой структуры H1/H4 (HH/HL/LH/LL и BOS) вместо determine_context
+REQUIRE_H4_CONFIRMATION = True # Контекст H4 должен совпадать с H1 (False - H4 только запрещает противоположное направление)
 SL_OFFSET_POINTS = 2.0       # Отступ для SL в пунктах (для GER40 1 пункт = 1.0)
 
 # --- Временные параметры ---
@@ -28,11 +43,27 @@ ASIAN_SESSION_START_UTC = dt_time(0, 0) # Начало азиатской сес
 ASIAN_SESSION_END_UTC = dt_time(1, 0)   # Конец первого часа азиатской сессии UTC (01:00 UTC)
 UTC = pytz.utc
 CHECK_INTERVAL_SECONDS = 60 * 5 # Интервал проверки в секундах (5 минут)
+USE_EVENT_SCHEDULER = True # Будить цикл по закрытию H1, границам окна входа и событиям данных вместо CHECK_INTERVAL_SECONDS
+SCHEDULER_BAR_CLOSE_DELAY_SECONDS = 2 # Задержка после закрытия свечи H1 перед плановым циклом
+
+# --- Отправка ордеров ---
+USE_ARMED_ORDERS = True # Ордера по заранее подготовленным шаблонам, отправка сразу в сокет, итог по событиям исполнения
+ORDER_ARM_LEAD_MINUTES = 10 # За сколько минут до окна входа готовить шаблоны ордеров
+ORDER_FILL_TIMEOUT_SECONDS = 10 # Ожидание события исполнения ордера
 
 # --- Параметры получения данных ---
 HISTORICAL_DATA_COUNT_H4 = 100 # Кол-во свечей H4 для анализа
 HISTORICAL_DATA_COUNT_H1 = 150 # Кол-во свечей H1 для анализа
 HISTORICAL_DATA_COUNT_ENTRY = 5 # Кол-во свечей M1/H1 для текущей цены
+USE_SPOT_SUBSCRIPTION = True # Текущая цена из подписки ProtoOASpotEvent вместо запроса свечи M1
+USE_LIVE_BARS = True # Строить свечи M1/H1/H4 локально из живых котировок вместо запросов каждый цикл
+BACKFILL_MAX_IN_FLIGHT = 4 # Кол-во одновременных запросов при загрузке длинной истории
+
+# --- Локальный архив свечей ---
+USE_BAR_ARCHIVE = True # Хранить загруженные свечи на диске и брать их оттуда при старте
+BAR_ARCHIVE_DIR = "bar_archive" # Каталог архива (символ/таймфрейм/партиции .npy)
+SYMBOL_MAP_FILE = "symbol_map.json" # Сохраненные ID символов (переподключение без загрузки списка символов); "" - не сохранять
+SYMBOL_MAP_MAX_AGE_HOURS = 24 # Сохраненная карта старше этого срока загружается заново
 
 # --- Начальные значения (могут не использоваться, если API дает реальные) ---
 INITIAL_ACCOUNT_BALANCE = 10000 # Примерный баланс для расчета, если API недоступен
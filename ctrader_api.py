@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
 
+import json
+import os
+import random
 import time
 from datetime import datetime, timezone
 import pandas as pd
 import config # Импортируем конфигурацию
+import bar_archive # Локальный архив свечей
+import bar_builder # Потоковое построение свечей из котировок
 import numpy as np # Добавлен импорт numpy
 import threading # Для блокировки доступа к pending_requests
+from collections import deque
+import itertools
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 
 # --- Импорт библиотеки cTrader Open API ---
 # Убедитесь, что библиотека установлена: pip install ctrader-open-api-python
@@ -20,6 +28,8 @@ try:
     # Импортируем все модели из OpenApiModelMessages_pb2
     from ctrader_open_api.messages.OpenApiModelMessages_pb2 import *
     # --- КОНЕЦ ИСПРАВЛЕННЫХ ИМПОРТОВ ---
+    from twisted.internet import reactor
+    from twisted.python import threadable
 
 except ImportError as e:
     print(f"Ошибка импорта из ctrader-open-api-python: {e}")
@@ -32,12 +42,228 @@ connected = False
 connection_in_progress = False # Флаг, что идет попытка подключения
 authorized_app = False
 authorized_account = False
-pending_requests = {} # Словарь для отслеживания ответов на запросы {msg_id: {'type': str, 'response': Protobuf | dict, 'processed': bool, 'event': threading.Event}}
-pending_requests_lock = threading.Lock() # Блокировка для безопасного доступа к pending_requests
+pending_requests = {} # Ожидающие ответа запросы {msg_id: _PendingRequest}
+pending_requests_lock = threading.Lock() # Блокировка для обхода/очистки pending_requests (одиночные операции со словарем атомарны)
+_msg_id_counter = itertools.count(1) # Монотонные ID запросов (next() атомарен в CPython)
+_last_sweep_time = 0.0 # time.monotonic() последней очистки просроченных запросов
 symbol_id_map = {} # Кэш для ID символов {symbol_name: symbol_id}
+symbol_map_loaded_at = 0.0 # Время (unix, сек) получения symbol_id_map от API; 0 - карта не загружена
+SYMBOL_MAP_VERSION = 1 # Версия формата файла config.SYMBOL_MAP_FILE
+bar_cache = {} # Кэш свечей {(symbol, timeframe): DataFrame}, последняя свеча может быть незакрытой
+bar_cache_lock = threading.Lock() # Блокировка для безопасного доступа к bar_cache
 connection_event = threading.Event() # Событие для сигнализации об успешном/неуспешном подключении
 auth_app_event = threading.Event() # Событие для сигнализации об авторизации приложения
 auth_acc_event = threading.Event() # Событие для сигнализации об авторизации счета
+spot_prices = {} # Последние котировки {symbol_id: (bid, ask, timestamp_ms)}, кортеж заменяется целиком
+spot_subscriptions = set() # Символы с подпиской на спот-котировки (восстанавливается после переподключения)
+live_bar_builders = {} # Локально строящиеся свечи {symbol_id: bar_builder.BarBuilder}
+live_bar_subscriptions = {} # Символы с живыми свечами {symbol_name: timeframes} (восстанавливаются после переподключения)
+bar_close_listeners = [] # Обработчики закрытия свечей callback(symbol, timeframe, bar_start)
+spot_listeners = [] # Обработчики котировок callback(symbol_id, bid, ask, timestamp_ms), вызываются в потоке реактора
+reactor_thread = None # Поток, в котором работает реактор Twisted
+link_ready = threading.Event() # Соединение установлено и счет авторизован (сбрасывается при разрыве)
+connection_epoch = 0 # Номер успешного подключения; запросы старых подключений повторяются после переподключения
+supervisor_thread = None # Поток переподключения (start_supervisor)
+_supervisor_stop = None # threading.Event остановки текущего супервизора
+_reconnect_needed = threading.Event() # Сигнал супервизору: соединение потеряно
+armed_orders = {} # Шаблоны рыночных ордеров {(symbol, "BUY"/"SELL"): ProtoOANewOrderReq} (arm_market_orders)
+order_tickets = {} # Отправленные ордера, ожидающие исполнения {clientOrderId: OrderTicket}
+_order_counter = itertools.count(1) # Номера clientOrderId в пределах процесса
+
+TRENDBAR_PERIOD_MINUTES = bar_builder.TIMEFRAME_MINUTES # Длительность периодов ProtoOATrendbarPeriod в минутах
+TRENDBAR_RANGE_SAFETY_FACTOR = 3 # Запас диапазона запроса на выходные и пропуски торговли
+TRENDBAR_MIN_LOOKBACK_MS = 5 * 24 * 60 * 60 * 1000 # Минимальный диапазон запроса: выходные с праздником и дневной перерыв
+# Максимальный диапазон одного ProtoOAGetTrendbarsReq (мс) по документации cTrader Open API
+TRENDBAR_MAX_RANGE_MS = {
+    'M1': 302400000, 'M2': 302400000, 'M3': 302400000, 'M4': 302400000, 'M5': 302400000,
+    'M10': 21168000000, 'M15': 21168000000, 'M30': 21168000000, 'H1': 21168000000,
+    'H4': 31622400000, 'H12': 31622400000, 'D1': 31622400000,
+    'W1': 158112000000, 'MN1': 158112000000,
+}
+BACKFILL_MAX_BARS_PER_WINDOW = 4000 # Ограничение числа свечей в одном окне загрузки истории
+
+# Типы сообщений, проверяемые на каждом входящем сообщении, вычисляем один раз
+SPOT_EVENT_PAYLOAD_TYPE = ProtoOASpotEvent().payloadType
+HEARTBEAT_PAYLOAD_TYPE = ProtoHeartbeatEvent().payloadType
+ERROR_RES_PAYLOAD_TYPE = ProtoOAErrorRes().payloadType
+EXECUTION_EVENT_PAYLOAD_TYPE = ProtoOAExecutionEvent().payloadType
+ORDER_ERROR_EVENT_PAYLOAD_TYPE = ProtoOAOrderErrorEvent().payloadType
+REQUEST_SWEEP_INTERVAL_SECONDS = 5 # Как часто удалять из pending_requests просроченные записи
+# Запросы только на чтение: при разрыве не завершаются ошибкой, а повторяются после переподключения
+IDEMPOTENT_REQUEST_TYPES = frozenset(("GET_TRENDBARS", "GET_SYMBOLS", "GET_ACCOUNTS"))
+SUPERVISOR_CHECK_INTERVAL_SECONDS = 5 # Период проверки соединения супервизором без сигнала о разрыве
+PRICE_UNITS = 100000 # Цены и относительные SL/TP в протоколе задаются в 1/100000
+VOLUME_UNITS = 100000 # Объем в протоколе: 1/100000 лота
+MIN_ORDER_VOLUME_UNITS = 1000 # Минимальный объем ордера (0.01 лота)
+ORDER_ID_PREFIX = "bot" # Префикс clientOrderId
+ORDER_UNKNOWN_STATUSES = ("TIMEOUT", "DISCONNECTED") # Исход ордера неизвестен - он мог быть исполнен
+
+
+class _PendingRequest:
+    """
+    Запись ожидающего запроса: тип, future с ответом и крайний срок (time.monotonic()).
+    request - сообщение для повтора после переподключения (только для IDEMPOTENT_REQUEST_TYPES),
+    epoch - connection_epoch подключения, в котором запрос отправлен.
+    """
+    __slots__ = ('request_type', 'future', 'deadline', 'request', 'epoch')
+
+    def __init__(self, request_type, future, deadline, request=None, epoch=0):
+        self.request_type = request_type
+        self.future = future
+        self.deadline = deadline
+        self.request = request
+        self.epoch = epoch
+
+
+def _resolve_request(record, response):
+    """Передает ответ (ProtoMessage или dict с ошибкой) ожидающему; повторные ответы игнорируются."""
+    if not record.future.done():
+        try:
+            record.future.set_result(response)
+        except Exception: # Future мог быть завершен в другом потоке между проверкой и set_result
+            pass
+
+
+class OrderTicket:
+    """
+    Отправленный рыночный ордер. future получает первый итог по ProtoOAExecutionEvent или ответу-ошибке:
+    dict(status, order_id, position_id, price, volume, error). Статусы:
+      FILLED - исполнен полностью; PARTIALLY_FILLED - исполнена часть объема (volume), остаток снят;
+      REJECTED/ERROR - ордер не исполнен;
+      TIMEOUT/DISCONNECTED - исход неизвестен, ордер мог быть исполнен.
+    При неизвестном исходе тикет остается в order_tickets до окончательного события исполнения,
+    которое обновит outcome (последний итог). executed_volume - исполненный объем (лоты) по частичным исполнениям.
+    Отметки времени - time.perf_counter(): создание запроса, передача в поток реактора, принятие и исполнение сервером.
+    """
+    __slots__ = ('client_order_id', 'msg_id', 'symbol', 'direction', 'future', 'outcome', 'executed_volume',
+                 'created_at', 'sent_at', 'accepted_at', 'filled_at')
+
+    def __init__(self, client_order_id, symbol, direction):
+        self.client_order_id = client_order_id
+        self.msg_id = None
+        self.symbol = symbol
+        self.direction = direction
+        self.future = Future()
+        self.outcome = None
+        self.executed_volume = 0.0
+        self.created_at = time.perf_counter()
+        self.sent_at = None
+        self.accepted_at = None
+        self.filled_at = None
+
+
+def _resolve_order_ticket(ticket, status, final=True, **details):
+    """
+    Сообщает итог ордера. final=False - исход неизвестен (TIMEOUT/DISCONNECTED): ожидающий получает итог,
+    но тикет остается в order_tickets, и позднее событие исполнения запишет окончательный итог в outcome.
+    """
+    result = dict(
+        status=status, order_id=details.get('order_id'), position_id=details.get('position_id'),
+        price=details.get('price'), volume=details.get('volume'), error=details.get('error'),
+    )
+    if final:
+        order_tickets.pop(ticket.client_order_id, None)
+    elif ticket.outcome is not None and ticket.outcome['status'] not in ORDER_UNKNOWN_STATUSES:
+        return # Окончательный итог уже получен
+    ticket.outcome = result
+    if ticket.future.done():
+        if final:
+            print(f"Позднее событие по ордеру {ticket.client_order_id}: {status}, OrderID {result['order_id']}, "
+                  f"PositionID {result['position_id']}, объем {result['volume']}")
+        return
+    try:
+        ticket.future.set_result(result)
+    except Exception: # Future мог быть завершен в другом потоке
+        pass
+
+
+# --- Реактор Twisted ---
+
+def ensure_reactor_running():
+    """Запускает реактор Twisted в фоновом потоке (один раз на процесс)."""
+    global reactor_thread
+    if reactor.running or (reactor_thread is not None and reactor_thread.is_alive()):
+        return
+    # Сигналы обрабатывает основной поток, поэтому installSignalHandlers=False
+    reactor_thread = threading.Thread(
+        target=reactor.run, kwargs={'installSignalHandlers': False}, name="twisted-reactor", daemon=True
+    )
+    reactor_thread.start()
+
+def call_in_reactor(function, *args, **kwargs):
+    """Выполняет function в потоке реактора (сразу, если вызов уже из него)."""
+    if threadable.isInIOThread() or not reactor.running:
+        return function(*args, **kwargs)
+    reactor.callFromThread(function, *args, **kwargs)
+
+
+# --- Супервизор соединения ---
+
+def reconnect_delay(attempt):
+    """Задержка перед попыткой attempt + 1: экспоненциальный рост до максимума со случайным уменьшением."""
+    delay = min(config.RECONNECT_BACKOFF_MAX_SECONDS, config.RECONNECT_BACKOFF_INITIAL_SECONDS * 2 ** attempt)
+    return delay * (1 - config.RECONNECT_BACKOFF_JITTER * random.random())
+
+def supervisor_running():
+    """Работает ли супервизор переподключения."""
+    return supervisor_thread is not None and supervisor_thread.is_alive() and not _supervisor_stop.is_set()
+
+def start_supervisor():
+    """Запускает фоновый поток переподключения (один на процесс)."""
+    global supervisor_thread, _supervisor_stop
+    if supervisor_running():
+        return
+    _supervisor_stop = threading.Event() # Свое событие у каждого потока: остановленный поток не продолжит работу
+    supervisor_thread = threading.Thread(
+        target=_supervisor_loop, args=(_supervisor_stop,), name="ctrader-supervisor", daemon=True
+    )
+    supervisor_thread.start()
+
+def stop_supervisor():
+    """Останавливает супервизор (текущая попытка подключения, если идет, завершается сама)."""
+    if _supervisor_stop is not None:
+        _supervisor_stop.set()
+        _reconnect_needed.set() # Будим поток, чтобы он увидел остановку
+
+def _supervisor_loop(stop_event):
+    """
+    Ждет разрыва (сигнал on_disconnected или периодическая проверка) и переподключается:
+    первая попытка сразу, следующие - через reconnect_delay.
+    """
+    while not stop_event.is_set():
+        _reconnect_needed.wait(SUPERVISOR_CHECK_INTERVAL_SECONDS)
+        _reconnect_needed.clear()
+        if stop_event.is_set():
+            break
+        if link_ready.is_set() or client is None:
+            continue # Соединение в порядке или клиент еще не создавался/отключен намеренно
+
+        attempt = 0
+        while not stop_event.is_set() and not link_ready.is_set():
+            if connection_in_progress: # Подключение уже выполняет другой поток
+                stop_event.wait(1)
+                continue
+            print(f"Супервизор: переподключение, попытка #{attempt + 1}...")
+            if connect_to_ctrader(max_retries=1, retry_delay=0, connect_timeout=config.RECONNECT_CONNECT_TIMEOUT_SECONDS):
+                print("Супервизор: соединение восстановлено.")
+                break
+            delay = reconnect_delay(attempt)
+            attempt += 1
+            print(f"Супервизор: не удалось переподключиться, следующая попытка через {delay:.1f} сек.")
+            stop_event.wait(delay)
+
+def _replay_pending_requests():
+    """Повторно отправляет запросы на чтение, оставшиеся без ответа от предыдущего подключения."""
+    now = time.monotonic()
+    with pending_requests_lock:
+        stale = [(msg_id, record) for msg_id, record in list(pending_requests.items())
+                 if record.request is not None and record.epoch < connection_epoch and not record.future.done()]
+    for msg_id, record in stale:
+        record.epoch = connection_epoch
+        call_in_reactor(_send_in_reactor, record.request, record.request_type, msg_id, max(1.0, record.deadline - now))
+    if stale:
+        print(f"Повторно отправлено {len(stale)} запросов, прерванных разрывом соединения.")
+
 
 # --- Вспомогательные функции и коллбэки ---
 
@@ -52,25 +278,36 @@ def on_connected(connection):
 
 def on_disconnected(connection, reason):
     """Коллбэк при разрыве соединения."""
-    global connected, authorized_app, authorized_account, connection_in_progress, symbol_id_map
+    global connected, authorized_app, authorized_account, connection_in_progress
     print(f"--> [CALLBACK] on_disconnected вызван. Причина: {reason}") # Отладка
     print(f"--> Соединение разорвано: {reason}")
     connected = False
     authorized_app = False
     authorized_account = False
     connection_in_progress = False # Сбрасываем флаг прогресса при дисконнекте
-    symbol_id_map = {} # Очищаем кэш символов
+    link_ready.clear()
+    # symbol_id_map сохраняется: ID символов не меняются при переподключении (свежесть проверяет restore_symbol_map)
+    spot_prices.clear() # Котировки устарели, подписки восстановятся после переподключения
+    live_bar_builders.clear() # Локальные свечи пропустят котировки за время разрыва - пересоберем после переподключения
     # Сбрасываем все события ожидания, чтобы запросы не зависли
     connection_event.set() # Сигнализируем (возможно, об ошибке)
     auth_app_event.set()
     auth_acc_event.set()
-    # Очищаем ожидающие запросы, так как они уже не актуальны
+    # Ответов на отправленные запросы уже не будет. При работающем супервизоре запросы на чтение
+    # остаются ожидающими и повторяются после переподключения, остальные завершаются ошибкой
+    replay = supervisor_running()
     with pending_requests_lock:
-        for msg_id, data in list(pending_requests.items()): # Используем list() для безопасного удаления во время итерации
-            if not data['processed']:
-                 data['response'] = {"error": "DISCONNECTED", "description": "Connection lost"}
-                 data['processed'] = True
-                 if 'event' in data: data['event'].set() # Разблокируем ожидающие потоки
+        failed = [(msg_id, record) for msg_id, record in list(pending_requests.items())
+                  if not replay or record.request is None]
+        for msg_id, _ in failed:
+            pending_requests.pop(msg_id, None)
+        kept = len(pending_requests)
+    for _, record in failed:
+        _resolve_request(record, {"error": "DISCONNECTED", "description": "Connection lost"})
+    if replay:
+        if kept:
+            print(f"--> {kept} запросов будут повторены после переподключения.")
+        _reconnect_needed.set()
 
 def on_message_received(connection, message: ProtoMessage):
     """Обрабатывает все входящие сообщения (ответы и события)."""
@@ -81,7 +318,7 @@ def on_message_received(connection, message: ProtoMessage):
     # print(f"--> [CALLBACK] on_message_received. Тип: {payload_type}, ID: {msg_id}") # Очень подробная отладка
 
     # Обработка Heartbeat (игнорируем, но можно логировать)
-    if payload_type == ProtoHeartbeatEvent().payloadType:
+    if payload_type == HEARTBEAT_PAYLOAD_TYPE:
         # print("Heartbeat received")
         # Отправляем ответный Heartbeat
         if client and client.isConnected:
@@ -94,133 +331,299 @@ def on_message_received(connection, message: ProtoMessage):
         return
 
     # Обработка ошибок API
-    if payload_type == ProtoOAErrorRes().payloadType:
+    if payload_type == ERROR_RES_PAYLOAD_TYPE:
         error_res = ProtoOAErrorRes()
         error_res.ParseFromString(message.payload)
         print(f"!! Ошибка API: {error_res.errorCode} - {error_res.description}" + (f" (для запроса ID: {msg_id})" if msg_id else ""))
         # Если это ответ на наш запрос, помечаем его как ошибку
         if msg_id:
-            with pending_requests_lock:
-                if msg_id in pending_requests:
-                    pending_requests[msg_id]['response'] = {"error": error_res.errorCode, "description": error_res.description}
-                    pending_requests[msg_id]['processed'] = True
-                    if 'event' in pending_requests[msg_id]: pending_requests[msg_id]['event'].set()
+            record = pending_requests.get(msg_id)
+            if record is not None:
+                _resolve_request(record, {"error": error_res.errorCode, "description": error_res.description})
         return # Прекращаем обработку этого сообщения
 
-    # Обработка ответов на наши запросы
+    # События исполнения ордеров (первое из них еще и ответ на запрос - обработка ниже продолжается)
+    if payload_type == EXECUTION_EVENT_PAYLOAD_TYPE:
+        _handle_execution_event(message)
+
+    # Обработка ответов на наши запросы (запись удаляет ожидающий поток или очистка просроченных)
     if msg_id:
-        with pending_requests_lock:
-            if msg_id in pending_requests:
-                request_type = pending_requests[msg_id]['type']
-                # print(f"Получен ответ на запрос {request_type} (ID: {msg_id}), тип payload: {payload_type}") # Отладка
-
-                # Сохраняем ответ
-                pending_requests[msg_id]['response'] = message
-                pending_requests[msg_id]['processed'] = True
-
-                # Обработка специфичных ответов для установки флагов и событий
-                if request_type == "APP_AUTH" and payload_type == ProtoOAApplicationAuthRes().payloadType:
-                    authorized_app = True
-                    print("--> Авторизация приложения успешна.")
-                    auth_app_event.set()
-                elif request_type == "ACC_AUTH" and payload_type == ProtoOAAccountAuthRes().payloadType:
-                    authorized_account = True
-                    print(f"--> Авторизация счета {config.ACCOUNT_ID} успешна.")
-                    auth_acc_event.set()
-                # Другие типы ответов просто сохраняются
-
-                # Сигнализируем потоку, ожидавшему этот ответ
-                if 'event' in pending_requests[msg_id]:
-                    # print(f"Сигнализируем событие для запроса {request_type} (ID: {msg_id})") # Отладка
-                    pending_requests[msg_id]['event'].set()
-                return # Ответ обработан
-            # else: # Отладка
-                # print(f"Получен ответ на запрос с ID {msg_id}, но он не найден в pending_requests.")
+        record = pending_requests.get(msg_id)
+        if record is not None:
+            request_type = record.request_type
+            # print(f"Получен ответ на запрос {request_type} (ID: {msg_id}), тип payload: {payload_type}") # Отладка
+
+            # Обработка специфичных ответов для установки флагов и событий
+            if request_type == "APP_AUTH" and payload_type == ProtoOAApplicationAuthRes().payloadType:
+                authorized_app = True
+                print("--> Авторизация приложения успешна.")
+                auth_app_event.set()
+            elif request_type == "ACC_AUTH" and payload_type == ProtoOAAccountAuthRes().payloadType:
+                authorized_account = True
+                print(f"--> Авторизация счета {config.ACCOUNT_ID} успешна.")
+                auth_acc_event.set()
+            # Другие типы ответов просто передаются ожидающему
+
+            _resolve_request(record, message)
+            return # Ответ обработан
+        # else: # Отладка
+            # print(f"Получен ответ на запрос с ID {msg_id}, но он не найден в pending_requests.")
 
     # Если сообщение не было ответом на наш запрос (msg_id пуст или не найден)
     # print(f"Получено событие (не ответ на запрос), тип: {payload_type}") # Отладка
-    # TODO: Добавить обработку событий, если требуется (например, обновление статуса ордера)
-
+    if payload_type == SPOT_EVENT_PAYLOAD_TYPE:
+        _handle_spot_event(message)
+        return
+    # TODO: Добавить обработку остальных событий, если требуется (например, обновление статуса ордера)
 
-def send_request(request_message: Protobuf, request_type: str, timeout=20): # Увеличен таймаут
-    """Отправляет запрос и ожидает ответ."""
-    global client, pending_requests, pending_requests_lock
-    if not client or not client.isConnected:
-        print(f"Ошибка: Клиент не подключен. Невозможно отправить запрос {request_type}.")
-        return None
+def _handle_execution_event(message):
+    """Обновляет OrderTicket по ProtoOAExecutionEvent (сопоставление по clientOrderId)."""
+    event = ProtoOAExecutionEvent()
+    event.ParseFromString(message.payload)
+    if not event.HasField('order') or not event.order.clientOrderId:
+        return
+    ticket = order_tickets.get(event.order.clientOrderId)
+    if ticket is None:
+        return
+    execution_type = event.executionType
+    order = event.order
+    fill = dict(
+        order_id=order.orderId,
+        position_id=event.position.positionId if event.HasField('position') else order.positionId,
+        price=order.executionPrice if order.HasField('executionPrice') else None,
+    )
+    if order.HasField('executedVolume'): # Накопленный исполненный объем ордера
+        ticket.executed_volume = order.executedVolume / VOLUME_UNITS
+    if execution_type == ProtoOAExecutionType.ORDER_ACCEPTED:
+        ticket.accepted_at = time.perf_counter()
+    elif execution_type == ProtoOAExecutionType.ORDER_PARTIAL_FILL:
+        # Остаток еще может исполниться - ждем ORDER_FILLED или снятия остатка
+        print(f"Ордер {ticket.client_order_id} исполнен частично: {ticket.executed_volume} лотов")
+    elif execution_type == ProtoOAExecutionType.ORDER_FILLED:
+        ticket.filled_at = time.perf_counter()
+        _resolve_order_ticket(ticket, "FILLED", volume=ticket.executed_volume or None, **fill)
+    elif execution_type in (ProtoOAExecutionType.ORDER_REJECTED, ProtoOAExecutionType.ORDER_CANCELLED,
+                            ProtoOAExecutionType.ORDER_EXPIRED):
+        error = f"{ProtoOAExecutionType.Name(execution_type)} {event.errorCode}".strip()
+        if ticket.executed_volume > 0:
+            # Остаток снят после частичного исполнения - позиция открыта на меньший объем
+            ticket.filled_at = time.perf_counter()
+            _resolve_order_ticket(ticket, "PARTIALLY_FILLED", volume=ticket.executed_volume, error=error, **fill)
+        else:
+            _resolve_order_ticket(ticket, "REJECTED", order_id=order.orderId, error=error)
 
-    # Генерируем уникальный ID запроса
-    msg_id = f"{int(time.time() * 1000)}_{np.random.randint(1000, 9999)}"
-    request_message.clientMsgId = msg_id
+def _order_response_callback(ticket):
+    """
+    Callback future запроса ордера: ошибки приходят ответом на запрос (ProtoOAErrorRes, ProtoOAOrderErrorEvent,
+    таймаут или разрыв), а исполнение - событиями по clientOrderId (_handle_execution_event).
+    """
+    def callback(future):
+        if future.cancelled():
+            return
+        response = future.result()
+        if isinstance(response, dict):
+            error = response.get('error')
+            if error in ORDER_UNKNOWN_STATUSES:
+                _resolve_order_ticket(ticket, error, final=False, error=f"{error}: {response.get('description')}")
+            else:
+                _resolve_order_ticket(ticket, "ERROR", error=f"{error}: {response.get('description')}")
+        elif response.payloadType == ORDER_ERROR_EVENT_PAYLOAD_TYPE:
+            order_error = ProtoOAOrderErrorEvent()
+            order_error.ParseFromString(response.payload)
+            _resolve_order_ticket(ticket, "REJECTED", order_id=order_error.orderId or None,
+                                  error=f"{order_error.errorCode}: {order_error.description}")
+        elif response.payloadType == ERROR_RES_PAYLOAD_TYPE:
+            error_res = ProtoOAErrorRes()
+            error_res.ParseFromString(response.payload)
+            _resolve_order_ticket(ticket, "ERROR", error=f"{error_res.errorCode}: {error_res.description}")
+    return callback
+
+def _handle_spot_event(message):
+    """Обновляет последнюю котировку символа по ProtoOASpotEvent."""
+    spot_event = ProtoOASpotEvent()
+    spot_event.ParseFromString(message.payload)
+    previous = spot_prices.get(spot_event.symbolId)
+    # Сервер присылает только изменившиеся поля - недостающие берем из предыдущей котировки
+    bid = spot_event.bid / 100000.0 if spot_event.HasField('bid') else (previous[0] if previous else None)
+    ask = spot_event.ask / 100000.0 if spot_event.HasField('ask') else (previous[1] if previous else None)
+    timestamp_ms = spot_event.timestamp if spot_event.HasField('timestamp') else int(time.time() * 1000)
+    # Кортеж заменяется целиком одной операцией, поэтому читатели обходятся без блокировки
+    spot_prices[spot_event.symbolId] = (bid, ask, timestamp_ms)
+    for callback in spot_listeners:
+        try:
+            callback(spot_event.symbolId, bid, ask, timestamp_ms)
+        except Exception as e:
+            print(f"Ошибка в обработчике котировок: {e}")
+
+    # Обновляем локально строящиеся свечи
+    builder = live_bar_builders.get(spot_event.symbolId)
+    if builder is not None:
+        if spot_event.trendbar:
+            for bar in spot_event.trendbar:
+                _feed_live_trendbar(builder, bar, bid)
+        elif spot_event.HasField('bid'):
+            builder.on_tick(timestamp_ms, bid)
+
+def _feed_live_trendbar(builder, bar, bid):
+    """Передает живую свечу из ProtoOASpotEvent в BarBuilder (только младший таймфрейм)."""
+    if ProtoOATrendbarPeriod.Name(bar.period) != builder.base_timeframe or bar.utcTimestampInMinutes <= 0:
+        return
+    price_divisor = 100000.0
+    low_price = bar.low / price_divisor
+    # У живой свечи нет deltaClose - закрытие равно текущему bid
+    close_price = low_price + bar.deltaClose / price_divisor if bar.HasField('deltaClose') else bid
+    if close_price is None:
+        return
+    builder.on_trendbar(
+        bar.utcTimestampInMinutes,
+        low_price + bar.deltaOpen / price_divisor,
+        low_price + bar.deltaHigh / price_divisor,
+        low_price,
+        close_price,
+        bar.volume
+    )
 
-    # Создаем событие для ожидания ответа
-    response_event = threading.Event()
 
-    # Регистрируем запрос перед отправкой
+def sweep_expired_requests(now=None):
+    """Удаляет из pending_requests записи с истекшим сроком, завершая их ошибкой TIMEOUT."""
+    global _last_sweep_time
+    now = time.monotonic() if now is None else now
+    _last_sweep_time = now
     with pending_requests_lock:
-        pending_requests[msg_id] = {'type': request_type, 'response': None, 'processed': False, 'event': response_event}
+        # list() снимает копию атомарно, поэтому регистрация новых запросов не мешает обходу
+        expired = [(msg_id, record) for msg_id, record in list(pending_requests.items()) if record.deadline < now]
+        for msg_id, _ in expired:
+            pending_requests.pop(msg_id, None)
+    for msg_id, record in expired:
+        _resolve_request(record, {"error": "TIMEOUT", "description": f"Timeout waiting for {record.request_type}"})
+    return len(expired)
+
+def send_request_future(request_message: Protobuf, request_type: str, timeout=20, instant=False):
+    """
+    Отправляет запрос, не дожидаясь ответа.
+    Возвращает (msg_id, Future) - future получает ProtoMessage или dict с ошибкой; (None, None) при ошибке отправки.
+    Запись остается в pending_requests до wait_for_response/cancel_request или истечения timeout.
+    instant - запись в сокет сразу, минуя очередь отправки клиента (она отправляется раз в секунду).
+    """
+    if not client or not client.isConnected:
+        print(f"Ошибка: Клиент не подключен. Невозможно отправить запрос {request_type}.")
+        return None, None
+    if not hasattr(request_message, "SerializeToString"):
+        print(f"Ошибка: Попытка отправить не Protobuf объект для запроса {request_type}")
+        return None, None
+
+    now = time.monotonic()
+    if now - _last_sweep_time > REQUEST_SWEEP_INTERVAL_SECONDS:
+        sweep_expired_requests(now)
+
+    # Монотонный ID: уникален в пределах процесса даже при параллельных запросах
+    msg_id = str(next(_msg_id_counter))
+    future = Future()
+    # Регистрируем запрос перед отправкой; запросы на чтение после авторизации можно повторить
+    replayable = request_type in IDEMPOTENT_REQUEST_TYPES and link_ready.is_set()
+    pending_requests[msg_id] = _PendingRequest(
+        request_type, future, now + timeout, request_message if replayable else None, connection_epoch
+    )
 
     try:
         # print(f"Отправка запроса {request_type} (ID: {msg_id})...") # Отладка
-        if hasattr(request_message, "SerializeToString"):
-             client.send(request_message)
+        # Транспорт Twisted не потокобезопасен - отправка всегда выполняется в потоке реактора
+        if instant:
+            call_in_reactor(_send_instant_in_reactor, request_message, request_type, msg_id)
         else:
-             print(f"Ошибка: Попытка отправить не Protobuf объект для запроса {request_type}")
-             with pending_requests_lock:
-                 if msg_id in pending_requests:
-                    del pending_requests[msg_id]
-             return None
+            call_in_reactor(_send_in_reactor, request_message, request_type, msg_id, timeout)
+    except Exception as e:
+        print(f"Ошибка при отправке запроса {request_type} (ID: {msg_id}): {e}")
+        cancel_request(msg_id)
+        return None, None
+
+    return msg_id, future
 
+def _send_in_reactor(request_message, request_type, msg_id, timeout):
+    """Передает запрос клиенту (в потоке реактора); ошибка отправки завершает future запроса."""
+    try:
+        # clientMsgId задается во внешнем ProtoMessage, сервер возвращает его в ответе
+        deferred = client.send(request_message, clientMsgId=msg_id, responseTimeoutInSeconds=timeout)
+        if deferred is not None:
+            deferred.addErrback(lambda failure: None) # Ответ обрабатывается в on_message_received
     except Exception as e:
         print(f"Ошибка при отправке запроса {request_type} (ID: {msg_id}): {e}")
-        with pending_requests_lock:
-            if msg_id in pending_requests:
-                 del pending_requests[msg_id]
+        record = pending_requests.get(msg_id)
+        if record is not None:
+            _resolve_request(record, {"error": "SEND_FAILED", "description": str(e)})
+
+def _send_instant_in_reactor(request_message, request_type, msg_id):
+    """
+    Пишет запрос в сокет сразу (в потоке реактора), минуя очередь TcpProtocol, которая отправляется
+    раз в секунду. Ответ сопоставляется по clientMsgId в on_message_received.
+    """
+    def write(protocol):
+        protocol.send(request_message, instant=True, clientMsgId=msg_id)
+
+    def fail(failure):
+        print(f"Ошибка при отправке запроса {request_type} (ID: {msg_id}): {failure.getErrorMessage()}")
+        record = pending_requests.get(msg_id)
+        if record is not None:
+            _resolve_request(record, {"error": "SEND_FAILED", "description": failure.getErrorMessage()})
+
+    # При установленном соединении whenConnected срабатывает синхронно
+    client.whenConnected(failAfterFailures=1).addCallbacks(write, fail)
+
+def send_request_nowait(request_message: Protobuf, request_type: str, timeout=20):
+    """
+    Отправляет запрос, не дожидаясь ответа.
+    Возвращает msg_id для последующего wait_for_response или None при ошибке отправки.
+    """
+    msg_id, _ = send_request_future(request_message, request_type, timeout)
+    return msg_id
+
+def wait_for_response(msg_id, request_type: str, timeout=20):
+    """Ожидает ответ на запрос, отправленный через send_request_nowait."""
+    record = pending_requests.get(msg_id)
+    if record is None:
+        print(f"Предупреждение: Запрос {request_type} (ID: {msg_id}) не найден в ожидающих.")
         return None
 
     # Ожидание ответа с таймаутом
     # print(f"Ожидание ответа на {request_type} (ID: {msg_id}) с таймаутом {timeout} сек...") # Отладка
-    if response_event.wait(timeout):
-        # print(f"Событие для {request_type} (ID: {msg_id}) сработало.") # Отладка
-        response_data = None
-        processed = False
-        with pending_requests_lock:
-            if msg_id in pending_requests:
-                response_data = pending_requests[msg_id]['response']
-                processed = pending_requests[msg_id]['processed']
-                del pending_requests[msg_id]
-            else:
-                print(f"Предупреждение: Запрос {request_type} (ID: {msg_id}) отсутствует после ожидания.")
-                return None
-
-        if not processed:
-            print(f"Предупреждение: Событие для запроса {request_type} (ID: {msg_id}) сработало, но он не помечен как обработанный.")
-            return None
-        elif isinstance(response_data, dict) and "error" in response_data:
-             print(f"Запрос {request_type} (ID: {msg_id}) завершился с ошибкой: {response_data.get('description', response_data['error'])}")
-             return None
-        # print(f"Успешный ответ на {request_type} (ID: {msg_id}) получен.") # Отладка
-        return response_data
-    else:
-        # Таймаут
+    try:
+        response_data = record.future.result(timeout)
+    except FutureTimeoutError:
         print(f"Ошибка: Таймаут ({timeout} сек) ожидания ответа на запрос {request_type} (ID: {msg_id}).")
-        with pending_requests_lock:
-            if msg_id in pending_requests:
-                # Помечаем как ошибочный, но не удаляем сразу, чтобы избежать гонки с on_message_received
-                pending_requests[msg_id]['response'] = {"error": "TIMEOUT", "description": f"Timeout waiting for {request_type}"}
-                pending_requests[msg_id]['processed'] = True
-                # Не удаляем: del pending_requests[msg_id]
+        response_data = None
+    finally:
+        # Запись больше не нужна: опоздавший ответ будет проигнорирован
+        pending_requests.pop(msg_id, None)
+
+    if isinstance(response_data, dict) and "error" in response_data:
+         print(f"Запрос {request_type} (ID: {msg_id}) завершился с ошибкой: {response_data.get('description', response_data['error'])}")
+         return None
+    # print(f"Успешный ответ на {request_type} (ID: {msg_id}) получен.") # Отладка
+    return response_data
+
+def cancel_request(msg_id):
+    """Удаляет запрос из ожидающих (ответ на него, если придет, будет проигнорирован)."""
+    record = pending_requests.pop(msg_id, None)
+    if record is not None:
+        record.future.cancel()
+
+def send_request(request_message: Protobuf, request_type: str, timeout=20): # Увеличен таймаут
+    """Отправляет запрос и ожидает ответ."""
+    msg_id = send_request_nowait(request_message, request_type, timeout)
+    if msg_id is None:
         return None
+    return wait_for_response(msg_id, request_type, timeout)
 
 
 # --- Реализация функций API ---
 
-def connect_to_ctrader(max_retries=3, retry_delay=5):
+def connect_to_ctrader(max_retries=3, retry_delay=5, connect_timeout=60):
     """
     Подключается к cTrader API, авторизуется и загружает символы.
     Использует события для синхронизации асинхронных операций.
+    connect_timeout - ожидание TCP соединения в одной попытке (сек).
     """
-    global client, connected, authorized_app, authorized_account, symbol_id_map, connection_in_progress
+    global client, connected, authorized_app, authorized_account, symbol_id_map, connection_in_progress, connection_epoch
     global connection_event, auth_app_event, auth_acc_event
 
     if connected and authorized_account:
@@ -235,7 +638,6 @@ def connect_to_ctrader(max_retries=3, retry_delay=5):
     connected = False
     authorized_app = False
     authorized_account = False
-    symbol_id_map = {} # Очищаем кэш символов
 
     # Сбрасываем события перед началом
     connection_event.clear()
@@ -246,12 +648,13 @@ def connect_to_ctrader(max_retries=3, retry_delay=5):
         print(f"\nПопытка подключения #{attempt + 1}/{max_retries}...")
         try:
             # 0. Создание клиента и установка коллбэков (если еще не создан)
+            ensure_reactor_running()
             if client is None:
-                api_host = 'live.ctraderapi.com' # Явно для реального счета
-                api_port = 5035
+                api_host = config.API_HOST
+                api_port = config.API_PORT
                 print(f"Создание клиента для {api_host}:{api_port}...")
-                protocol = TcpProtocol()
-                client = Client(api_host, api_port, protocol)
+                # Client строит соединения через фабрику, поэтому передается класс протокола, а не экземпляр
+                client = Client(api_host, api_port, TcpProtocol)
                 print("Регистрация коллбэков...")
                 client.setConnectedCallback(on_connected)
                 client.setDisconnectedCallback(on_disconnected)
@@ -263,19 +666,19 @@ def connect_to_ctrader(max_retries=3, retry_delay=5):
                 try:
                     print("Запуск сервиса клиента (инициирует подключение)...")
                     connection_event.clear() # Сбрасываем событие перед startService
-                    client.startService()
+                    call_in_reactor(client.startService)
                     print("startService() вызван.")
                     # Ожидаем установления TCP соединения с таймаутом
-                    print("Ожидание TCP соединения (до 60 сек)...")
+                    print(f"Ожидание TCP соединения (до {connect_timeout} сек)...")
                     # --- ИСПРАВЛЕНИЕ: Увеличен таймаут ---
-                    connection_established = connection_event.wait(timeout=60)
+                    connection_established = connection_event.wait(timeout=connect_timeout)
                     # ------------------------------------
                     if not connection_established:
                         print("Ошибка: Таймаут ожидания TCP соединения после startService.")
                         if client:
                              try:
                                  print("Попытка остановить сервис после таймаута соединения...")
-                                 client.stopService()
+                                 call_in_reactor(client.stopService)
                              except Exception as stop_e:
                                  print(f"Ошибка при остановке сервиса: {stop_e}")
                         time.sleep(retry_delay)
@@ -286,7 +689,7 @@ def connect_to_ctrader(max_retries=3, retry_delay=5):
                         if client:
                              try:
                                  print("Попытка остановить сервис...")
-                                 client.stopService()
+                                 call_in_reactor(client.stopService)
                              except Exception as stop_e:
                                  print(f"Ошибка при остановке сервиса: {stop_e}")
                         time.sleep(retry_delay)
@@ -295,7 +698,7 @@ def connect_to_ctrader(max_retries=3, retry_delay=5):
                 except Exception as start_exc:
                     print(f"Ошибка при запуске сервиса: {start_exc}")
                     if client:
-                         try: client.stopService()
+                         try: call_in_reactor(client.stopService)
                          except Exception: pass
                     time.sleep(retry_delay)
                     continue
@@ -303,69 +706,77 @@ def connect_to_ctrader(max_retries=3, retry_delay=5):
                  print("Клиент уже подключен (пропускаем startService).")
 
 
-            # 2. Авторизация приложения
-            print("Авторизация приложения...")
-            auth_app_event.clear() # Сбрасываем событие перед запросом
-            app_auth_req = ProtoOAApplicationAuthReq(clientId=config.CLIENT_ID, clientSecret=config.CLIENT_SECRET)
-            response = send_request(app_auth_req, "APP_AUTH")
-            if not response:
-                print("Ошибка: Не получен ответ на запрос авторизации приложения (возможно, таймаут или ошибка API).")
-                # Не разрываем соединение, но переходим к следующей попытке
-                time.sleep(retry_delay)
-                continue
-            # Ожидаем подтверждения авторизации приложения от коллбэка
-            print("Ожидание подтверждения авторизации приложения (до 10 сек)...")
-            if not auth_app_event.wait(timeout=10):
-                 print("Ошибка: Таймаут ожидания подтверждения авторизации приложения.")
-                 time.sleep(retry_delay)
-                 continue
-            if not authorized_app: # Проверяем флаг на всякий случай
-                 print("Ошибка: Событие авторизации приложения сработало, но флаг 'authorized_app' не установлен.")
-                 time.sleep(retry_delay)
-                 continue
-            print("Авторизация приложения подтверждена.")
-
-            # 3. Авторизация торгового счета
-            print(f"Авторизация счета {config.ACCOUNT_ID}...")
+            # 2. Конвейер авторизации: запросы авторизации приложения, счета и (если кэш символов устарел)
+            # списка символов уходят подряд, не дожидаясь ответов - сервер обрабатывает запросы
+            # соединения по порядку, поэтому авторизация счета выполняется сразу за авторизацией приложения
             try:
                 ctid_trader_account_id = int(config.ACCOUNT_ID)
             except ValueError:
                  print(f"Критическая ошибка: ACCOUNT_ID '{config.ACCOUNT_ID}' в config.py должен быть числом.")
                  if client:
-                     try: client.stopService()
+                     try: call_in_reactor(client.stopService)
                      except Exception: pass
                  connection_in_progress = False
                  return None # Выходим, так как это ошибка конфигурации
 
-            auth_acc_event.clear() # Сбрасываем событие
-            acc_auth_req = ProtoOAAccountAuthReq(ctidTraderAccountId=ctid_trader_account_id)
-            response = send_request(acc_auth_req, "ACC_AUTH")
-            if not response:
-                print("Ошибка: Не получен ответ на запрос авторизации счета.")
+            need_symbols = not restore_symbol_map()
+            print(f"Авторизация приложения и счета {config.ACCOUNT_ID}" + (" и загрузка списка символов..." if need_symbols else " (ID символов из кэша)..."))
+            auth_app_event.clear() # Сбрасываем события перед запросами
+            auth_acc_event.clear()
+            app_msg_id = send_request_nowait(
+                ProtoOAApplicationAuthReq(clientId=config.CLIENT_ID, clientSecret=config.CLIENT_SECRET), "APP_AUTH")
+            acc_msg_id = send_request_nowait(
+                ProtoOAAccountAuthReq(ctidTraderAccountId=ctid_trader_account_id, accessToken=config.ACCESS_TOKEN), "ACC_AUTH")
+            symbols_msg_id = None
+            if need_symbols:
+                symbols_msg_id = send_request_nowait(ProtoOASymbolsListReq(ctidTraderAccountId=ctid_trader_account_id), "GET_SYMBOLS")
+            if app_msg_id is None or acc_msg_id is None or (need_symbols and symbols_msg_id is None):
+                print("Ошибка: Не удалось отправить запросы авторизации.")
+                for msg_id in (app_msg_id, acc_msg_id, symbols_msg_id):
+                    if msg_id is not None:
+                        cancel_request(msg_id)
+                time.sleep(retry_delay)
+                continue
+
+            # Флаги авторизации выставляет on_message_received до передачи ответа ожидающему
+            app_response = wait_for_response(app_msg_id, "APP_AUTH")
+            acc_response = wait_for_response(acc_msg_id, "ACC_AUTH")
+            symbols_response = wait_for_response(symbols_msg_id, "GET_SYMBOLS") if need_symbols else None
+            if not app_response or not authorized_app:
+                print("Ошибка: Авторизация приложения не подтверждена (таймаут или ошибка API).")
+                time.sleep(retry_delay)
+                continue
+            print("Авторизация приложения подтверждена.")
+            if not acc_response or not authorized_account:
+                print("Ошибка: Авторизация счета не подтверждена (таймаут или ошибка API).")
                 time.sleep(retry_delay)
                 continue
-            # Ожидаем подтверждения авторизации счета
-            print("Ожидание подтверждения авторизации счета (до 10 сек)...")
-            if not auth_acc_event.wait(timeout=10):
-                 print("Ошибка: Таймаут ожидания подтверждения авторизации счета.")
-                 time.sleep(retry_delay)
-                 continue
-            if not authorized_account:
-                 print("Ошибка: Событие авторизации счета сработало, но флаг 'authorized_account' не установлен.")
-                 time.sleep(retry_delay)
-                 continue
             print("Авторизация счета подтверждена.")
 
-            # 4. Получаем список символов для кэширования ID (ВАЖНО!)
-            print("Загрузка списка символов для получения ID...")
-            if not load_symbol_ids(client): # Используем новый клиент
-                 print("Ошибка: Не удалось загрузить ID символов.")
-                 # Считаем это критической ошибкой для текущей попытки
-                 time.sleep(retry_delay)
-                 continue # Попробуем снова
+            # 3. ID символов: из конвейера или, если этот запрос не удался, отдельным запросом
+            if need_symbols:
+                symbols_loaded = (symbols_response is not None
+                                  and symbols_response.payloadType == ProtoOASymbolsListRes().payloadType
+                                  and _apply_symbols_response(symbols_response))
+                if not symbols_loaded and not load_symbol_ids(client):
+                    print("Ошибка: Не удалось загрузить ID символов.")
+                    # Считаем это критической ошибкой для текущей попытки
+                    time.sleep(retry_delay)
+                    continue # Попробуем снова
+
+            # 4. Восстанавливаем подписки на спот-котировки (после переподключения)
+            for symbol_name in list(spot_subscriptions):
+                _send_subscribe_spots(symbol_name)
+            for symbol_name, timeframes in list(live_bar_subscriptions.items()):
+                _start_live_bars(symbol_name, timeframes)
 
             # Если все шаги пройдены успешно
             print("\nПодключение, авторизация и загрузка символов успешно завершены.")
+            connection_epoch += 1
+            link_ready.set()
+            _replay_pending_requests() # Запросы, прерванные разрывом, отправляем в новом соединении
+            if config.USE_RECONNECT_SUPERVISOR:
+                start_supervisor()
             connection_in_progress = False # Сбрасываем флаг прогресса
             return client
 
@@ -375,13 +786,12 @@ def connect_to_ctrader(max_retries=3, retry_delay=5):
             import traceback
             traceback.print_exc()
             if client:
-                 try: client.stopService()
+                 try: call_in_reactor(client.stopService)
                  except Exception: pass
             # Сбрасываем флаги
             connected = False
             authorized_app = False
             authorized_account = False
-            symbol_id_map = {}
             # Пауза перед следующей попыткой
             if attempt < max_retries - 1:
                  print(f"Пауза {retry_delay} секунд перед следующей попыткой...")
@@ -391,7 +801,7 @@ def connect_to_ctrader(max_retries=3, retry_delay=5):
     print("="*20 + " Не удалось подключиться после всех попыток. " + "="*20)
     connection_in_progress = False # Сбрасываем флаг прогресса
     if client:
-        try: client.stopService()
+        try: call_in_reactor(client.stopService)
         except Exception: pass
     client = None # Сбрасываем клиента
     return None
@@ -417,26 +827,7 @@ def load_symbol_ids(client_obj, retries=2, delay=3):
          response_msg = send_request(request, "GET_SYMBOLS")
 
          if response_msg and response_msg.payloadType == ProtoOASymbolsListRes().payloadType:
-             symbols_res = ProtoOASymbolsListRes()
-             symbols_res.ParseFromString(response_msg.payload)
-             count = 0
-             new_symbol_map = {}
-             for symbol_data in symbols_res.symbol:
-                 if hasattr(symbol_data, 'symbolName') and hasattr(symbol_data, 'symbolId'):
-                      new_symbol_map[symbol_data.symbolName] = symbol_data.symbolId
-                      count += 1
-                 else:
-                      print("Предупреждение: Получены неполные данные символа.")
-
-             if count > 0:
-                 symbol_id_map = new_symbol_map
-                 print(f"Загружено {count} символов в кэш ID.")
-                 if config.SYMBOL not in symbol_id_map:
-                      print(f"ПРЕДУПРЕЖДЕНИЕ: Целевой символ {config.SYMBOL} не найден в списке символов брокера!")
-                 return True
-             else:
-                 print("Ошибка: Получен пустой список символов от API (возможно, счет не активен или нет доступных символов).")
-                 return False # Пустой список может быть ошибкой
+             return _apply_symbols_response(response_msg)
 
          elif response_msg is None and attempt < retries - 1:
              print(f"Не удалось получить список символов (попытка {attempt + 1}/{retries}). Повтор через {delay} сек...")
@@ -449,6 +840,87 @@ def load_symbol_ids(client_obj, retries=2, delay=3):
               return False
      return False
 
+def _apply_symbols_response(response_msg):
+    """
+    Заполняет symbol_id_map из ProtoOASymbolsListRes и сохраняет карту в config.SYMBOL_MAP_FILE.
+    Возвращает True, если получен непустой список.
+    """
+    global symbol_id_map, symbol_map_loaded_at
+    symbols_res = ProtoOASymbolsListRes()
+    symbols_res.ParseFromString(response_msg.payload)
+    count = 0
+    new_symbol_map = {}
+    for symbol_data in symbols_res.symbol:
+        if hasattr(symbol_data, 'symbolName') and hasattr(symbol_data, 'symbolId'):
+             new_symbol_map[symbol_data.symbolName] = symbol_data.symbolId
+             count += 1
+        else:
+             print("Предупреждение: Получены неполные данные символа.")
+
+    if count > 0:
+        symbol_id_map = new_symbol_map
+        symbol_map_loaded_at = time.time()
+        print(f"Загружено {count} символов в кэш ID.")
+        _save_symbol_map(symbol_id_map, symbol_map_loaded_at)
+        if config.SYMBOL not in symbol_id_map:
+             print(f"ПРЕДУПРЕЖДЕНИЕ: Целевой символ {config.SYMBOL} не найден в списке символов брокера!")
+        return True
+    else:
+        print("Ошибка: Получен пустой список символов от API (возможно, счет не активен или нет доступных символов).")
+        return False # Пустой список может быть ошибкой
+
+def _symbol_map_owner():
+    """Сервер и счет, для которых действительна карта символов."""
+    return {'api_host': config.API_HOST, 'account_id': str(config.ACCOUNT_ID)}
+
+def _save_symbol_map(symbol_map, loaded_at):
+    """Сохраняет карту символов в config.SYMBOL_MAP_FILE (запись через временный файл)."""
+    if not config.SYMBOL_MAP_FILE:
+        return
+    data = dict(_symbol_map_owner(), version=SYMBOL_MAP_VERSION, loaded_at=loaded_at, symbols=symbol_map)
+    tmp_path = config.SYMBOL_MAP_FILE + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, config.SYMBOL_MAP_FILE)
+    except OSError as e:
+        print(f"Предупреждение: Не удалось сохранить карту символов в {config.SYMBOL_MAP_FILE}: {e}")
+
+def _load_symbol_map():
+    """Читает карту символов из config.SYMBOL_MAP_FILE. Возвращает (карта, loaded_at) или (None, 0.0)."""
+    if not config.SYMBOL_MAP_FILE or not os.path.exists(config.SYMBOL_MAP_FILE):
+        return None, 0.0
+    try:
+        with open(config.SYMBOL_MAP_FILE, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Предупреждение: Не удалось прочитать карту символов {config.SYMBOL_MAP_FILE}: {e}")
+        return None, 0.0
+    owner = _symbol_map_owner()
+    if (not isinstance(data, dict) or data.get('version') != SYMBOL_MAP_VERSION
+            or any(data.get(key) != value for key, value in owner.items())
+            or not isinstance(data.get('symbols'), dict) or not data['symbols']):
+        return None, 0.0 # Другой формат, сервер или счет - карта не подходит
+    return {name: int(symbol_id) for name, symbol_id in data['symbols'].items()}, float(data.get('loaded_at', 0.0))
+
+def restore_symbol_map():
+    """
+    Берет ID символов из памяти или config.SYMBOL_MAP_FILE, если карта моложе SYMBOL_MAP_MAX_AGE_HOURS
+    и содержит config.SYMBOL. Возвращает True, если запрашивать список символов не нужно.
+    """
+    global symbol_id_map, symbol_map_loaded_at
+    max_age = config.SYMBOL_MAP_MAX_AGE_HOURS * 3600
+    now = time.time()
+    if symbol_id_map and now - symbol_map_loaded_at < max_age and config.SYMBOL in symbol_id_map:
+        return True
+    stored_map, loaded_at = _load_symbol_map()
+    if stored_map is None or now - loaded_at >= max_age or config.SYMBOL not in stored_map:
+        return False
+    symbol_id_map = stored_map
+    symbol_map_loaded_at = loaded_at
+    print(f"ID {len(stored_map)} символов взяты из {config.SYMBOL_MAP_FILE} (возраст {(now - loaded_at) / 3600:.1f} ч).")
+    return True
+
 def get_symbol_id(symbol_name):
     """Получает ID символа из кэша. Пытается перезагрузить, если кэш пуст."""
     global symbol_id_map, client
@@ -476,6 +948,14 @@ def check_client_status(operation_name="операции"):
      global client, connected, authorized_account
      # Используем client.isConnected как свойство
      if not client or not client.isConnected or not authorized_account:
+          if supervisor_running():
+              # Переподключается супервизор - ждем его, а не подключаемся здесь же
+              print(f"Клиент не готов для выполнения {operation_name}. Ожидание переподключения (до {config.RECONNECT_WAIT_SECONDS} сек)...")
+              _reconnect_needed.set()
+              if link_ready.wait(config.RECONNECT_WAIT_SECONDS):
+                  return True
+              print(f"Соединение не восстановлено. {operation_name.capitalize()} отменена.")
+              return False
           print(f"Клиент не готов для выполнения {operation_name}. Попытка переподключения...")
           new_client = connect_to_ctrader(max_retries=2, retry_delay=3)
           if not new_client:
@@ -485,99 +965,367 @@ def check_client_status(operation_name="операции"):
           return True
      return True
 
-def get_historical_data(client_obj, symbol, timeframe, count):
-    """Получает исторические данные."""
+def _decode_trendbars(trendbars_res):
+    """
+    Преобразует ProtoOAGetTrendbarsRes в DataFrame (timestamp, open, high, low, close, volume).
+    Сырые целые поля собираются в типизированные массивы, цены и время считаются векторно.
+    """
+    bars = trendbars_res.trendbar
+    n = len(bars)
+    if n == 0:
+        return pd.DataFrame()
+
+    # Собираем поля протобуфа в колонки int64 (отсутствующие поля protobuf возвращает как 0)
+    ts_minutes = np.fromiter((bar.utcTimestampInMinutes for bar in bars), dtype=np.int64, count=n)
+    low_raw = np.fromiter((bar.low for bar in bars), dtype=np.int64, count=n)
+    delta_open = np.fromiter((bar.deltaOpen for bar in bars), dtype=np.int64, count=n)
+    delta_high = np.fromiter((bar.deltaHigh for bar in bars), dtype=np.int64, count=n)
+    delta_close = np.fromiter((bar.deltaClose for bar in bars), dtype=np.int64, count=n)
+    volume = np.fromiter((bar.volume for bar in bars), dtype=np.int64, count=n)
+
+    # Отбрасываем свечи без времени
+    valid = ts_minutes > 0
+    if not valid.all():
+        ts_minutes, low_raw, delta_open, delta_high, delta_close, volume = (
+            arr[valid] for arr in (ts_minutes, low_raw, delta_open, delta_high, delta_close, volume)
+        )
+        if len(ts_minutes) == 0:
+            return pd.DataFrame()
+
+    # Сортировка по времени (API обычно уже отдает свечи по возрастанию)
+    if len(ts_minutes) > 1 and (np.diff(ts_minutes) < 0).any():
+        order = np.argsort(ts_minutes, kind='stable')
+        ts_minutes, low_raw, delta_open, delta_high, delta_close, volume = (
+            arr[order] for arr in (ts_minutes, low_raw, delta_open, delta_high, delta_close, volume)
+        )
+
+    price_divisor = 100000.0
+    low_price = low_raw / price_divisor
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(ts_minutes * 60_000_000_000, unit='ns', utc=True),
+        'open': low_price + delta_open / price_divisor,
+        'high': low_price + delta_high / price_divisor,
+        'low': low_price,
+        'close': low_price + delta_close / price_divisor,
+        'volume': volume
+    })
+
+def _build_trendbars_request(timeframe, period_enum, symbol_id, account_id, count, from_timestamp=None):
+    """
+    Создает ProtoOAGetTrendbarsReq до текущего момента.
+    Если from_timestamp (мс) не задан, диапазон рассчитывается по count с запасом на выходные,
+    но не короче TRENDBAR_MIN_LOOKBACK_MS: при малом count (цена по 1-5 свечам M1) узкий диапазон
+    после выходных или перерыва торговли был бы пуст. Сервер возвращает последние count свечей диапазона.
+    """
+    to_timestamp = int(datetime.now(timezone.utc).timestamp() * 1000)
+    if from_timestamp is None:
+        period_ms = TRENDBAR_PERIOD_MINUTES[timeframe.upper()] * 60 * 1000
+        lookback_ms = max(count * period_ms * TRENDBAR_RANGE_SAFETY_FACTOR, TRENDBAR_MIN_LOOKBACK_MS)
+        from_timestamp = to_timestamp - lookback_ms
+
+    return ProtoOAGetTrendbarsReq(
+        ctidTraderAccountId=account_id,
+        period=period_enum,
+        symbolId=symbol_id,
+        count=count,
+        fromTimestamp=int(from_timestamp),
+        toTimestamp=to_timestamp
+    )
+
+def _parse_trendbars_response(symbol, timeframe, response_msg):
+    """
+    Декодирует ответ на ProtoOAGetTrendbarsReq в DataFrame.
+    Возвращает None при ошибке запроса (пустой DataFrame означает, что новых свечей нет).
+    """
+    if response_msg and response_msg.payloadType == ProtoOAGetTrendbarsRes().payloadType:
+        trendbars_res = ProtoOAGetTrendbarsRes()
+        trendbars_res.ParseFromString(response_msg.payload)
+        return _decode_trendbars(trendbars_res)
+    elif response_msg and response_msg.payloadType == ProtoOAErrorRes().payloadType:
+         print(f"API вернуло ошибку при запросе исторических данных для {symbol} {timeframe}.")
+         return None
+    else:
+        print(f"Не удалось получить исторические данные для {symbol} {timeframe}.")
+        return None
+
+def _merge_bars(cached_df, new_df, count):
+    """
+    Объединяет кэшированные свечи с новыми: свечи с совпадающим timestamp
+    (в т.ч. незакрытая последняя) заменяются новыми, оставляются последние count.
+    """
+    if new_df.empty:
+        return cached_df.tail(count).reset_index(drop=True)
+    first_new_ts = new_df['timestamp'].iloc[0]
+    kept = cached_df[cached_df['timestamp'] < first_new_ts]
+    merged = pd.concat([kept, new_df], ignore_index=True)
+    return merged.tail(count).reset_index(drop=True)
+
+def get_historical_data(client_obj, symbol, timeframe, count, use_cache=True):
+    """
+    Получает исторические данные.
+    При use_cache=True хранит свечи по (symbol, timeframe) и запрашивает у API только
+    свечи начиная с последней сохраненной (она обновляется на месте, т.к. может быть незакрытой).
+    Если для символа включены живые свечи (subscribe_live_bars), данные берутся из памяти без запросов.
+    """
+    if use_cache:
+        live_df = get_live_bars(symbol, timeframe, count)
+        if live_df is not None:
+            return live_df
+
     if not check_client_status(f"получения исторических данных для {symbol}"):
         return pd.DataFrame()
 
+    plan = _prepare_historical_request(symbol, timeframe, count, use_cache)
+    if plan is None:
+        return pd.DataFrame()
+    response_msg = send_request(plan['request'], "GET_TRENDBARS")
+    return _complete_historical_request(plan, response_msg)
+
+def _prepare_historical_request(symbol, timeframe, count, use_cache=True):
+    """
+    Готовит запрос свечей с учетом кэша и архива (без ожидания сети).
+    Возвращает план {'request', 'symbol', 'timeframe', 'count', 'cached_df', 'use_cache'} или None при ошибке.
+    """
     try:
         period_enum = ProtoOATrendbarPeriod.Value(timeframe.upper())
     except ValueError:
         print(f"Ошибка: Неверный таймфрейм '{timeframe}'.")
-        return pd.DataFrame()
+        return None
 
     symbol_id = get_symbol_id(symbol)
     if symbol_id is None:
         print(f"Не удалось получить ID для символа {symbol}. Запрос данных отменен.")
-        return pd.DataFrame()
+        return None
 
     try:
          account_id = int(config.ACCOUNT_ID)
     except ValueError:
          print(f"Критическая ошибка: ACCOUNT_ID '{config.ACCOUNT_ID}' некорректен.")
-         return pd.DataFrame()
+         return None
 
-    to_timestamp = int(datetime.now(timezone.utc).timestamp() * 1000)
+    cache_key = (symbol, timeframe.upper())
+    cached_df = None
+    if use_cache:
+        with bar_cache_lock:
+            cached_df = bar_cache.get(cache_key)
+        # Кэш пригоден только если в нем достаточно свечей
+        if cached_df is not None and len(cached_df) < count:
+            cached_df = None
+        # При холодном кэше (например, после перезапуска) берем свечи из локального архива
+        if cached_df is None and config.USE_BAR_ARCHIVE:
+            archived_df = bar_archive.load_bars(symbol, timeframe, count=count)
+            if len(archived_df) >= count:
+                cached_df = archived_df
+        # Разрыв больше допустимого диапазона одного запроса - делаем полный запрос
+        if cached_df is not None:
+            gap_ms = datetime.now(timezone.utc).timestamp() * 1000 - cached_df['timestamp'].iloc[-1].timestamp() * 1000
+            if gap_ms > TRENDBAR_MAX_RANGE_MS[timeframe.upper()]:
+                cached_df = None
+
+    if cached_df is not None:
+        # Запрашиваем только свечи, начиная с последней сохраненной (utcTimestampInMinutes)
+        last_ts_ms = int(cached_df['timestamp'].iloc[-1].timestamp() * 1000)
+        request = _build_trendbars_request(timeframe, period_enum, symbol_id, account_id, count, from_timestamp=last_ts_ms)
+    else:
+        request = _build_trendbars_request(timeframe, period_enum, symbol_id, account_id, count)
+
+    return {
+        'request': request,
+        'symbol': symbol,
+        'timeframe': timeframe,
+        'count': count,
+        'cached_df': cached_df,
+        'use_cache': use_cache,
+    }
+
+def _complete_historical_request(plan, response_msg):
+    """Декодирует ответ по плану _prepare_historical_request, объединяет с кэшем и обновляет кэш/архив."""
+    symbol, timeframe, count = plan['symbol'], plan['timeframe'], plan['count']
+    new_df = _parse_trendbars_response(symbol, timeframe, response_msg)
+    if new_df is None:
+        return pd.DataFrame()
 
-    request = ProtoOAGetTrendbarsReq(
-        ctidTraderAccountId=account_id,
-        period=period_enum,
-        symbolId=symbol_id,
-        count=count,
-        toTimestamp=to_timestamp
-    )
+    cached_df = plan['cached_df']
+    if cached_df is not None:
+        df = _merge_bars(cached_df, new_df, count)
+    else:
+        if new_df.empty:
+            print(f"Получен пустой набор данных для {symbol} {timeframe}.")
+            return new_df
+        df = new_df.reset_index(drop=True)
+
+    if plan['use_cache']:
+        cache_key = (symbol, timeframe.upper())
+        with bar_cache_lock:
+            # Сохраняем не меньше свечей, чем уже было в кэше, чтобы не терять историю для больших count
+            previous = bar_cache.get(cache_key)
+            if previous is None or len(df) >= len(previous):
+                bar_cache[cache_key] = df
+            else:
+                bar_cache[cache_key] = _merge_bars(previous, df, len(previous))
+        if config.USE_BAR_ARCHIVE:
+            _archive_bars(symbol, timeframe, new_df)
+    return df.copy()
 
-    response_msg = send_request(request, "GET_TRENDBARS")
+def _archive_bars(symbol, timeframe, df):
+    """Дописывает свечи в локальный архив; ошибки записи не прерывают работу."""
+    try:
+        bar_archive.append_bars(symbol, timeframe, df)
+    except OSError as e:
+        print(f"Предупреждение: Не удалось записать свечи {symbol} {timeframe} в архив: {e}")
+
+def clear_bar_cache(symbol=None, timeframe=None):
+    """Очищает кэш свечей (полностью или для указанного символа/таймфрейма)."""
+    with bar_cache_lock:
+        if symbol is None:
+            bar_cache.clear()
+            return
+        for key in list(bar_cache.keys()):
+            if key[0] == symbol and (timeframe is None or key[1] == timeframe.upper()):
+                del bar_cache[key]
+
+def _to_utc_ms(value):
+    """Переводит datetime (naive считается UTC) или pandas.Timestamp в миллисекунды UTC."""
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize('UTC')
+    return int(ts.timestamp() * 1000)
+
+def _split_backfill_windows(timeframe, from_ms, to_ms):
+    """Разбивает диапазон [from_ms, to_ms) на окна, которые сервер отдает одним ответом."""
+    timeframe = timeframe.upper()
+    period_ms = TRENDBAR_PERIOD_MINUTES[timeframe] * 60 * 1000
+    window_ms = min(TRENDBAR_MAX_RANGE_MS[timeframe], BACKFILL_MAX_BARS_PER_WINDOW * period_ms)
+    windows = []
+    start = from_ms
+    while start < to_ms:
+        end = min(start + window_ms, to_ms)
+        windows.append((start, end))
+        start = end
+    return windows
+
+def get_historical_range(client_obj, symbol, timeframe, from_time, to_time, max_in_flight=config.BACKFILL_MAX_IN_FLIGHT, timeout=60):
+    """
+    Загружает свечи за диапазон [from_time, to_time).
+    Диапазон режется на окна допустимого для сервера размера, одновременно в полете
+    держится до max_in_flight запросов ProtoOAGetTrendbarsReq. Результаты склеиваются
+    по порядку окон без дубликатов. При ошибке любого окна возвращается пустой DataFrame.
+    """
+    if not check_client_status(f"загрузки истории для {symbol}"):
+        return pd.DataFrame()
 
-    if response_msg and response_msg.payloadType == ProtoOAGetTrendbarsRes().payloadType:
-        trendbars_res = ProtoOAGetTrendbarsRes()
-        trendbars_res.ParseFromString(response_msg.payload)
+    try:
+        period_enum = ProtoOATrendbarPeriod.Value(timeframe.upper())
+    except ValueError:
+        print(f"Ошибка: Неверный таймфрейм '{timeframe}'.")
+        return pd.DataFrame()
 
-        data = []
-        price_divisor = 100000.0
-        for bar in trendbars_res.trendbar:
-            if not hasattr(bar, 'utcTimestampInMinutes') or bar.utcTimestampInMinutes <= 0:
-                continue
-            ts_ms = bar.utcTimestampInMinutes * 60 * 1000
-            dt_utc = datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc)
-
-            low_price = getattr(bar, 'low', 0) / price_divisor
-            delta_open = getattr(bar, 'deltaOpen', 0)
-            delta_high = getattr(bar, 'deltaHigh', 0)
-            delta_close = getattr(bar, 'deltaClose', 0)
-            volume = getattr(bar, 'volume', 0)
-
-            open_price = low_price + delta_open / price_divisor
-            high_price = low_price + delta_high / price_divisor
-            close_price = low_price + delta_close / price_divisor
-
-            data.append({
-                'timestamp': dt_utc,
-                'open': open_price,
-                'high': high_price,
-                'low': low_price,
-                'close': close_price,
-                'volume': volume
-            })
-
-        if not data:
-            print(f"Получен пустой набор данных для {symbol} {timeframe}.")
-            return pd.DataFrame()
+    symbol_id = get_symbol_id(symbol)
+    if symbol_id is None:
+        print(f"Не удалось получить ID для символа {symbol}. Загрузка истории отменена.")
+        return pd.DataFrame()
 
-        df = pd.DataFrame(data)
-        df = df.sort_values('timestamp')
-        return df
-    elif response_msg and response_msg.payloadType == ProtoOAErrorRes().payloadType:
-         print(f"API вернуло ошибку при запросе исторических данных для {symbol} {timeframe}.")
+    try:
+         account_id = int(config.ACCOUNT_ID)
+    except ValueError:
+         print(f"Критическая ошибка: ACCOUNT_ID '{config.ACCOUNT_ID}' некорректен.")
          return pd.DataFrame()
-    else:
-        print(f"Не удалось получить исторические данные для {symbol} {timeframe}.")
+
+    from_ms = _to_utc_ms(from_time)
+    to_ms = _to_utc_ms(to_time)
+    if from_ms >= to_ms:
+        print(f"Ошибка: Пустой диапазон загрузки истории ({from_time} - {to_time}).")
+        return pd.DataFrame()
+
+    windows = _split_backfill_windows(timeframe, from_ms, to_ms)
+    max_in_flight = max(1, max_in_flight)
+    print(f"Загрузка истории {symbol} {timeframe}: {len(windows)} окон, до {max_in_flight} запросов одновременно...")
+
+    def make_request(window):
+        # toTimestamp включителен на стороне сервера, поэтому берем полуинтервал [start, end)
+        return ProtoOAGetTrendbarsReq(
+            ctidTraderAccountId=account_id,
+            period=period_enum,
+            symbolId=symbol_id,
+            fromTimestamp=window[0],
+            toTimestamp=window[1] - 1
+        )
+
+    frames = [None] * len(windows)
+    in_flight = deque() # (индекс окна, msg_id) в порядке отправки
+    next_window = 0
+    failed = False
+
+    while (next_window < len(windows) or in_flight) and not failed:
+        # Дозаполняем конвейер запросов
+        while next_window < len(windows) and len(in_flight) < max_in_flight:
+            msg_id = send_request_nowait(make_request(windows[next_window]), "GET_TRENDBARS", timeout)
+            if msg_id is None:
+                failed = True
+                break
+            in_flight.append((next_window, msg_id))
+            next_window += 1
+        if failed or not in_flight:
+            break
+
+        # Ожидаем самое старое окно, остальные тем временем продолжают загружаться
+        window_index, msg_id = in_flight.popleft()
+        response_msg = wait_for_response(msg_id, "GET_TRENDBARS", timeout)
+        if response_msg is None:
+            # Одна повторная попытка для окна синхронно
+            print(f"Повтор запроса окна {window_index + 1}/{len(windows)}...")
+            response_msg = send_request(make_request(windows[window_index]), "GET_TRENDBARS", timeout)
+
+        if response_msg and response_msg.payloadType == ProtoOAGetTrendbarsRes().payloadType:
+            trendbars_res = ProtoOAGetTrendbarsRes()
+            trendbars_res.ParseFromString(response_msg.payload)
+            frames[window_index] = _decode_trendbars(trendbars_res)
+        else:
+            print(f"Ошибка: Не удалось загрузить окно {window_index + 1}/{len(windows)} для {symbol} {timeframe}.")
+            failed = True
+
+    if failed:
+        # Оставшиеся ответы больше не нужны
+        for _, msg_id in in_flight:
+            cancel_request(msg_id)
         return pd.DataFrame()
 
+    frames = [frame for frame in frames if frame is not None and not frame.empty]
+    if not frames:
+        print(f"Получен пустой набор данных для {symbol} {timeframe} за указанный диапазон.")
+        return pd.DataFrame()
+
+    df = pd.concat(frames, ignore_index=True)
+    df = df.drop_duplicates('timestamp', keep='last').sort_values('timestamp')
+    start_ts = pd.Timestamp(from_ms, unit='ms', tz='UTC')
+    end_ts = pd.Timestamp(to_ms, unit='ms', tz='UTC')
+    df = df[(df['timestamp'] >= start_ts) & (df['timestamp'] < end_ts)].reset_index(drop=True)
+    print(f"Загружено {len(df)} свечей {symbol} {timeframe}.")
+    if config.USE_BAR_ARCHIVE:
+        _archive_bars(symbol, timeframe, df)
+    return df
+
 def get_account_balance(client_obj):
     """Получает текущий баланс счета."""
     if not check_client_status("получения баланса"):
         return config.INITIAL_ACCOUNT_BALANCE
 
+    request = _build_balance_request()
+    response_msg = send_request(request, "GET_ACCOUNTS")
+    return _parse_balance_response(response_msg)
+
+def _build_balance_request():
+    """Создает запрос списка счетов (из него берется баланс)."""
+    return ProtoOAGetAccountListByAccessTokenReq(accessToken=config.ACCESS_TOKEN)
+
+def _parse_balance_response(response_msg):
+    """Извлекает баланс счета config.ACCOUNT_ID из ответа; при ошибке - INITIAL_ACCOUNT_BALANCE."""
     try:
          account_id = int(config.ACCOUNT_ID)
     except ValueError:
          print(f"Критическая ошибка: ACCOUNT_ID '{config.ACCOUNT_ID}' некорректен.")
          return config.INITIAL_ACCOUNT_BALANCE
 
-    request = ProtoOAGetAccountListByAccessTokenReq(accessToken="dummy_token_ignored")
-    response_msg = send_request(request, "GET_ACCOUNTS")
-
     if response_msg and response_msg.payloadType == ProtoOAGetAccountListByAccessTokenRes().payloadType:
         accounts_res = ProtoOAGetAccountListByAccessTokenRes()
         accounts_res.ParseFromString(response_msg.payload)
@@ -593,36 +1341,69 @@ def get_account_balance(client_obj):
         print("Не удалось получить информацию о счете (ошибка API или таймаут).")
         return config.INITIAL_ACCOUNT_BALANCE
 
-def place_market_order(client_obj, symbol, direction, volume, stop_loss_price, take_profit_price, comment=""):
-    """Размещает рыночный ордер."""
+def place_market_order(client_obj, symbol, direction, volume, stop_loss_price, take_profit_price, comment="",
+                       reference_price=None):
+    """
+    Размещает рыночный ордер. SL/TP рыночного ордера задаются относительно цены исполнения,
+    поэтому для них нужна reference_price - текущая цена, от которой рассчитаны уровни.
+    """
     if not check_client_status("размещения ордера"):
         return False
 
     print(f"Попытка размещения ордера: {direction} {volume:.2f} лотов {symbol}")
 
+    request = _build_market_order_request(symbol, direction, volume, stop_loss_price, take_profit_price, comment,
+                                          reference_price)
+    if request is None:
+        return False
+    response_msg = send_request(request, "NEW_ORDER")
+    return _parse_order_response(response_msg)
+
+def _order_volume_units(volume):
+    """Объем в единицах API (1/100000 лота) или None, если объем некорректен."""
+    volume_in_units = int(round(volume * VOLUME_UNITS))
+    if volume_in_units <= 0:
+        print("Ошибка: Объем лота должен быть положительным (минимум 0.01 лота -> 1000 единиц API).")
+        return None
+    if volume_in_units < MIN_ORDER_VOLUME_UNITS:
+         print(f"Предупреждение: Объем {volume_in_units} меньше минимального ({MIN_ORDER_VOLUME_UNITS}). Устанавливаем минимальный объем.")
+         volume_in_units = MIN_ORDER_VOLUME_UNITS
+    return volume_in_units
+
+def _relative_price(distance):
+    """Расстояние в цене -> относительный SL/TP в единицах API (1/100000), None для отсутствующего."""
+    if distance is None or distance <= 0:
+        return None
+    return int(round(distance * PRICE_UNITS))
+
+def _build_market_order_request(symbol, direction, volume, stop_loss_price, take_profit_price, comment="",
+                                reference_price=None):
+    """Создает запрос рыночного ордера. Возвращает None, если параметры некорректны."""
     symbol_id = get_symbol_id(symbol)
     if symbol_id is None:
         print(f"Не удалось получить ID для символа {symbol}. Размещение ордера отменено.")
-        return False
+        return None
 
     try:
          account_id = int(config.ACCOUNT_ID)
     except ValueError:
          print(f"Критическая ошибка: ACCOUNT_ID '{config.ACCOUNT_ID}' некорректен.")
-         return False
+         return None
 
-    volume_in_units = int(round(volume * 100000))
+    volume_in_units = _order_volume_units(volume)
+    if volume_in_units is None:
+        return None
     print(f"Объем для API (1/100000 лота): {volume_in_units}")
-    if volume_in_units <= 0:
-        print("Ошибка: Объем лота должен быть положительным (минимум 0.01 лота -> 1000 единиц API).")
-        return False
-    if volume_in_units < 1000:
-         print(f"Предупреждение: Объем {volume_in_units} меньше минимального (1000). Устанавливаем минимальный объем.")
-         volume_in_units = 1000
+
+    has_stops = any(price is not None and price > 0 for price in (stop_loss_price, take_profit_price))
+    if has_stops and not reference_price:
+        # Абсолютные SL/TP для рыночного ордера сервер не принимает - без цены отсчета позиция осталась бы без стопа
+        print("Ошибка: Для SL/TP рыночного ордера нужна текущая цена (reference_price). Размещение ордера отменено.")
+        return None
 
     trade_side = ProtoOATradeSide.BUY if direction.upper() == "BUY" else ProtoOATradeSide.SELL
 
-    request = ProtoOACreateOrderReq(
+    request = ProtoOANewOrderReq(
         ctidTraderAccountId=account_id,
         symbolId=symbol_id,
         orderType=ProtoOAOrderType.MARKET,
@@ -632,48 +1413,345 @@ def place_market_order(client_obj, symbol, direction, volume, stop_loss_price, t
     )
 
     if stop_loss_price is not None and stop_loss_price > 0:
-        request.stopLoss = round(stop_loss_price, 5)
-        print(f"  Установка SL: {request.stopLoss:.5f}")
+        request.relativeStopLoss = _relative_price(abs(reference_price - stop_loss_price))
+        print(f"  Установка SL: {stop_loss_price:.5f} (отступ {request.relativeStopLoss / PRICE_UNITS:.5f})")
 
     if take_profit_price is not None and take_profit_price > 0:
-        request.takeProfit = round(take_profit_price, 5)
-        print(f"  Установка TP: {request.takeProfit:.5f}")
+        request.relativeTakeProfit = _relative_price(abs(take_profit_price - reference_price))
+        print(f"  Установка TP: {take_profit_price:.5f} (отступ {request.relativeTakeProfit / PRICE_UNITS:.5f})")
 
-    response_msg = send_request(request, "CREATE_ORDER")
+    return request
 
-    if response_msg and response_msg.payloadType == ProtoOACreateOrderRes().payloadType:
-        order_res = ProtoOACreateOrderRes()
-        order_res.ParseFromString(response_msg.payload)
+def _parse_order_response(response_msg):
+    """
+    Разбирает ответ на ProtoOANewOrderReq: первое ProtoOAExecutionEvent с clientMsgId запроса
+    (ORDER_ACCEPTED/ORDER_FILLED), ProtoOAOrderErrorEvent или ProtoOAErrorRes.
+    Возвращает True, если ордер принят/исполнен.
+    """
+    if response_msg is None or isinstance(response_msg, dict):
+        error = f" ({response_msg.get('error')}: {response_msg.get('description')})" if response_msg else ""
+        print(f"Ошибка при размещении ордера (не получен корректный ответ или таймаут){error}.")
+        return False
 
-        order_status_code = getattr(getattr(order_res, 'order', None), 'orderStatus', None)
-        position_status_code = getattr(getattr(order_res, 'position', None), 'positionStatus', None)
-        order_id = getattr(getattr(order_res, 'order', None), 'orderId', "N/A")
-        position_id = getattr(getattr(order_res, 'position', None), 'positionId', "N/A")
+    if response_msg.payloadType == EXECUTION_EVENT_PAYLOAD_TYPE:
+        event = ProtoOAExecutionEvent()
+        event.ParseFromString(response_msg.payload)
 
-        order_status_str = ProtoOAOrderStatus.Name(order_status_code) if order_status_code is not None else "UNKNOWN"
-        position_status_str = ProtoOAPositionStatus.Name(position_status_code) if position_status_code is not None else "UNKNOWN"
+        order_id = event.order.orderId if event.HasField('order') else "N/A"
+        position_id = event.position.positionId if event.HasField('position') else "N/A"
+        execution_str = ProtoOAExecutionType.Name(event.executionType)
+        order_status_str = ProtoOAOrderStatus.Name(event.order.orderStatus) if event.HasField('order') else "UNKNOWN"
 
-        print(f"Ответ на создание ордера получен. OrderID: {order_id}, PositionID: {position_id}, OrderStatus: {order_status_str}, PositionStatus: {position_status_str}")
+        print(f"Ответ на создание ордера получен. OrderID: {order_id}, PositionID: {position_id}, Execution: {execution_str}, OrderStatus: {order_status_str}")
 
-        if order_status_code in [ProtoOAOrderStatus.ORDER_ACCEPTED, ProtoOAOrderStatus.ORDER_FILLED, ProtoOAOrderStatus.ORDER_PARTIALLY_FILLED]:
+        if event.executionType in (ProtoOAExecutionType.ORDER_ACCEPTED, ProtoOAExecutionType.ORDER_FILLED,
+                                   ProtoOAExecutionType.ORDER_PARTIAL_FILL):
              print("Ордер успешно создан/исполнен.")
              return True
         else:
-             print(f"Ордер не был успешно исполнен. Статус: {order_status_str}")
-             error_code = getattr(order_res, 'errorCode', None)
-             if error_code:
-                  print(f"  Код ошибки API: {error_code}")
+             print(f"Ордер не был успешно исполнен. Статус: {execution_str}")
+             if event.errorCode:
+                  print(f"  Код ошибки API: {event.errorCode}")
              return False
-    elif response_msg and response_msg.payloadType == ProtoOAErrorRes().payloadType:
+    elif response_msg.payloadType == ORDER_ERROR_EVENT_PAYLOAD_TYPE:
+        order_error = ProtoOAOrderErrorEvent()
+        order_error.ParseFromString(response_msg.payload)
+        print(f"Ордер отклонен: {order_error.errorCode} - {order_error.description}")
+        return False
+    elif response_msg.payloadType == ERROR_RES_PAYLOAD_TYPE:
         print("API вернуло ошибку при попытке размещения ордера.")
         return False
     else:
         print("Ошибка при размещении ордера (не получен корректный ответ или таймаут).")
         return False
 
+def arm_market_orders(symbol):
+    """
+    Готовит шаблоны рыночных ордеров BUY/SELL для символа заранее (до окна входа): ID символа и счета,
+    тип и сторона уже заполнены и проверены. send_armed_order дописывает только объем, SL/TP и clientOrderId.
+    Возвращает True, если шаблоны готовы.
+    """
+    symbol_id = get_symbol_id(symbol)
+    if symbol_id is None:
+        print(f"Не удалось получить ID для символа {symbol}. Шаблоны ордеров не подготовлены.")
+        return False
+    try:
+        account_id = int(config.ACCOUNT_ID)
+    except ValueError:
+        print(f"Критическая ошибка: ACCOUNT_ID '{config.ACCOUNT_ID}' некорректен.")
+        return False
+
+    for direction, trade_side in (("BUY", ProtoOATradeSide.BUY), ("SELL", ProtoOATradeSide.SELL)):
+        template = ProtoOANewOrderReq(
+            ctidTraderAccountId=account_id,
+            symbolId=symbol_id,
+            orderType=ProtoOAOrderType.MARKET,
+            tradeSide=trade_side,
+            volume=MIN_ORDER_VOLUME_UNITS, # Заменяется при отправке; нужен для проверки обязательных полей
+        )
+        if not template.IsInitialized():
+            print(f"Ошибка: Шаблон ордера {direction} {symbol} неполон.")
+            return False
+        armed_orders[(symbol, direction)] = template
+    print(f"Шаблоны рыночных ордеров {symbol} подготовлены (symbolId {symbol_id}).")
+    return True
+
+def disarm_market_orders(symbol=None):
+    """Удаляет шаблоны ордеров символа (или все)."""
+    for key in [key for key in armed_orders if symbol is None or key[0] == symbol]:
+        del armed_orders[key]
+
+def send_armed_order(symbol, direction, volume, sl_distance, tp_distance=None, comment=""):
+    """
+    Отправляет рыночный ордер по шаблону arm_market_orders без блокирующих проверок:
+    сразу в сокет, минуя очередь отправки клиента. sl_distance/tp_distance - расстояние от цены исполнения.
+    Возвращает OrderTicket (итог - wait_for_fill) или None, если ордер не отправлен.
+    """
+    template = armed_orders.get((symbol, direction.upper()))
+    if template is None:
+        print(f"Ошибка: Нет шаблона ордера {direction} {symbol}. Вызовите arm_market_orders.")
+        return None
+    if not link_ready.is_set():
+        print("Ошибка: Нет готового соединения с cTrader. Ордер не отправлен.")
+        return None
+    volume_in_units = _order_volume_units(volume)
+    if volume_in_units is None:
+        return None
+
+    ticket = OrderTicket(f"{ORDER_ID_PREFIX}-{os.getpid()}-{next(_order_counter)}", symbol, direction.upper())
+    request = ProtoOANewOrderReq()
+    request.CopyFrom(template)
+    request.volume = volume_in_units
+    request.clientOrderId = ticket.client_order_id
+    relative_stop_loss = _relative_price(sl_distance)
+    if relative_stop_loss is not None:
+        request.relativeStopLoss = relative_stop_loss
+    relative_take_profit = _relative_price(tp_distance)
+    if relative_take_profit is not None:
+        request.relativeTakeProfit = relative_take_profit
+    if comment:
+        request.comment = comment[:64]
+
+    order_tickets[ticket.client_order_id] = ticket
+    msg_id, future = send_request_future(request, "NEW_ORDER", timeout=config.ORDER_FILL_TIMEOUT_SECONDS, instant=True)
+    if future is None:
+        _resolve_order_ticket(ticket, "ERROR", error="SEND_FAILED")
+        return ticket
+    ticket.msg_id = msg_id
+    ticket.sent_at = time.perf_counter()
+    future.add_done_callback(_order_response_callback(ticket))
+    return ticket
+
+def wait_for_fill(ticket, timeout=None):
+    """
+    Ждет итог ордера по событиям исполнения. Возвращает dict: status (см. OrderTicket), order_id,
+    position_id, price, volume, error. При TIMEOUT/DISCONNECTED ордер мог быть исполнен - повторно его
+    не отправляют; окончательный итог появится в ticket.outcome, если событие придет позже.
+    """
+    timeout = config.ORDER_FILL_TIMEOUT_SECONDS if timeout is None else timeout
+    try:
+        result = ticket.future.result(timeout=timeout)
+    except FutureTimeoutError:
+        # Тикет остается в order_tickets - позднее событие исполнения будет сопоставлено
+        partial = f", исполнено частично {ticket.executed_volume} лотов" if ticket.executed_volume else ""
+        _resolve_order_ticket(ticket, "TIMEOUT", final=False, volume=ticket.executed_volume or None,
+                              error=f"Нет окончательного события исполнения за {timeout} сек.{partial}")
+        result = ticket.future.result()
+    if ticket.msg_id is not None:
+        cancel_request(ticket.msg_id) # Запись ответа не нужна - итог пришел через OrderTicket
+
+    local_us = (ticket.sent_at - ticket.created_at) * 1e6 if ticket.sent_at else float('nan')
+    if result['status'] in ("FILLED", "PARTIALLY_FILLED"):
+        fill_ms = (ticket.filled_at - ticket.sent_at) * 1000 if ticket.filled_at and ticket.sent_at else float('nan')
+        partial = f" частично ({result['volume']} лотов)" if result['status'] == "PARTIALLY_FILLED" else ""
+        print(f"Ордер {ticket.client_order_id} исполнен{partial}: {ticket.direction} {ticket.symbol} по {result['price']}, "
+              f"OrderID {result['order_id']}, PositionID {result['position_id']} "
+              f"(подготовка {local_us:.0f} мкс, исполнение {fill_ms:.1f} мс)")
+    else:
+        print(f"Ордер {ticket.client_order_id} не исполнен: {result['status']} {result['error'] or ''}".rstrip())
+    return result
+
+
+def _send_subscribe_spots(symbol):
+    """Отправляет ProtoOASubscribeSpotsReq для символа (без проверки статуса клиента)."""
+    symbol_id = symbol_id_map.get(symbol)
+    if symbol_id is None:
+        print(f"Ошибка: Символ '{symbol}' не найден в кэше ID. Подписка на котировки отменена.")
+        return False
+    try:
+         account_id = int(config.ACCOUNT_ID)
+    except ValueError:
+         print(f"Критическая ошибка: ACCOUNT_ID '{config.ACCOUNT_ID}' некорректен.")
+         return False
+
+    request = ProtoOASubscribeSpotsReq(ctidTraderAccountId=account_id, symbolId=[symbol_id])
+    response_msg = send_request(request, "SUBSCRIBE_SPOTS")
+    if response_msg and response_msg.payloadType == ProtoOASubscribeSpotsRes().payloadType:
+        print(f"Подписка на спот-котировки {symbol} оформлена.")
+        return True
+    print(f"Не удалось подписаться на спот-котировки {symbol}.")
+    return False
+
+def subscribe_spots(client_obj, symbol):
+    """Подписывается на ProtoOASpotEvent для символа; get_current_price начинает читать цену из памяти."""
+    if not check_client_status(f"подписки на котировки {symbol}"):
+        return False
+    if get_symbol_id(symbol) is None:
+        print(f"Не удалось получить ID для символа {symbol}. Подписка на котировки отменена.")
+        return False
+    if not _send_subscribe_spots(symbol):
+        return False
+    spot_subscriptions.add(symbol)
+    return True
+
+def unsubscribe_spots(client_obj, symbol):
+    """Отменяет подписку на спот-котировки символа."""
+    spot_subscriptions.discard(symbol)
+    symbol_id = symbol_id_map.get(symbol)
+    if symbol_id is None:
+        return False
+    spot_prices.pop(symbol_id, None)
+    if not client or not client.isConnected:
+        return False
+    try:
+         account_id = int(config.ACCOUNT_ID)
+    except ValueError:
+         print(f"Критическая ошибка: ACCOUNT_ID '{config.ACCOUNT_ID}' некорректен.")
+         return False
+    request = ProtoOAUnsubscribeSpotsReq(ctidTraderAccountId=account_id, symbolId=[symbol_id])
+    response_msg = send_request(request, "UNSUBSCRIBE_SPOTS")
+    return bool(response_msg and response_msg.payloadType == ProtoOAUnsubscribeSpotsRes().payloadType)
+
+def _send_subscribe_live_trendbar(symbol, timeframe):
+    """Отправляет ProtoOASubscribeLiveTrendbarReq (требует активной подписки на спот-котировки)."""
+    symbol_id = symbol_id_map.get(symbol)
+    if symbol_id is None:
+        print(f"Ошибка: Символ '{symbol}' не найден в кэше ID. Подписка на живые свечи отменена.")
+        return False
+    try:
+         account_id = int(config.ACCOUNT_ID)
+    except ValueError:
+         print(f"Критическая ошибка: ACCOUNT_ID '{config.ACCOUNT_ID}' некорректен.")
+         return False
+
+    request = ProtoOASubscribeLiveTrendbarReq(
+        ctidTraderAccountId=account_id,
+        period=ProtoOATrendbarPeriod.Value(timeframe.upper()),
+        symbolId=symbol_id
+    )
+    response_msg = send_request(request, "SUBSCRIBE_LIVE_TRENDBAR")
+    if response_msg and response_msg.payloadType == ProtoOASubscribeLiveTrendbarRes().payloadType:
+        print(f"Подписка на живые свечи {symbol} {timeframe} оформлена.")
+        return True
+    print(f"Не удалось подписаться на живые свечи {symbol} {timeframe}.")
+    return False
+
+def _start_live_bars(symbol, timeframes):
+    """Создает BarBuilder, заполняет его историей и подписывается на живые свечи младшего таймфрейма."""
+    symbol_id = symbol_id_map.get(symbol)
+    if symbol_id is None:
+        print(f"Ошибка: Символ '{symbol}' не найден в кэше ID. Живые свечи не запущены.")
+        return False
+    history_counts = {
+        config.TIMEFRAME_CONTEXT_H4.upper(): config.HISTORICAL_DATA_COUNT_H4,
+        config.TIMEFRAME_CONTEXT_H1.upper(): config.HISTORICAL_DATA_COUNT_H1,
+        config.TIMEFRAME_ENTRY.upper(): config.HISTORICAL_DATA_COUNT_ENTRY,
+    }
+    builder = bar_builder.BarBuilder(
+        timeframes,
+        max_bars={tf: max(history_counts.get(tf, 0), bar_builder.DEFAULT_MAX_BARS) for tf in timeframes}
+    )
+    for tf in builder.timeframes:
+        df = get_historical_data(client, symbol, tf, history_counts.get(tf, config.HISTORICAL_DATA_COUNT_ENTRY))
+        if df.empty:
+            print(f"Ошибка: Не удалось загрузить историю {symbol} {tf} для живых свечей.")
+            return False
+        builder.seed(tf, df)
+    builder.add_bar_close_listener(lambda tf, bar_start: _notify_bar_close(symbol, tf, bar_start))
+
+    live_bar_builders[symbol_id] = builder
+    if not _send_subscribe_live_trendbar(symbol, builder.base_timeframe):
+        live_bar_builders.pop(symbol_id, None)
+        return False
+    return True
+
+def _notify_bar_close(symbol, timeframe, bar_start):
+    """Передает закрытие свечи зарегистрированным обработчикам."""
+    for callback in list(bar_close_listeners):
+        try:
+            callback(symbol, timeframe, bar_start)
+        except Exception as e:
+            print(f"Ошибка в обработчике закрытия свечи {symbol} {timeframe}: {e}")
+
+def add_bar_close_listener(callback):
+    """Регистрирует callback(symbol, timeframe, bar_start) для событий закрытия живых свечей."""
+    bar_close_listeners.append(callback)
+
+def remove_bar_close_listener(callback):
+    """Удаляет обработчик, зарегистрированный через add_bar_close_listener."""
+    try:
+        bar_close_listeners.remove(callback)
+    except ValueError:
+        pass
+
+def add_spot_listener(callback):
+    """Регистрирует callback(symbol_id, bid, ask, timestamp_ms) для каждого ProtoOASpotEvent."""
+    spot_listeners.append(callback)
+
+def remove_spot_listener(callback):
+    """Удаляет обработчик, зарегистрированный через add_spot_listener."""
+    try:
+        spot_listeners.remove(callback)
+    except ValueError:
+        pass
+
+def subscribe_live_bars(client_obj, symbol, timeframes=None):
+    """
+    Включает локальное построение свечей символа по живым котировкам.
+    По умолчанию строятся таймфреймы из config (M1, H1, H4); после этого get_historical_data
+    для них отвечает из памяти, а обработчики add_bar_close_listener узнают о закрытии свечей сразу.
+    """
+    if timeframes is None:
+        timeframes = (config.TIMEFRAME_ENTRY, config.TIMEFRAME_CONTEXT_H1, config.TIMEFRAME_CONTEXT_H4)
+    timeframes = tuple(tf.upper() for tf in timeframes)
+    # Живые свечи приходят внутри ProtoOASpotEvent, поэтому нужна подписка на котировки
+    if not subscribe_spots(client_obj, symbol):
+        return False
+    if not _start_live_bars(symbol, timeframes):
+        return False
+    live_bar_subscriptions[symbol] = timeframes
+    return True
+
+def get_live_bars(symbol, timeframe, count):
+    """Свечи из локального BarBuilder или None, если живые свечи для символа/таймфрейма недоступны."""
+    symbol_id = symbol_id_map.get(symbol)
+    if symbol_id is None:
+        return None
+    builder = live_bar_builders.get(symbol_id)
+    if builder is None or timeframe.upper() not in builder.timeframes:
+        return None
+    if builder.bar_count(timeframe) < count:
+        return None
+    return builder.get_dataframe(timeframe, count)
+
+def get_spot_price(symbol):
+    """Последняя котировка (bid, ask, timestamp_ms) из подписки или None. Чтение из памяти без запросов."""
+    symbol_id = symbol_id_map.get(symbol)
+    if symbol_id is None:
+        return None
+    return spot_prices.get(symbol_id)
 
 def get_current_price(client_obj, symbol, timeframe=config.TIMEFRAME_ENTRY):
-     """Получает последнюю цену закрытия."""
+     """
+     Получает текущую цену.
+     При активной подписке на спот-котировки возвращает последний bid из памяти
+     (trendbar-цены cTrader строятся по bid), иначе - цену закрытия последней свечи.
+     """
+     if symbol in spot_subscriptions:
+         quote = get_spot_price(symbol)
+         if quote is not None and quote[0] is not None:
+             return quote[0]
+
      df = get_historical_data(client_obj, symbol, timeframe, count=1)
      if not df.empty:
          try:
@@ -690,13 +1768,82 @@ def get_current_price(client_obj, symbol, timeframe=config.TIMEFRAME_ENTRY):
          print(f"Не удалось получить последнюю свечу для {symbol} {timeframe} для определения цены.")
          return None
 
+def fetch_cycle_data(client_obj, symbol, include_balance=False, timeout=20):
+    """
+    Получает данные торгового цикла одним пакетом: свечи H4 и H1, текущую цену и (опционально) баланс.
+    Независимые запросы отправляются сразу все и ожидаются вместе, поэтому задержка цикла равна
+    самому медленному ответу, а не сумме ответов. Данные, доступные в памяти (живые свечи,
+    котировка из подписки), берутся без запросов.
+    Возвращает dict {'h4': DataFrame, 'h1': DataFrame, 'price': float|None, 'balance': float|None}.
+    """
+    result = {'h4': pd.DataFrame(), 'h1': pd.DataFrame(), 'price': None, 'balance': None}
+    if include_balance:
+        result['balance'] = config.INITIAL_ACCOUNT_BALANCE
+
+    bar_requests = {
+        'h4': (config.TIMEFRAME_CONTEXT_H4, config.HISTORICAL_DATA_COUNT_H4),
+        'h1': (config.TIMEFRAME_CONTEXT_H1, config.HISTORICAL_DATA_COUNT_H1),
+    }
+    for key, (timeframe, count) in list(bar_requests.items()):
+        live_df = get_live_bars(symbol, timeframe, count)
+        if live_df is not None:
+            result[key] = live_df
+            del bar_requests[key]
+
+    if symbol in spot_subscriptions:
+        quote = get_spot_price(symbol)
+        if quote is not None and quote[0] is not None:
+            result['price'] = quote[0]
+    if result['price'] is None:
+        live_df = get_live_bars(symbol, config.TIMEFRAME_ENTRY, 1)
+        if live_df is not None:
+            result['price'] = live_df['close'].iloc[-1]
+        else:
+            bar_requests['price'] = (config.TIMEFRAME_ENTRY, 1)
+
+    if not bar_requests and not include_balance:
+        return result
+    if not check_client_status(f"получения данных цикла для {symbol}"):
+        return result
+
+    # 1. Отправляем все запросы, не дожидаясь ответов
+    in_flight = {} # {key: (msg_id, request_type, plan)}
+    for key, (timeframe, count) in bar_requests.items():
+        plan = _prepare_historical_request(symbol, timeframe, count)
+        if plan is None:
+            continue
+        msg_id = send_request_nowait(plan['request'], "GET_TRENDBARS", timeout)
+        if msg_id is not None:
+            in_flight[key] = (msg_id, "GET_TRENDBARS", plan)
+    if include_balance:
+        msg_id = send_request_nowait(_build_balance_request(), "GET_ACCOUNTS", timeout)
+        if msg_id is not None:
+            in_flight['balance'] = (msg_id, "GET_ACCOUNTS", None)
+
+    # 2. Собираем ответы с общим крайним сроком
+    deadline = time.monotonic() + timeout
+    for key, (msg_id, request_type, plan) in in_flight.items():
+        remaining = max(deadline - time.monotonic(), 0.001)
+        response_msg = wait_for_response(msg_id, request_type, remaining)
+        if key == 'balance':
+            result['balance'] = _parse_balance_response(response_msg)
+        elif key == 'price':
+            df = _complete_historical_request(plan, response_msg)
+            if not df.empty:
+                result['price'] = df['close'].iloc[-1]
+        else:
+            result[key] = _complete_historical_request(plan, response_msg)
+    return result
+
 def disconnect_from_ctrader():
     """Отключается от API."""
     global client, connected, authorized_app, authorized_account, connection_in_progress
+    stop_supervisor() # Намеренное отключение - переподключаться не нужно
+    link_ready.clear()
     if client:
         print("Отключение от cTrader API...")
         try:
-            client.stopService()
+            call_in_reactor(client.stopService)
             print("Сервис клиента остановлен.")
         except Exception as e:
             print(f"Ошибка при остановке сервиса клиента: {e}")
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Асинхронный (asyncio) интерфейс к cTrader Open API.
+
+Транспорт остается прежним: ctrader_api.Client работает в реакторе Twisted (фоновый поток),
+ответы сопоставляются по clientMsgId в ctrader_api.on_message_received.
+Здесь concurrent.futures.Future запроса оборачивается в asyncio-future, поэтому
+ожидающий запрос не занимает поток, и один цикл событий может вести десятки запросов.
+"""
+
+import asyncio
+import pandas as pd
+import config
+import ctrader_api
+
+DEFAULT_TIMEOUT = 20 # Таймаут запроса (сек), как в ctrader_api.send_request
+EVENT_QUEUE_SIZE = 1000 # Максимум необработанных событий в очереди подписчика (старые вытесняются)
+_ready_lock = None # (цикл событий, asyncio.Lock): одна проверка готовности клиента на все задачи цикла
+
+
+async def request(request_message, request_type, timeout=DEFAULT_TIMEOUT):
+    """
+    Отправляет запрос и ожидает ответ без блокировки потока.
+    Возвращает ProtoMessage или None (ошибка отправки, ошибка API, таймаут).
+    """
+    msg_id, future = ctrader_api.send_request_future(request_message, request_type, timeout)
+    if msg_id is None:
+        return None
+    try:
+        response = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError:
+        print(f"Ошибка: Таймаут ({timeout} сек) ожидания ответа на запрос {request_type} (ID: {msg_id}).")
+        return None
+    except asyncio.CancelledError:
+        raise
+    finally:
+        # Убираем запись из ожидающих в любом случае (в т.ч. при отмене задачи)
+        ctrader_api.cancel_request(msg_id)
+
+    if isinstance(response, dict) and "error" in response:
+        print(f"Запрос {request_type} (ID: {msg_id}) завершился с ошибкой: {response.get('description', response['error'])}")
+        return None
+    return response
+
+
+def _client_ready():
+    """Клиент подключен и счет авторизован (без ожидания)."""
+    client = ctrader_api.client
+    return bool(client and client.isConnected and ctrader_api.authorized_account)
+
+
+async def ensure_client_ready(operation_name="операции"):
+    """
+    Аналог ctrader_api.check_client_status, не блокирующий цикл событий: ожидание супервизора или
+    переподключение выполняются в пуле потоков, параллельные задачи ждут одну общую проверку.
+    """
+    global _ready_lock
+    if _client_ready():
+        return True
+    loop = asyncio.get_running_loop()
+    if _ready_lock is None or _ready_lock[0] is not loop:
+        _ready_lock = (loop, asyncio.Lock())
+    async with _ready_lock[1]:
+        if _client_ready():
+            return True
+        return await loop.run_in_executor(None, ctrader_api.check_client_status, operation_name)
+
+
+async def _run_blocking(function, *args):
+    """Выполняет синхронную функцию ctrader_api (может ждать сеть или диск) в пуле потоков."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, function, *args)
+
+
+async def connect(max_retries=3, retry_delay=5):
+    """Подключается и авторизуется (синхронная процедура выполняется в пуле потоков)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, ctrader_api.connect_to_ctrader, max_retries, retry_delay)
+
+
+async def disconnect():
+    """Отключается от API."""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, ctrader_api.disconnect_from_ctrader)
+
+
+async def load_symbol_ids(retries=2, delay=3):
+    """Загружает и кэширует ID символов (аналог ctrader_api.load_symbol_ids)."""
+    if not await ensure_client_ready("загрузки символов"):
+        return False
+    try:
+        account_id = int(config.ACCOUNT_ID)
+    except ValueError:
+        print(f"Критическая ошибка: ACCOUNT_ID '{config.ACCOUNT_ID}' некорректен.")
+        return False
+
+    request_message = ctrader_api.ProtoOASymbolsListReq(ctidTraderAccountId=account_id)
+    for attempt in range(retries):
+        response_msg = await request(request_message, "GET_SYMBOLS")
+        if response_msg and response_msg.payloadType == ctrader_api.ProtoOASymbolsListRes().payloadType:
+            # Разбор списка символов и сохранение карты на диск - в пуле потоков
+            return await _run_blocking(ctrader_api._apply_symbols_response, response_msg)
+        if attempt < retries - 1:
+            print(f"Не удалось получить список символов (попытка {attempt + 1}/{retries}). Повтор через {delay} сек...")
+            await asyncio.sleep(delay)
+    print("Ошибка: Не удалось получить список символов от API после всех попыток.")
+    return False
+
+
+async def get_historical_data(symbol, timeframe, count, use_cache=True):
+    """Получает свечи (аналог ctrader_api.get_historical_data, с тем же кэшем и архивом)."""
+    live_df = ctrader_api.get_live_bars(symbol, timeframe, count)
+    if live_df is not None:
+        return live_df
+
+    if not await ensure_client_ready(f"получения исторических данных для {symbol}"):
+        return pd.DataFrame()
+
+    # Подготовка читает архив на диске и при пустом кэше символов загружает их синхронно
+    plan = await _run_blocking(ctrader_api._prepare_historical_request, symbol, timeframe, count, use_cache)
+    if plan is None:
+        return pd.DataFrame()
+    response_msg = await request(plan['request'], "GET_TRENDBARS")
+    # Разбор, объединение с кэшем и запись в архив (.npy) - тоже в пуле потоков
+    return await _run_blocking(ctrader_api._complete_historical_request, plan, response_msg)
+
+
+async def get_account_balance():
+    """Получает текущий баланс счета (аналог ctrader_api.get_account_balance)."""
+    if not await ensure_client_ready("получения баланса"):
+        return config.INITIAL_ACCOUNT_BALANCE
+    response_msg = await request(ctrader_api._build_balance_request(), "GET_ACCOUNTS")
+    return ctrader_api._parse_balance_response(response_msg)
+
+
+async def place_market_order(symbol, direction, volume, stop_loss_price, take_profit_price, comment="",
+                             reference_price=None):
+    """Размещает рыночный ордер (аналог ctrader_api.place_market_order)."""
+    if not await ensure_client_ready("размещения ордера"):
+        return False
+    print(f"Попытка размещения ордера: {direction} {volume:.2f} лотов {symbol}")
+    request_message = await _run_blocking(
+        ctrader_api._build_market_order_request,
+        symbol, direction, volume, stop_loss_price, take_profit_price, comment, reference_price
+    )
+    if request_message is None:
+        return False
+    response_msg = await request(request_message, "NEW_ORDER")
+    return ctrader_api._parse_order_response(response_msg)
+
+
+async def get_current_price(symbol, timeframe=config.TIMEFRAME_ENTRY):
+    """Текущая цена: bid из подписки на котировки или закрытие последней свечи."""
+    if symbol in ctrader_api.spot_subscriptions:
+        quote = ctrader_api.get_spot_price(symbol)
+        if quote is not None and quote[0] is not None:
+            return quote[0]
+    df = await get_historical_data(symbol, timeframe, count=1)
+    if df.empty:
+        print(f"Не удалось получить последнюю свечу для {symbol} {timeframe} для определения цены.")
+        return None
+    return df['close'].iloc[-1]
+
+
+async def fetch_cycle_data(symbol, include_balance=False):
+    """
+    Данные торгового цикла (свечи H4/H1, цена, опционально баланс), запрошенные параллельно.
+    Формат результата как у ctrader_api.fetch_cycle_data.
+    """
+    tasks = [
+        get_historical_data(symbol, config.TIMEFRAME_CONTEXT_H4, config.HISTORICAL_DATA_COUNT_H4),
+        get_historical_data(symbol, config.TIMEFRAME_CONTEXT_H1, config.HISTORICAL_DATA_COUNT_H1),
+        get_current_price(symbol),
+    ]
+    if include_balance:
+        tasks.append(get_account_balance())
+    results = await asyncio.gather(*tasks)
+    return {
+        'h4': results[0],
+        'h1': results[1],
+        'price': results[2],
+        'balance': results[3] if include_balance else None,
+    }
+
+
+def _put_nowait(queue, item):
+    """Кладет событие в очередь; при переполнении вытесняет самое старое (выполняется в цикле asyncio)."""
+    if queue.full():
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+    queue.put_nowait(item)
+
+
+async def spot_events(symbol, maxsize=EVENT_QUEUE_SIZE):
+    """
+    Асинхронный итератор котировок символа: (bid, ask, timestamp_ms).
+    Подписка на ProtoOASpotEvent оформляется при необходимости; итератор завершается при выходе из async for.
+    """
+    loop = asyncio.get_running_loop()
+    if symbol not in ctrader_api.spot_subscriptions:
+        subscribed = await loop.run_in_executor(None, ctrader_api.subscribe_spots, ctrader_api.client, symbol)
+        if not subscribed:
+            return
+    symbol_id = ctrader_api.symbol_id_map.get(symbol)
+    queue = asyncio.Queue(maxsize)
+
+    def on_spot(event_symbol_id, bid, ask, timestamp_ms):
+        # Вызывается в потоке реактора - передаем событие в цикл asyncio
+        if event_symbol_id == symbol_id:
+            loop.call_soon_threadsafe(_put_nowait, queue, (bid, ask, timestamp_ms))
+
+    ctrader_api.add_spot_listener(on_spot)
+    try:
+        while True:
+            yield await queue.get()
+    finally:
+        ctrader_api.remove_spot_listener(on_spot)
+
+
+async def trendbar_events(symbol, timeframe, maxsize=EVENT_QUEUE_SIZE):
+    """
+    Асинхронный итератор закрытых свечей символа на таймфрейме: pandas.Series
+    (timestamp, open, high, low, close, volume). Требует живых свечей (subscribe_live_bars).
+    """
+    loop = asyncio.get_running_loop()
+    timeframe = timeframe.upper()
+    if timeframe not in ctrader_api.live_bar_subscriptions.get(symbol, ()):
+        timeframes = set(ctrader_api.live_bar_subscriptions.get(symbol, ())) | {timeframe}
+        subscribed = await loop.run_in_executor(
+            None, ctrader_api.subscribe_live_bars, ctrader_api.client, symbol, tuple(timeframes)
+        )
+        if not subscribed:
+            return
+    queue = asyncio.Queue(maxsize)
+
+    def on_bar_close(event_symbol, event_timeframe, bar_start):
+        if event_symbol != symbol or event_timeframe != timeframe:
+            return
+        # Закрытая свеча - предпоследняя в BarBuilder (последняя только что открылась)
+        df = ctrader_api.get_live_bars(symbol, timeframe, 2)
+        if df is None:
+            return
+        closed = df[df['timestamp'] == bar_start]
+        if not closed.empty:
+            loop.call_soon_threadsafe(_put_nowait, queue, closed.iloc[-1])
+
+    ctrader_api.add_bar_close_listener(on_bar_close)
+    try:
+        while True:
+            yield await queue.get()
+    finally:
+        ctrader_api.remove_bar_close_listener(on_bar_close)
@@ -1,17 +1,22 @@
 # -*- coding: utf-8 -*-
 
 import time
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 import config         # Настройки
 import ctrader_api    # Функции API
 import analysis       # Функции анализа
 import trading_logic  # Торговая логика
+import market_structure # Потоковая рыночная структура
 
 # Глобальные переменные состояния
 current_context = None # None, "BULLISH", "BEARISH"
 trade_taken_today = False
 last_check_day = None
 client = None # Объект клиента API
+wake_event = threading.Event() # Пробуждение основного цикла по событиям данных
+structure = None # market_structure.MarketStructure, состояние сохраняется между циклами
+fractal_index = None # analysis.FractalIndex по закрытым свечам H1
 
 def initialize_bot():
     """Инициализация бота: подключение к API."""
@@ -21,12 +26,17 @@ def initialize_bot():
     if not client:
         print("Ошибка: Не удалось подключиться к cTrader API.")
         return False
+    if config.USE_LIVE_BARS:
+        if not ctrader_api.subscribe_live_bars(client, config.SYMBOL):
+            print("Предупреждение: Живые свечи не запущены, данные будут запрашиваться каждый цикл.")
+    elif config.USE_SPOT_SUBSCRIPTION and not ctrader_api.subscribe_spots(client, config.SYMBOL):
+        print("Предупреждение: Подписка на котировки не оформлена, цена будет запрашиваться по свечам.")
     print("Бот инициализирован.")
     return True
 
 def run_trading_cycle():
-    """Выполняет один цикл торговой логики."""
-    global current_context, trade_taken_today, last_check_day, client
+    """Выполняет один цикл торговой логики. Возвращает False, если данные для цикла получить не удалось."""
+    global current_context, trade_taken_today, last_check_day, client, structure, fractal_index
 
     now_utc = datetime.now(config.UTC)
     current_day = now_utc.date()
@@ -40,24 +50,46 @@ def run_trading_cycle():
     # 1. Получаем свежие данные
     print(f"\n[{now_utc.strftime('%Y-%m-%d %H:%M:%S UTC')}] Получение данных...")
     try:
-        h4_data = ctrader_api.get_historical_data(client, config.SYMBOL, config.TIMEFRAME_CONTEXT_H4, config.HISTORICAL_DATA_COUNT_H4)
-        h1_data = ctrader_api.get_historical_data(client, config.SYMBOL, config.TIMEFRAME_CONTEXT_H1, config.HISTORICAL_DATA_COUNT_H1)
-        current_price = ctrader_api.get_current_price(client, config.SYMBOL) # Получаем текущую цену
+        # В окне входа баланс запрашиваем вместе с остальными данными, чтобы не ждать его перед ордером
+        entry_window = not trade_taken_today and trading_logic.is_asian_session_start(now_utc)
+        cycle_data = ctrader_api.fetch_cycle_data(client, config.SYMBOL, include_balance=entry_window)
+        h4_data = cycle_data['h4']
+        h1_data = cycle_data['h1']
+        current_price = cycle_data['price'] # Текущая цена
+        prefetched_balance = cycle_data['balance']
 
         if h4_data.empty or h1_data.empty or current_price is None:
             print("Ошибка: Не удалось получить все необходимые данные. Пропуск цикла.")
-            return # Пропускаем остаток цикла, если данных нет
+            return False # Пропускаем остаток цикла, если данных нет
     except Exception as e:
         print(f"Ошибка при получении данных: {e}")
         # Попытка переподключения может быть здесь
-        return
+        return False
 
     # 2. Определяем контекст
-    new_context = analysis.determine_context(h4_data, h1_data)
+    if config.USE_FRACTAL_INDEX:
+        if fractal_index is None:
+            fractal_index = analysis.FractalIndex(config.FRACTAL_LOOKBACK_H1)
+        fractal_index.update_from_dataframe(market_structure.closed_bars(h1_data, config.TIMEFRAME_CONTEXT_H1, now_utc))
+
+    if config.USE_MARKET_STRUCTURE:
+        if structure is None:
+            structure = market_structure.MarketStructure(config.SYMBOL)
+        # Подаются только новые закрытые свечи, пересчета всей истории нет
+        for timeframe, timestamp, event, price in structure.update(h4_data, h1_data, now_utc):
+            print(f"Структура {timeframe}: {event} {price:.5f} ({timestamp})")
+        new_context = structure.context
+    else:
+        new_context = analysis.determine_context(h4_data, h1_data, symbol=config.SYMBOL)
     if new_context != current_context:
         print(f"Смена контекста: {current_context} -> {new_context}")
         current_context = new_context
 
+    # Шаблоны ордеров готовятся заранее, чтобы в окне входа оставалось только заполнить объем и SL/TP
+    if (config.USE_ARMED_ORDERS and not trade_taken_today and in_order_arm_window(now_utc)
+            and (config.SYMBOL, "BUY") not in ctrader_api.armed_orders):
+        ctrader_api.arm_market_orders(config.SYMBOL)
+
     # 3. Проверяем условия входа
     if not trade_taken_today and trading_logic.is_asian_session_start(now_utc):
         print("Время входа (первый час Азии). Проверка контекста...")
@@ -74,7 +106,7 @@ def run_trading_cycle():
         if direction:
             # 4. Рассчитываем параметры сделки
             print("Расчет параметров сделки...")
-            sl_price = trading_logic.get_stop_loss_level(direction, h1_data, current_price)
+            sl_price = trading_logic.get_stop_loss_level(direction, h1_data, current_price, symbol=config.SYMBOL)
 
             if sl_price is None:
                 print("Не удалось рассчитать SL. Вход отменен.")
@@ -88,7 +120,7 @@ def run_trading_cycle():
                 if sl_distance_points <= 0:
                      print(f"Ошибка: Расстояние до SL ({sl_distance_points:.2f}) не положительное. SL={sl_price:.5f}, Цена={current_price:.5f}. Вход отменен.")
                 else:
-                    balance = ctrader_api.get_account_balance(client)
+                    balance = prefetched_balance if prefetched_balance is not None else ctrader_api.get_account_balance(client)
                     volume_lots = trading_logic.calculate_position_size(
                         balance,
                         config.RISK_PER_TRADE_PERCENT,
@@ -99,7 +131,9 @@ def run_trading_cycle():
                     if volume_lots < 0.01:
                         print(f"Размер позиции ({volume_lots:.2f}) слишком мал (менее 0.01). Вход отменен.")
                     else:
-                        tp_price = trading_logic.get_take_profit_level(direction, current_price, h1_data, sl_price)
+                        tp_price = trading_logic.get_take_profit_level(
+                            direction, current_price, h1_data, sl_price, symbol=config.SYMBOL, fractal_index=fractal_index
+                        )
                         # Если TP не найден, API обычно позволяет None или 0.0
                         if tp_price is None:
                             print("TP не будет установлен (фрактал не найден или некорректен).")
@@ -110,15 +144,32 @@ def run_trading_cycle():
 
                         # 5. Размещаем ордер
                         comment = f"Daily {direction} {current_context} {now_utc.strftime('%Y%m%d')}"
-                        success = ctrader_api.place_market_order(
-                            client,
-                            config.SYMBOL,
-                            direction,
-                            volume_lots,
-                            sl_price,
-                            tp_param_for_api, # Используем None или 0.0 если TP не определен
-                            comment
-                        )
+                        if config.USE_ARMED_ORDERS and (config.SYMBOL, direction) in ctrader_api.armed_orders:
+                            # SL/TP рыночного ордера - расстояния от цены исполнения
+                            tp_distance = abs(tp_price - current_price) if tp_price is not None else None
+                            ticket = ctrader_api.send_armed_order(
+                                config.SYMBOL, direction, volume_lots, sl_distance_points, tp_distance, comment
+                            )
+                            status = ctrader_api.wait_for_fill(ticket)['status'] if ticket is not None else None
+                            # Частичное исполнение - позиция открыта на меньший объем (риск ниже расчетного), не доливаем
+                            success = status in ("FILLED", "PARTIALLY_FILLED")
+                            if status == "PARTIALLY_FILLED":
+                                print(f"Предупреждение: Ордер исполнен частично ({ticket.outcome['volume']} из {volume_lots:.2f} лотов).")
+                            elif status in ctrader_api.ORDER_UNKNOWN_STATUSES:
+                                # Ордер мог быть исполнен - повторный ордер в окне входа открыл бы вторую позицию
+                                print(f"Предупреждение: Исход ордера неизвестен ({status}). Повторный вход сегодня не выполняется, проверьте позиции.")
+                                trade_taken_today = True
+                        else:
+                            success = ctrader_api.place_market_order(
+                                client,
+                                config.SYMBOL,
+                                direction,
+                                volume_lots,
+                                sl_price,
+                                tp_param_for_api, # Используем None или 0.0 если TP не определен
+                                comment,
+                                reference_price=current_price
+                            )
 
                         if success:
                             print("Сделка успешно открыта.")
@@ -132,21 +183,87 @@ def run_trading_cycle():
         # Можно раскомментировать для отладки
         # print(f"Не время для входа ({now_utc.strftime('%H:%M:%S')} UTC). Ожидание {config.ASIAN_SESSION_START_UTC}-{config.ASIAN_SESSION_END_UTC} UTC.")
         # pass
+    return True
 
 
+def on_bar_close(symbol, timeframe, bar_start):
+    """Будит основной цикл при закрытии свечи H1/H4 торгуемого символа."""
+    if symbol != config.SYMBOL:
+        return
+    if timeframe in (config.TIMEFRAME_CONTEXT_H1.upper(), config.TIMEFRAME_CONTEXT_H4.upper()):
+        wake_event.set()
+
+def in_order_arm_window(now_utc):
+    """Время готовить шаблоны ордеров: за ORDER_ARM_LEAD_MINUTES до окна входа и в самом окне."""
+    lead = timedelta(minutes=config.ORDER_ARM_LEAD_MINUTES)
+    for day_offset in (0, 1):
+        day = now_utc.date() + timedelta(days=day_offset)
+        start_dt = config.UTC.localize(datetime.combine(day, config.ASIAN_SESSION_START_UTC))
+        end_dt = config.UTC.localize(datetime.combine(day, config.ASIAN_SESSION_END_UTC))
+        if start_dt - lead <= now_utc < end_dt:
+            return True
+    return False
+
+def _after_bar_close(moment):
+    """Момент, совпадающий с закрытием свечи H1, сдвигается на SCHEDULER_BAR_CLOSE_DELAY_SECONDS."""
+    if moment.minute == 0 and moment.second == 0 and moment.microsecond == 0:
+        return moment + timedelta(seconds=config.SCHEDULER_BAR_CLOSE_DELAY_SECONDS)
+    return moment
+
+def next_scheduled_wakeup(after_utc):
+    """
+    Ближайшее плановое пробуждение после after_utc: закрытие следующей свечи H1
+    (с небольшой задержкой, чтобы сервер успел ее закрыть), граница окна входа
+    или время подготовки шаблонов ордеров перед ним. Границы на закрытии H1 получают ту же задержку.
+    """
+    next_h1_close = after_utc.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    candidates = [next_h1_close + timedelta(seconds=config.SCHEDULER_BAR_CLOSE_DELAY_SECONDS)]
+    for day_offset in (0, 1):
+        day = after_utc.date() + timedelta(days=day_offset)
+        session_start = config.UTC.localize(datetime.combine(day, config.ASIAN_SESSION_START_UTC))
+        boundaries = [session_start, config.UTC.localize(datetime.combine(day, config.ASIAN_SESSION_END_UTC))]
+        if config.USE_ARMED_ORDERS:
+            boundaries.append(session_start - timedelta(minutes=config.ORDER_ARM_LEAD_MINUTES))
+        for boundary_dt in map(_after_bar_close, boundaries):
+            if boundary_dt > after_utc:
+                candidates.append(boundary_dt)
+    return min(candidates)
+
+def wait_for_next_event(last_cycle_utc, retry_soon=False):
+    """
+    Спит без сетевой активности до планового пробуждения или события данных. Возвращает причину.
+    retry_soon - сон не дольше CHECK_INTERVAL_SECONDS (окно входа без сделки, неудачный цикл).
+    """
+    wake_at = next_scheduled_wakeup(last_cycle_utc)
+    if retry_soon:
+        wake_at = min(wake_at, datetime.now(config.UTC) + timedelta(seconds=config.CHECK_INTERVAL_SECONDS))
+    timeout = max(0.0, (wake_at - datetime.now(config.UTC)).total_seconds())
+    print(f"--- Ожидание до {wake_at.strftime('%Y-%m-%d %H:%M:%S UTC')} или закрытия свечи ---")
+    woke_by_event = wake_event.wait(timeout)
+    wake_event.clear()
+    return "event" if woke_by_event else "schedule"
+
 def main_loop():
     """Основной цикл работы бота."""
     if not initialize_bot():
         return # Не запускаем цикл, если инициализация не удалась
 
     print("\n--- Запуск основного цикла бота ---")
+    if config.USE_EVENT_SCHEDULER:
+        ctrader_api.add_bar_close_listener(on_bar_close)
     while True:
         try:
-            run_trading_cycle()
+            cycle_started_utc = datetime.now(config.UTC)
+            cycle_ok = run_trading_cycle()
 
             # Пауза перед следующей проверкой
-            print(f"--- Ожидание {config.CHECK_INTERVAL_SECONDS} секунд до следующей проверки ---")
-            time.sleep(config.CHECK_INTERVAL_SECONDS)
+            if config.USE_EVENT_SCHEDULER:
+                # В окне входа без сделки и после неудачного цикла повторяем попытки как прежний цикл опроса
+                in_entry_window = not trade_taken_today and trading_logic.is_asian_session_start(datetime.now(config.UTC))
+                wait_for_next_event(cycle_started_utc, retry_soon=not cycle_ok or in_entry_window)
+            else:
+                print(f"--- Ожидание {config.CHECK_INTERVAL_SECONDS} секунд до следующей проверки ---")
+                time.sleep(config.CHECK_INTERVAL_SECONDS)
 
         except KeyboardInterrupt:
             print("\nОстановка бота вручную (Ctrl+C).")
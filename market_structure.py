@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+from collections import deque
+import pandas as pd
+import config # Импортируем конфигурацию
+import analysis # SwingTracker
+import bar_builder # Длительность таймфреймов
+
+MAX_STORED_EVENTS = 100 # Сколько последних событий структуры хранить
+MAX_STORED_SWINGS = 100 # Сколько последних свингов хранить в SwingTracker
+
+
+class StructureEngine:
+    """
+    Потоковая рыночная структура одного таймфрейма.
+    По закрытым свечам (update) подтверждает свинги через SwingTracker, размечает их как
+    HH/LH (максимумы) и HL/LL (минимумы) и фиксирует слом структуры (BOS) - закрытие за последним
+    подтвержденным свингом. Контекст: BULLISH после HH+HL или BOS вверх, BEARISH после LH+LL или BOS вниз.
+    Состояние хранится между циклами, поэтому каждая новая свеча обрабатывается за O(1).
+    """
+
+    def __init__(self, n, timeframe=None):
+        self.n = n
+        self.timeframe = timeframe
+        self.tracker = analysis.SwingTracker(n, max_swings=MAX_STORED_SWINGS)
+        self.context = None # "BULLISH", "BEARISH" или None
+        self.last_high = None # Последний подтвержденный swing high
+        self.previous_high = None
+        self.last_low = None # Последний подтвержденный swing low
+        self.previous_low = None
+        self.high_label = None # "HH" или "LH" для last_high
+        self.low_label = None # "HL" или "LL" для last_low
+        self.events = deque(maxlen=MAX_STORED_EVENTS) # (timestamp, событие, цена)
+        self._high_broken = True # Последний swing high уже пробит (BOS вверх по нему был)
+        self._low_broken = True
+
+    @property
+    def last_timestamp(self):
+        """timestamp последней обработанной свечи."""
+        return self.tracker.last_timestamp
+
+    def update(self, high, low, close, timestamp=None):
+        """Обрабатывает закрытую свечу. Возвращает список новых событий (timestamp, событие, цена)."""
+        new_events = []
+        swing_high, swing_low = self.tracker.update(high, low, timestamp)
+        if swing_high is not None:
+            new_events.extend(self._on_swing_high(swing_high[2], swing_high[1]))
+        if swing_low is not None:
+            new_events.extend(self._on_swing_low(swing_low[2], swing_low[1]))
+
+        # Слом структуры по закрытию свечи
+        new_events.extend(self.check_break(close, timestamp))
+        return new_events
+
+    def add_swing_high(self, price, timestamp=None):
+        """Добавляет заранее вычисленный swing high (например, из swing_point_indices). Возвращает события."""
+        return self._on_swing_high(price, timestamp)
+
+    def add_swing_low(self, price, timestamp=None):
+        """Добавляет заранее вычисленный swing low. Возвращает события."""
+        return self._on_swing_low(price, timestamp)
+
+    def check_break(self, close, timestamp=None):
+        """Проверяет BOS по цене закрытия без подачи свечи в SwingTracker (для заранее вычисленных свингов)."""
+        new_events = []
+        if not self._high_broken and close > self.last_high:
+            self._high_broken = True
+            new_events.append(self._record(timestamp, "BOS_UP", self.last_high))
+            self.context = "BULLISH"
+        if not self._low_broken and close < self.last_low:
+            self._low_broken = True
+            new_events.append(self._record(timestamp, "BOS_DOWN", self.last_low))
+            self.context = "BEARISH"
+        return new_events
+
+    def update_from_dataframe(self, data):
+        """
+        Подает закрытые свечи DataFrame (timestamp, high, low, close), которые новее уже обработанных.
+        Возвращает список новых событий.
+        """
+        if data is None or data.empty:
+            return []
+        if self.last_timestamp is not None:
+            data = data[data['timestamp'] > self.last_timestamp]
+        new_events = []
+        for timestamp, high, low, close in zip(data['timestamp'], data['high'].to_numpy(),
+                                               data['low'].to_numpy(), data['close'].to_numpy()):
+            new_events.extend(self.update(high, low, close, timestamp))
+        return new_events
+
+    def _on_swing_high(self, price, timestamp):
+        self.previous_high, self.last_high = self.last_high, price
+        self._high_broken = False
+        if self.previous_high is None:
+            return []
+        self.high_label = "HH" if price > self.previous_high else "LH"
+        events = [self._record(timestamp, self.high_label, price)]
+        self._update_context_from_swings()
+        return events
+
+    def _on_swing_low(self, price, timestamp):
+        self.previous_low, self.last_low = self.last_low, price
+        self._low_broken = False
+        if self.previous_low is None:
+            return []
+        self.low_label = "HL" if price > self.previous_low else "LL"
+        events = [self._record(timestamp, self.low_label, price)]
+        self._update_context_from_swings()
+        return events
+
+    def _update_context_from_swings(self):
+        # Как в determine_context: HH+HL - бычий, LH+LL - медвежий; смешанная разметка контекст не меняет
+        if self.high_label == "HH" and self.low_label == "HL":
+            self.context = "BULLISH"
+        elif self.high_label == "LH" and self.low_label == "LL":
+            self.context = "BEARISH"
+
+    def _record(self, timestamp, event, price):
+        record = (timestamp, event, price)
+        self.events.append(record)
+        return record
+
+
+def closed_bars(data, timeframe, now_utc):
+    """Отбрасывает незакрытую последнюю свечу (начало + период позже now_utc)."""
+    if data is None or data.empty:
+        return data
+    period = pd.Timedelta(minutes=bar_builder.TIMEFRAME_MINUTES[timeframe.upper()])
+    if data['timestamp'].iloc[-1] + period > pd.Timestamp(now_utc):
+        return data.iloc[:-1]
+    return data
+
+
+class MarketStructure:
+    """
+    Структура символа на H1 и H4. Контекст берется с H1; H4 подтверждает его:
+    при REQUIRE_H4_CONFIRMATION контекст H4 должен совпадать с H1, иначе H4 только запрещает
+    противоположное направление.
+    """
+
+    def __init__(self, symbol=None):
+        self.symbol = symbol
+        self.h1 = StructureEngine(config.SWING_POINTS_LOOKBACK_H1, config.TIMEFRAME_CONTEXT_H1)
+        self.h4 = StructureEngine(config.SWING_POINTS_LOOKBACK_H4, config.TIMEFRAME_CONTEXT_H4)
+
+    def update(self, h4_data, h1_data, now_utc):
+        """Подает новые закрытые свечи H4 и H1. Возвращает список новых событий (timeframe, timestamp, событие, цена)."""
+        new_events = []
+        for engine, data in ((self.h4, h4_data), (self.h1, h1_data)):
+            for event in engine.update_from_dataframe(closed_bars(data, engine.timeframe, now_utc)):
+                new_events.append((engine.timeframe,) + event)
+        return new_events
+
+    @property
+    def context(self):
+        """Итоговый контекст с учетом подтверждения H4."""
+        return combine_context(self.h1.context, self.h4.context, config.REQUIRE_H4_CONFIRMATION)
+
+
+def combine_context(h1_context, h4_context, require_h4_confirmation):
+    """Контекст H1 с фильтром H4: совпадение (require_h4_confirmation) или отсутствие противоположного."""
+    if h1_context is None:
+        return None
+    if require_h4_confirmation:
+        return h1_context if h4_context == h1_context else None
+    opposite = "BEARISH" if h1_context == "BULLISH" else "BULLISH"
+    return None if h4_context == opposite else h1_context
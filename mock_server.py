@@ -0,0 +1,530 @@
+# -*- coding: utf-8 -*-
+"""
+Локальный заменитель cTrader Open API для воспроизводимых нагрузочных тестов и проверки переподключений.
+
+Говорит на том же протоколе, что и live.ctraderapi.com: TLS, кадры Int32 (длина) + ProtoMessage.
+Отвечает на авторизацию приложения и счета, список символов и счетов, свечи (из архива bar_archive
+или синтетические), рыночные ордера (ProtoOAExecutionEvent), подписки на котировки и рассылает
+ProtoOASpotEvent. Задержка ответов, ошибки, потеря ответов и разрывы соединения настраиваются.
+
+Подключение бота: config.API_HOST = "localhost" (порт по умолчанию тот же, config.API_PORT).
+Запуск: python mock_server.py --latency-ms 50 --error-rate 0.01
+"""
+
+import argparse
+import random
+import time
+from collections import deque
+import numpy as np
+from twisted.internet import reactor, ssl, task, threads
+from twisted.internet.protocol import Factory
+from twisted.protocols.basic import Int32StringReceiver
+from ctrader_open_api.messages.OpenApiCommonMessages_pb2 import ProtoMessage, ProtoHeartbeatEvent
+from ctrader_open_api.messages.OpenApiMessages_pb2 import *
+from ctrader_open_api.messages.OpenApiModelMessages_pb2 import *
+import config # Импортируем конфигурацию
+import bar_archive # Архив свечей (формат записей и загрузка истории)
+import bar_builder # Длительность таймфреймов
+
+DEFAULT_PORT = 5035 # Как у live.ctraderapi.com - достаточно заменить config.API_HOST
+DEFAULT_INTERFACE = "127.0.0.1"
+SYNTHETIC_HISTORY_BARS = 20000 # Сколько синтетических свечей генерировать на таймфрейм
+SPOT_INTERVAL_SECONDS = 1.0 # Период рассылки ProtoOASpotEvent по подписанным символам
+PRICE_DIVISOR = 100000.0 # Цены в протоколе передаются в 1/100000
+# Начальные цены синтетических символов (ID назначаются по порядку, начиная с 1)
+SYMBOL_BASE_PRICES = {
+    config.SYMBOL: 18000.0,
+    "US500": 5000.0,
+    "XAUUSD": 2000.0,
+    "EURUSD": 1.1,
+}
+SYNTHETIC_VOLATILITY = 0.0005 # Стандартное отклонение доходности за минуту (доля цены)
+SPREAD_FRACTION = 0.00005 # Спред котировок (доля цены)
+INJECTED_ERROR_CODE = "UNKNOWN_ERROR" # Код ошибки для --error-rate
+HEARTBEAT_PAYLOAD_TYPE = ProtoHeartbeatEvent().payloadType
+
+
+def synthetic_records(timeframe, count, base_price, seed=0, end_minutes=None):
+    """
+    Синтетические свечи (структурированный массив bar_archive.BAR_DTYPE): геометрическое случайное
+    блуждание, закрывающееся на base_price; последняя свеча содержит end_minutes (по умолчанию - текущая минута).
+    """
+    minutes = bar_builder.TIMEFRAME_MINUTES[timeframe.upper()]
+    if end_minutes is None:
+        end_minutes = int(time.time()) // 60
+    last_start = end_minutes - end_minutes % minutes
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(scale=SYNTHETIC_VOLATILITY * np.sqrt(minutes), size=count)
+    # Блуждание заканчивается на base_price, поэтому все таймфреймы сходятся к одной текущей цене
+    log_path = np.cumsum(returns)
+    close = base_price * np.exp(log_path - log_path[-1])
+    open_ = np.concatenate([[close[0] * np.exp(-returns[0])], close[:-1]])
+    wick = np.abs(rng.normal(scale=SYNTHETIC_VOLATILITY * np.sqrt(minutes) / 2, size=(2, count))) * close
+    records = np.empty(count, dtype=bar_archive.BAR_DTYPE)
+    records['timestamp'] = last_start - minutes * np.arange(count - 1, -1, -1, dtype=np.int64)
+    records['open'] = open_
+    records['close'] = close
+    records['high'] = np.maximum(open_, close) + wick[0]
+    records['low'] = np.minimum(open_, close) - wick[1]
+    records['volume'] = rng.integers(1, 1000, size=count)
+    return records
+
+
+def encode_trendbars(records, timeframe):
+    """Свечи BAR_DTYPE -> список ProtoOATrendbar (low и дельты в 1/100000 цены, как у сервера)."""
+    low = np.round(records['low'] * PRICE_DIVISOR).astype(np.int64)
+    delta_open = np.round(records['open'] * PRICE_DIVISOR).astype(np.int64) - low
+    delta_high = np.round(records['high'] * PRICE_DIVISOR).astype(np.int64) - low
+    delta_close = np.round(records['close'] * PRICE_DIVISOR).astype(np.int64) - low
+    period = ProtoOATrendbarPeriod.Value(timeframe.upper())
+    return [
+        ProtoOATrendbar(volume=int(volume), period=period, low=int(low_value), deltaOpen=int(d_open),
+                        deltaHigh=int(d_high), deltaClose=int(d_close), utcTimestampInMinutes=int(minutes))
+        for minutes, low_value, d_open, d_high, d_close, volume in zip(
+            records['timestamp'], low, delta_open, delta_high, delta_close, records['volume'])
+    ]
+
+
+class MarketData:
+    """
+    Данные сервера: символы, свечи по (символ, таймфрейм) и текущие котировки.
+    Свечи берутся из локального архива (use_archive) или генерируются один раз и кэшируются.
+    """
+
+    def __init__(self, symbols=None, history_bars=SYNTHETIC_HISTORY_BARS, use_archive=False, seed=0):
+        symbols = list(symbols or SYMBOL_BASE_PRICES)
+        self.symbol_ids = {name: symbol_id for symbol_id, name in enumerate(symbols, start=1)}
+        self.symbol_names = {symbol_id: name for name, symbol_id in self.symbol_ids.items()}
+        self.history_bars = history_bars
+        self.use_archive = use_archive
+        self.seed = seed
+        self._records = {} # {(symbol_id, timeframe): BAR_DTYPE}
+        self._spots = {} # {symbol_id: последняя цена}
+        self._spot_rng = np.random.default_rng(seed)
+
+    def records(self, symbol_id, timeframe):
+        """Свечи символа на таймфрейме (BAR_DTYPE, по возрастанию времени)."""
+        key = (symbol_id, timeframe)
+        records = self._records.get(key)
+        if records is None:
+            name = self.symbol_names[symbol_id]
+            if self.use_archive:
+                records = bar_archive.load_records(name, timeframe, count=self.history_bars)
+            if records is None or len(records) == 0:
+                base_price = SYMBOL_BASE_PRICES.get(name, 100.0)
+                records = synthetic_records(timeframe, self.history_bars, base_price, seed=self.seed * 1000 + symbol_id)
+            self._records[key] = records
+        return records
+
+    def trendbars(self, symbol_id, timeframe, from_ms, to_ms, count=None):
+        """Свечи в диапазоне [from_ms, to_ms] (не больше count последних) в виде ProtoOATrendbar."""
+        records = self.records(symbol_id, timeframe)
+        timestamps = records['timestamp']
+        start = np.searchsorted(timestamps, from_ms // 60000, side='left')
+        end = np.searchsorted(timestamps, to_ms // 60000, side='right')
+        if count:
+            start = max(start, end - count)
+        return encode_trendbars(records[start:end], timeframe)
+
+    def next_spot(self, symbol_id):
+        """Следующая котировка символа (bid, ask) - случайное блуждание от последнего закрытия M1."""
+        price = self._spots.get(symbol_id)
+        if price is None:
+            price = float(self.records(symbol_id, 'M1')['close'][-1])
+        price *= float(np.exp(self._spot_rng.normal(scale=SYNTHETIC_VOLATILITY / 8)))
+        self._spots[symbol_id] = price
+        return price, price * (1 + SPREAD_FRACTION)
+
+    def spot(self, symbol_id):
+        """Текущая котировка (bid, ask) без сдвига цены."""
+        if symbol_id not in self._spots:
+            return self.next_spot(symbol_id)
+        price = self._spots[symbol_id]
+        return price, price * (1 + SPREAD_FRACTION)
+
+
+class MockOpenApiProtocol(Int32StringReceiver):
+    """
+    Соединение с одним клиентом. Запросы обрабатываются в порядке поступления, ответы уходят
+    с задержкой latency + jitter, но не обгоняют друг друга (как у настоящего сервера).
+    """
+    MAX_LENGTH = 15000000 # Как в ctrader_open_api.TcpProtocol
+
+    def connectionMade(self):
+        self.app_authorized = False
+        self.authorized_accounts = set()
+        self.spot_symbols = set()
+        self.requests = 0
+        self._outbox = deque() # Отложенные ответы (срок time.monotonic(), данные)
+        self._flush_call = None
+        self._spot_task = task.LoopingCall(self._send_spots)
+        self.factory.connections.add(self)
+
+    def connectionLost(self, reason):
+        if self._spot_task.running:
+            self._spot_task.stop()
+        if self._flush_call is not None and self._flush_call.active():
+            self._flush_call.cancel()
+        self._outbox.clear()
+        self.factory.connections.discard(self)
+
+    def stringReceived(self, data):
+        message = ProtoMessage()
+        message.ParseFromString(data)
+        if message.payloadType == HEARTBEAT_PAYLOAD_TYPE:
+            return # Клиент сам шлет heartbeat при простое, отвечать не нужно
+
+        self.requests += 1
+        self.factory.stats['requests'] += 1
+        factory = self.factory
+        if factory.disconnect_after and self.requests > factory.disconnect_after:
+            factory.stats['disconnects'] += 1
+            self.transport.loseConnection()
+            return
+        roll = factory.random.random()
+        if roll < factory.disconnect_rate:
+            factory.stats['disconnects'] += 1
+            self.transport.loseConnection()
+            return
+        roll -= factory.disconnect_rate
+        if roll < factory.drop_rate:
+            factory.stats['dropped'] += 1
+            return
+        roll -= factory.drop_rate
+        if roll < factory.error_rate:
+            factory.stats['errors'] += 1
+            self._send_error(message.clientMsgId, INJECTED_ERROR_CODE, "Injected by mock_server")
+            return
+
+        handler = _HANDLERS.get(message.payloadType)
+        if handler is None:
+            self._send_error(message.clientMsgId, "UNSUPPORTED_MESSAGE", f"Payload type {message.payloadType} is not supported")
+            return
+        request = _REQUEST_TYPES[message.payloadType]()
+        request.ParseFromString(message.payload)
+        handler(self, request, message.clientMsgId)
+
+    # --- Отправка ---
+
+    def send_message(self, payload, client_msg_id=None, delay=True):
+        """Отправляет сообщение клиенту; delay - с задержкой ответа, сохраняя порядок ответов."""
+        message = ProtoMessage(payloadType=payload.payloadType, payload=payload.SerializeToString())
+        if client_msg_id:
+            message.clientMsgId = client_msg_id
+        data = message.SerializeToString()
+        latency = self.factory.response_delay() if delay else 0.0
+        if latency <= 0 and not self._outbox:
+            self.sendString(data)
+            return
+        # Очередь ответов: срок не раньше предыдущего, отправка одним таймером
+        due = max(time.monotonic() + latency, self._outbox[-1][0] if self._outbox else 0.0)
+        self._outbox.append((due, data))
+        if self._flush_call is None:
+            self._flush_call = reactor.callLater(max(0.0, due - time.monotonic()), self._flush)
+
+    def _flush(self):
+        """Отправляет ответы, срок которых наступил, и планирует следующий."""
+        self._flush_call = None
+        now = time.monotonic()
+        while self._outbox and self._outbox[0][0] <= now:
+            _, data = self._outbox.popleft()
+            self.sendString(data)
+        if self._outbox:
+            self._flush_call = reactor.callLater(self._outbox[0][0] - now, self._flush)
+
+    def _send_error(self, client_msg_id, error_code, description, account_id=None):
+        error = ProtoOAErrorRes(errorCode=error_code, description=description)
+        if account_id is not None:
+            error.ctidTraderAccountId = account_id
+        self.send_message(error, client_msg_id)
+
+    def _check_account(self, request, client_msg_id):
+        """Проверяет авторизацию приложения и счета запроса; при ошибке отвечает ProtoOAErrorRes."""
+        if not self.app_authorized:
+            self._send_error(client_msg_id, "CH_CLIENT_NOT_AUTHENTICATED", "Application is not authorized")
+            return False
+        if request.ctidTraderAccountId not in self.authorized_accounts:
+            self._send_error(client_msg_id, "ACCOUNT_NOT_AUTHORIZED", "Account is not authorized",
+                             request.ctidTraderAccountId)
+            return False
+        return True
+
+    def _check_symbol(self, request, symbol_id, client_msg_id):
+        if symbol_id not in self.factory.market.symbol_names:
+            self._send_error(client_msg_id, "SYMBOL_NOT_FOUND", f"Symbol {symbol_id} not found",
+                             request.ctidTraderAccountId)
+            return False
+        return True
+
+    # --- Обработчики запросов ---
+
+    def _on_application_auth(self, request, client_msg_id):
+        factory = self.factory
+        if factory.client_id is not None and (request.clientId != factory.client_id
+                                              or request.clientSecret != factory.client_secret):
+            self._send_error(client_msg_id, "CH_CLIENT_AUTH_FAILURE", "Invalid client credentials")
+            return
+        self.app_authorized = True
+        self.send_message(ProtoOAApplicationAuthRes(), client_msg_id)
+
+    def _on_account_auth(self, request, client_msg_id):
+        if not self.app_authorized:
+            self._send_error(client_msg_id, "CH_CLIENT_NOT_AUTHENTICATED", "Application is not authorized")
+            return
+        self.authorized_accounts.add(request.ctidTraderAccountId)
+        self.send_message(ProtoOAAccountAuthRes(ctidTraderAccountId=request.ctidTraderAccountId), client_msg_id)
+
+    def _on_account_list(self, request, client_msg_id):
+        response = ProtoOAGetAccountListByAccessTokenRes(accessToken=request.accessToken)
+        for account_id in sorted(self.authorized_accounts) or [self.factory.account_id]:
+            response.ctidTraderAccount.add(ctidTraderAccountId=account_id, isLive=False)
+        self.send_message(response, client_msg_id)
+
+    def _on_symbols_list(self, request, client_msg_id):
+        if not self._check_account(request, client_msg_id):
+            return
+        response = ProtoOASymbolsListRes(ctidTraderAccountId=request.ctidTraderAccountId)
+        for symbol_id, name in self.factory.market.symbol_names.items():
+            response.symbol.add(symbolId=symbol_id, symbolName=name, enabled=True)
+        self.send_message(response, client_msg_id)
+
+    def _on_trendbars(self, request, client_msg_id):
+        if not self._check_account(request, client_msg_id) or not self._check_symbol(request, request.symbolId, client_msg_id):
+            return
+        timeframe = ProtoOATrendbarPeriod.Name(request.period)
+        response = ProtoOAGetTrendbarsRes(
+            ctidTraderAccountId=request.ctidTraderAccountId, period=request.period,
+            timestamp=int(time.time() * 1000), symbolId=request.symbolId,
+        )
+        response.trendbar.extend(self.factory.market.trendbars(
+            request.symbolId, timeframe, request.fromTimestamp, request.toTimestamp,
+            request.count if request.HasField('count') else None,
+        ))
+        self.send_message(response, client_msg_id)
+
+    def _on_new_order(self, request, client_msg_id):
+        if not self._check_account(request, client_msg_id) or not self._check_symbol(request, request.symbolId, client_msg_id):
+            return
+        if request.orderType != ProtoOAOrderType.MARKET:
+            self._send_error(client_msg_id, "TRADING_BAD_PRICES", "Only market orders are supported by mock_server",
+                             request.ctidTraderAccountId)
+            return
+        if request.volume <= 0:
+            self._send_error(client_msg_id, "TRADING_BAD_VOLUME", "Volume must be positive", request.ctidTraderAccountId)
+            return
+
+        bid, ask = self.factory.market.spot(request.symbolId)
+        price = ask if request.tradeSide == ProtoOATradeSide.BUY else bid
+        sign = 1 if request.tradeSide == ProtoOATradeSide.BUY else -1
+        order_id, position_id = self.factory.next_ids()
+        now_ms = int(time.time() * 1000)
+        trade_data = ProtoOATradeData(symbolId=request.symbolId, volume=request.volume, tradeSide=request.tradeSide,
+                                      openTimestamp=now_ms, comment=request.comment, label=request.label)
+        stop_loss = request.stopLoss if request.HasField('stopLoss') else None
+        take_profit = request.takeProfit if request.HasField('takeProfit') else None
+        # Относительные SL/TP задаются в 1/100000 цены от цены исполнения
+        if request.HasField('relativeStopLoss'):
+            stop_loss = round(price - sign * request.relativeStopLoss / PRICE_DIVISOR, 5)
+        if request.HasField('relativeTakeProfit'):
+            take_profit = round(price + sign * request.relativeTakeProfit / PRICE_DIVISOR, 5)
+
+        order = ProtoOAOrder(orderId=order_id, tradeData=trade_data, orderType=request.orderType,
+                             orderStatus=ProtoOAOrderStatus.ORDER_STATUS_ACCEPTED, positionId=position_id,
+                             utcLastUpdateTimestamp=now_ms)
+        if request.clientOrderId:
+            order.clientOrderId = request.clientOrderId
+        position = ProtoOAPosition(positionId=position_id, tradeData=trade_data,
+                                   positionStatus=ProtoOAPositionStatus.POSITION_STATUS_CREATED, swap=0,
+                                   utcLastUpdateTimestamp=now_ms)
+        accepted = ProtoOAExecutionEvent(ctidTraderAccountId=request.ctidTraderAccountId,
+                                         executionType=ProtoOAExecutionType.ORDER_ACCEPTED,
+                                         order=order, position=position)
+        self.send_message(accepted, client_msg_id)
+
+        # Исполнение: отдельное событие с тем же clientMsgId, как у настоящего сервера
+        order.orderStatus = ProtoOAOrderStatus.ORDER_STATUS_FILLED
+        order.executionPrice = price
+        order.executedVolume = request.volume
+        position.positionStatus = ProtoOAPositionStatus.POSITION_STATUS_OPEN
+        position.price = price
+        if stop_loss is not None:
+            order.stopLoss = position.stopLoss = stop_loss
+        if take_profit is not None:
+            order.takeProfit = position.takeProfit = take_profit
+        deal = ProtoOADeal(dealId=order_id, orderId=order_id, positionId=position_id, volume=request.volume,
+                           filledVolume=request.volume, symbolId=request.symbolId, createTimestamp=now_ms,
+                           executionTimestamp=now_ms, executionPrice=price, tradeSide=request.tradeSide,
+                           dealStatus=ProtoOADealStatus.FILLED)
+        filled = ProtoOAExecutionEvent(ctidTraderAccountId=request.ctidTraderAccountId,
+                                       executionType=ProtoOAExecutionType.ORDER_FILLED,
+                                       order=order, position=position, deal=deal)
+        self.send_message(filled, client_msg_id)
+
+    def _on_subscribe_spots(self, request, client_msg_id):
+        if not self._check_account(request, client_msg_id):
+            return
+        for symbol_id in request.symbolId:
+            if not self._check_symbol(request, symbol_id, client_msg_id):
+                return
+        self.spot_symbols.update((request.ctidTraderAccountId, symbol_id) for symbol_id in request.symbolId)
+        self.send_message(ProtoOASubscribeSpotsRes(ctidTraderAccountId=request.ctidTraderAccountId), client_msg_id)
+        if not self._spot_task.running and self.factory.spot_interval > 0:
+            self._spot_task.start(self.factory.spot_interval, now=False)
+
+    def _on_unsubscribe_spots(self, request, client_msg_id):
+        if not self._check_account(request, client_msg_id):
+            return
+        self.spot_symbols.difference_update((request.ctidTraderAccountId, symbol_id) for symbol_id in request.symbolId)
+        self.send_message(ProtoOAUnsubscribeSpotsRes(ctidTraderAccountId=request.ctidTraderAccountId), client_msg_id)
+
+    def _on_subscribe_live_trendbar(self, request, client_msg_id):
+        if not self._check_account(request, client_msg_id):
+            return
+        if (request.ctidTraderAccountId, request.symbolId) not in self.spot_symbols:
+            self._send_error(client_msg_id, "NOT_SUBSCRIBED_TO_SPOTS", "Subscribe to spots first",
+                             request.ctidTraderAccountId)
+            return
+        # Свечи клиент строит сам по котировкам, поэтому достаточно подтверждения
+        self.send_message(ProtoOASubscribeLiveTrendbarRes(ctidTraderAccountId=request.ctidTraderAccountId), client_msg_id)
+
+    def _send_spots(self):
+        """Рассылает ProtoOASpotEvent по всем подписанным символам (события идут без задержки ответов)."""
+        now_ms = int(time.time() * 1000)
+        for account_id, symbol_id in list(self.spot_symbols):
+            bid, ask = self.factory.market.next_spot(symbol_id)
+            event = ProtoOASpotEvent(ctidTraderAccountId=account_id, symbolId=symbol_id,
+                                     bid=int(round(bid * PRICE_DIVISOR)), ask=int(round(ask * PRICE_DIVISOR)),
+                                     timestamp=now_ms)
+            self.send_message(event, delay=False)
+            self.factory.stats['spots'] += 1
+
+
+# Тип запроса -> (класс сообщения, обработчик)
+_REQUEST_HANDLERS = (
+    (ProtoOAApplicationAuthReq, MockOpenApiProtocol._on_application_auth),
+    (ProtoOAAccountAuthReq, MockOpenApiProtocol._on_account_auth),
+    (ProtoOAGetAccountListByAccessTokenReq, MockOpenApiProtocol._on_account_list),
+    (ProtoOASymbolsListReq, MockOpenApiProtocol._on_symbols_list),
+    (ProtoOAGetTrendbarsReq, MockOpenApiProtocol._on_trendbars),
+    (ProtoOANewOrderReq, MockOpenApiProtocol._on_new_order),
+    (ProtoOASubscribeSpotsReq, MockOpenApiProtocol._on_subscribe_spots),
+    (ProtoOAUnsubscribeSpotsReq, MockOpenApiProtocol._on_unsubscribe_spots),
+    (ProtoOASubscribeLiveTrendbarReq, MockOpenApiProtocol._on_subscribe_live_trendbar),
+)
+_REQUEST_TYPES = {message_class().payloadType: message_class for message_class, _ in _REQUEST_HANDLERS}
+_HANDLERS = {message_class().payloadType: handler for message_class, handler in _REQUEST_HANDLERS}
+
+
+class MockServerFactory(Factory):
+    """
+    Общие данные и настройки сервера.
+    latency_ms/jitter_ms - задержка ответов; error_rate, drop_rate, disconnect_rate - вероятности
+    ответить ProtoOAErrorRes, не ответить, разорвать соединение на запросе; disconnect_after - разрыв
+    после N запросов в соединении. client_id/client_secret (если заданы) проверяются при авторизации.
+    """
+    protocol = MockOpenApiProtocol
+
+    def __init__(self, market=None, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, drop_rate=0.0,
+                 disconnect_rate=0.0, disconnect_after=None, spot_interval=SPOT_INTERVAL_SECONDS,
+                 client_id=None, client_secret=None, seed=0):
+        self.market = market or MarketData(seed=seed)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.disconnect_rate = disconnect_rate
+        self.disconnect_after = disconnect_after
+        self.spot_interval = spot_interval
+        self.client_id = client_id
+        self.client_secret = client_secret
+        try:
+            self.account_id = int(config.ACCOUNT_ID)
+        except ValueError:
+            self.account_id = 1
+        self.random = random.Random(seed)
+        self.connections = set()
+        self.stats = {'requests': 0, 'errors': 0, 'dropped': 0, 'disconnects': 0, 'spots': 0}
+        self._ids = 0
+
+    def response_delay(self):
+        """Задержка очередного ответа (сек)."""
+        jitter = self.random.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0
+        return (self.latency_ms + jitter) / 1000.0
+
+    def next_ids(self):
+        """Новые (orderId, positionId)."""
+        self._ids += 1
+        return self._ids, self._ids
+
+    def disconnect_all(self):
+        """Разрывает все текущие соединения (проверка переподключения)."""
+        for connection in list(self.connections):
+            connection.transport.loseConnection()
+
+
+def tls_options(certificate_path=None):
+    """Параметры TLS: сертификат с ключом из PEM-файла или самоподписанный (клиент сертификат не проверяет)."""
+    if certificate_path:
+        with open(certificate_path) as f:
+            return ssl.PrivateCertificate.loadPEM(f.read()).options()
+    return ssl.KeyPair.generate(size=2048).selfSignedCert(1, CN="localhost").options()
+
+
+def listen(port=DEFAULT_PORT, interface=DEFAULT_INTERFACE, certificate_path=None, **options):
+    """
+    Запускает сервер в реакторе (вызывать из потока реактора).
+    options - аргументы MockServerFactory. Возвращает (IListeningPort, factory).
+    """
+    factory = MockServerFactory(**options)
+    listening_port = reactor.listenSSL(port, factory, tls_options(certificate_path), interface=interface)
+    return listening_port, factory
+
+
+def start_in_background(port=0, interface=DEFAULT_INTERFACE, **options):
+    """
+    Запускает сервер в реакторе, работающем в фоновом потоке (тот же реактор, что у ctrader_api).
+    port=0 - свободный порт. Возвращает (фактический порт, listening_port, factory).
+    """
+    import ctrader_api # Запуск общего реактора (импорт здесь, чтобы сервер не зависел от клиента)
+    ctrader_api.ensure_reactor_running()
+    listening_port, factory = threads.blockingCallFromThread(reactor, listen, port, interface, **options)
+    return listening_port.getHost().port, listening_port, factory
+
+
+def stop_in_background(listening_port, factory=None):
+    """Останавливает сервер, запущенный start_in_background, и разрывает его соединения."""
+    if factory is not None:
+        threads.blockingCallFromThread(reactor, factory.disconnect_all)
+    threads.blockingCallFromThread(reactor, listening_port.stopListening)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальный заменитель cTrader Open API")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--interface", default=DEFAULT_INTERFACE)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Задержка ответов (мс)")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Случайная добавка к задержке (мс)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля запросов с ответом ProtoOAErrorRes")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Доля запросов без ответа")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="Доля запросов, разрывающих соединение")
+    parser.add_argument("--disconnect-after", type=int, default=None, help="Разрыв после N запросов в соединении")
+    parser.add_argument("--spot-interval", type=float, default=SPOT_INTERVAL_SECONDS, help="Период котировок (сек)")
+    parser.add_argument("--history-bars", type=int, default=SYNTHETIC_HISTORY_BARS, help="Свечей на таймфрейм")
+    parser.add_argument("--archive", action="store_true", help="Отдавать свечи из локального архива (config.BAR_ARCHIVE_DIR)")
+    parser.add_argument("--cert", default=None, help="PEM с сертификатом и ключом (по умолчанию самоподписанный)")
+    parser.add_argument("--check-credentials", action="store_true", help="Проверять CLIENT_ID/CLIENT_SECRET из config")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    market = MarketData(history_bars=args.history_bars, use_archive=args.archive, seed=args.seed)
+    listen(
+        args.port, args.interface, args.cert, market=market,
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        drop_rate=args.drop_rate, disconnect_rate=args.disconnect_rate, disconnect_after=args.disconnect_after,
+        spot_interval=args.spot_interval, seed=args.seed,
+        client_id=config.CLIENT_ID if args.check_credentials else None,
+        client_secret=config.CLIENT_SECRET if args.check_credentials else None,
+    )
+    print(f"mock_server слушает {args.interface}:{args.port} (TLS). Символы: {', '.join(market.symbol_ids)}")
+    print(f"Для подключения бота: config.API_HOST = \"localhost\", config.API_PORT = {args.port}")
+    reactor.run()
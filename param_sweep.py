@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Перебор параметров стратегии (сетка) на исторических свечах с пулом процессов.
+
+Свечи один раз копируются в общую память (multiprocessing.shared_memory); воркеры подключаются
+к ней в инициализаторе и работают с массивами без копирования и без передачи DataFrame.
+Комбинации упорядочены по окнам свингов и раздаются воркерам блоками, поэтому кэш свингов
+и кандидатов входа в Backtester воркера переиспользуется между соседними комбинациями.
+"""
+
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import time as dt_time
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+import config # Импортируем конфигурацию
+import backtester # Прогон стратегии
+import bar_archive # Загрузка истории из архива
+
+# Сетка по умолчанию: имена совпадают с аргументами Backtester.run
+DEFAULT_GRID = {
+    'swing_n_h1': [3, 4, 5, 6, 7],
+    'swing_n_h4': [2, 3, 4, 5],
+    'fractal_n': [2, 3],
+    'sl_offset_points': [0.0, 2.0, 5.0, 10.0, 20.0],
+    'risk_percent': [config.RISK_PER_TRADE_PERCENT],
+    'session_window': [(config.ASIAN_SESSION_START_UTC, config.ASIAN_SESSION_END_UTC),
+                       (dt_time(1, 0), dt_time(2, 0))],
+}
+# Параметры, от которых зависят свинги и кандидаты входа (по ним группируются комбинации)
+_SWING_KEYS = ('swing_n_h1', 'swing_n_h4', 'fractal_n', 'session_window')
+_FIELDS = ('time', 'open', 'high', 'low', 'close')
+
+_worker_backtester = None # Backtester воркера над общей памятью
+_worker_segments = [] # Ссылки на подключенные сегменты общей памяти (чтобы их не закрыл сборщик мусора)
+
+
+def _share_arrays(arrays):
+    """Копирует массивы свечей в один сегмент общей памяти: строка 0 - время (int64), 1-4 - OHLC (float64)."""
+    length = len(arrays['time'])
+    segment = shared_memory.SharedMemory(create=True, size=max(len(_FIELDS) * length * 8, 8))
+    block = np.ndarray((len(_FIELDS), length), dtype=np.float64, buffer=segment.buf)
+    block[0].view(np.int64)[:] = arrays['time']
+    for row, field in enumerate(_FIELDS[1:], start=1):
+        block[row] = arrays[field]
+    return segment, (segment.name, length)
+
+
+def _attach_arrays(descriptor):
+    """Подключается к сегменту общей памяти и возвращает словарь массивов-представлений (без копирования)."""
+    name, length = descriptor
+    segment = shared_memory.SharedMemory(name=name)
+    _worker_segments.append(segment)
+    block = np.ndarray((len(_FIELDS), length), dtype=np.float64, buffer=segment.buf)
+    arrays = {'time': block[0].view(np.int64)}
+    for row, field in enumerate(_FIELDS[1:], start=1):
+        arrays[field] = block[row]
+    return arrays
+
+
+def _init_worker(h1_descriptor, h4_descriptor, m1_descriptor):
+    """Инициализатор воркера: Backtester над общей памятью."""
+    global _worker_backtester
+    m1_arrays = _attach_arrays(m1_descriptor) if m1_descriptor is not None else None
+    _worker_backtester = backtester.Backtester.from_arrays(
+        _attach_arrays(h1_descriptor), _attach_arrays(h4_descriptor), m1_arrays
+    )
+
+
+def _run_combination(params):
+    """Прогон одной комбинации в воркере; возвращает параметры вместе со статистикой."""
+    _, stats = _worker_backtester.run(**params)
+    return dict(params, **stats)
+
+
+def parameter_combinations(grid):
+    """Все комбинации сетки, упорядоченные так, чтобы комбинации с общими свингами шли подряд."""
+    names = list(grid)
+    combinations = [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+    swing_keys = [key for key in _SWING_KEYS if key in names]
+    combinations.sort(key=lambda params: tuple(str(params[key]) for key in swing_keys))
+    return combinations
+
+
+def map_combinations(h1_data, h4_data, m1_data, tasks, function, processes=None):
+    """
+    Выполняет function(task) для каждого задания в пуле процессов над общими свечами.
+    function - функция верхнего уровня модуля, использующая Backtester воркера (worker_backtester()).
+    Возвращает список результатов в порядке tasks.
+    """
+    processes = processes or os.cpu_count() or 1
+    arrays = {
+        'h1': backtester._bars_to_arrays(h1_data),
+        'h4': backtester._bars_to_arrays(h4_data),
+        'm1': backtester._bars_to_arrays(m1_data) if m1_data is not None and not m1_data.empty else None,
+    }
+    segments, descriptors = [], {}
+    try:
+        for key, value in arrays.items():
+            if value is None:
+                descriptors[key] = None
+                continue
+            segment, descriptors[key] = _share_arrays(value)
+            segments.append(segment)
+        del arrays
+
+        # Блоки примерно одинакового размера на процесс, внутри блока - соседние по свингам комбинации
+        chunk_size = max(1, len(tasks) // (processes * 4))
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(descriptors['h1'], descriptors['h4'], descriptors['m1'])) as executor:
+            return list(executor.map(function, tasks, chunksize=chunk_size))
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+
+def worker_backtester():
+    """Backtester текущего воркера (над общей памятью)."""
+    return _worker_backtester
+
+
+def run_sweep(h1_data, h4_data, m1_data=None, grid=None, processes=None):
+    """
+    Прогоняет все комбинации сетки grid ({аргумент Backtester.run: список значений}).
+    processes - число процессов (по умолчанию все ядра). Возвращает DataFrame результатов,
+    отсортированный по total_pnl.
+    """
+    combinations = parameter_combinations(grid or DEFAULT_GRID)
+    results = map_combinations(h1_data, h4_data, m1_data, combinations, _run_combination, processes)
+    return pd.DataFrame(results).sort_values('total_pnl', ascending=False).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    print(f"Перебор параметров {config.SYMBOL} по локальному архиву ({config.BAR_ARCHIVE_DIR})...")
+    h1_data = bar_archive.load_bars(config.SYMBOL, config.TIMEFRAME_CONTEXT_H1)
+    h4_data = bar_archive.load_bars(config.SYMBOL, config.TIMEFRAME_CONTEXT_H4)
+    m1_data = bar_archive.load_bars(config.SYMBOL, config.TIMEFRAME_ENTRY)
+    if h1_data.empty or h4_data.empty:
+        print("Ошибка: В архиве нет свечей H1/H4. Загрузите историю через ctrader_api.get_historical_range.")
+    else:
+        total = len(parameter_combinations(DEFAULT_GRID))
+        print(f"Комбинаций: {total}, процессов: {os.cpu_count()}")
+        started = time.perf_counter()
+        results = run_sweep(h1_data, h4_data, m1_data)
+        print(f"Перебор занял {time.perf_counter() - started:.1f} сек.")
+        print(results.head(10).to_string())
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Проверки centered_window_max/min против pandas rolling: python -m pytest -q test_analysis_windows.py"""
+
+import numpy as np
+import pandas as pd
+import pytest
+import analysis
+
+SEED = 13
+
+
+def _rolling(values, n, method):
+    rolling = pd.Series(values).rolling(2 * n + 1, center=True, min_periods=n + 1)
+    return getattr(rolling, method)().to_numpy()
+
+
+def _random_series(rng, length, nan_share=0.0):
+    # Округление дает повторяющиеся значения (равные максимумы в окне)
+    values = np.round(np.cumsum(rng.normal(size=length)), 1)
+    if nan_share:
+        values[rng.random(length) < nan_share] = np.nan
+    return values
+
+
+# Малые n считаются сдвигами, n > SHIFTED_WINDOW_MAX_N - алгоритмом van Herk/Gil-Werman
+@pytest.mark.parametrize("n", [1, 2, 5, analysis.SHIFTED_WINDOW_MAX_N, analysis.SHIFTED_WINDOW_MAX_N + 1, 40])
+def test_matches_rolling(n):
+    rng = np.random.default_rng(SEED + n)
+    for length in list(range(1, 2 * n + 4)) + [100, 1000]:
+        values = _random_series(rng, length)
+        np.testing.assert_array_equal(analysis.centered_window_max(values, n), _rolling(values, n, 'max'))
+        np.testing.assert_array_equal(analysis.centered_window_min(values, n), _rolling(values, n, 'min'))
+
+
+@pytest.mark.parametrize("n", [1, 3, analysis.SHIFTED_WINDOW_MAX_N + 3])
+def test_matches_rolling_with_nan(n):
+    rng = np.random.default_rng(SEED * 7 + n)
+    for _ in range(200):
+        values = _random_series(rng, int(rng.integers(1, 120)), nan_share=rng.random() * 0.6)
+        np.testing.assert_array_equal(analysis.centered_window_max(values, n), _rolling(values, n, 'max'))
+        np.testing.assert_array_equal(analysis.centered_window_min(values, n), _rolling(values, n, 'min'))
+
+
+def test_rows_match_rolling():
+    rng = np.random.default_rng(SEED)
+    values = np.stack([_random_series(rng, 300) for _ in range(8)])
+    values[:3, :50] = np.nan # Короткие ряды, дополненные NaN слева (как в stack_bars)
+    for n in (2, 20):
+        expected_max = np.stack([_rolling(row, n, 'max') for row in values])
+        expected_min = np.stack([_rolling(row, n, 'min') for row in values])
+        np.testing.assert_array_equal(analysis.centered_window_max(values, n), expected_max)
+        np.testing.assert_array_equal(analysis.centered_window_min(values, n), expected_min)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Проверки отправки ордеров по шаблонам (ctrader_api.send_armed_order) и их учета в main_bot.
+Сервер - локальный mock_server, запуск: python -m pytest -q test_armed_orders.py
+"""
+
+from datetime import datetime
+import pandas as pd
+import pytest
+import config
+import ctrader_api
+import main_bot
+import mock_server
+import trading_logic
+import analysis
+from ctrader_api import (ProtoMessage, ProtoOAExecutionEvent, ProtoOAExecutionType, ProtoOAOrder, ProtoOAOrderStatus,
+                         ProtoOAOrderType, ProtoOATradeData, ProtoOATradeSide)
+
+
+def _execution_message(ticket, execution_type, executed_volume=None, price=18000.0):
+    """ProtoMessage с ProtoOAExecutionEvent по ордеру ticket (как его отправляет сервер)."""
+    order = ProtoOAOrder(
+        orderId=7, orderType=ProtoOAOrderType.MARKET, orderStatus=ProtoOAOrderStatus.ORDER_STATUS_ACCEPTED,
+        tradeData=ProtoOATradeData(symbolId=1, volume=50000, tradeSide=ProtoOATradeSide.BUY),
+        clientOrderId=ticket.client_order_id, positionId=9,
+    )
+    if executed_volume is not None:
+        order.executedVolume = executed_volume
+        order.executionPrice = price
+    event = ProtoOAExecutionEvent(ctidTraderAccountId=1, executionType=execution_type, order=order)
+    return ProtoMessage(payloadType=event.payloadType, payload=event.SerializeToString())
+
+
+def _open_ticket():
+    ticket = ctrader_api.OrderTicket("test-1", config.SYMBOL, "BUY")
+    ctrader_api.order_tickets[ticket.client_order_id] = ticket
+    return ticket
+
+
+def test_late_fill_is_matched_after_timeout():
+    ticket = _open_ticket()
+    assert ctrader_api.wait_for_fill(ticket, timeout=0.01)['status'] == "TIMEOUT"
+    assert ticket.client_order_id in ctrader_api.order_tickets # Исход неизвестен - тикет ждет событие
+
+    ctrader_api._handle_execution_event(_execution_message(ticket, ProtoOAExecutionType.ORDER_FILLED, 50000))
+    assert ticket.outcome['status'] == "FILLED"
+    assert ticket.outcome['volume'] == 0.5
+    assert ticket.client_order_id not in ctrader_api.order_tickets
+
+
+def test_partial_fill_is_not_reported_as_filled():
+    ticket = _open_ticket()
+    ctrader_api._handle_execution_event(_execution_message(ticket, ProtoOAExecutionType.ORDER_PARTIAL_FILL, 20000))
+    assert not ticket.future.done() # Остаток еще может исполниться
+
+    ctrader_api._handle_execution_event(_execution_message(ticket, ProtoOAExecutionType.ORDER_CANCELLED, 20000))
+    result = ctrader_api.wait_for_fill(ticket, timeout=1)
+    assert result['status'] == "PARTIALLY_FILLED"
+    assert result['volume'] == 0.2
+
+
+@pytest.fixture
+def mock_connection(monkeypatch, tmp_path):
+    """Подключение ctrader_api к mock_server; сервер не отвечает на запросы после подключения."""
+    monkeypatch.setattr(config, "SYMBOL_MAP_FILE", str(tmp_path / "symbol_map.json"))
+    monkeypatch.setattr(config, "USE_BAR_ARCHIVE", False)
+    monkeypatch.setattr(config, "USE_RECONNECT_SUPERVISOR", False)
+    port, listening_port, factory = mock_server.start_in_background(0)
+    monkeypatch.setattr(config, "API_HOST", "localhost")
+    monkeypatch.setattr(config, "API_PORT", port)
+    try:
+        assert ctrader_api.connect_to_ctrader(max_retries=1, retry_delay=1)
+        assert ctrader_api.arm_market_orders(config.SYMBOL)
+        yield factory
+    finally:
+        ctrader_api.disconnect_from_ctrader()
+        ctrader_api.disarm_market_orders()
+        mock_server.stop_in_background(listening_port, factory)
+
+
+def test_timed_out_armed_order_is_not_sent_again(mock_connection, monkeypatch):
+    bars = pd.DataFrame({'timestamp': pd.date_range("2026-01-01", periods=3, freq="h", tz="UTC"),
+                         'open': 18000.0, 'high': 18010.0, 'low': 17990.0, 'close': 18000.0})
+    monkeypatch.setattr(ctrader_api, "fetch_cycle_data", lambda client_obj, symbol, include_balance=False: {
+        'h4': bars, 'h1': bars, 'price': 18000.0, 'balance': 10000.0,
+    })
+    monkeypatch.setattr(config, "USE_MARKET_STRUCTURE", False)
+    monkeypatch.setattr(config, "USE_FRACTAL_INDEX", False)
+    monkeypatch.setattr(config, "ORDER_FILL_TIMEOUT_SECONDS", 1)
+    monkeypatch.setattr(analysis, "determine_context", lambda *args, **kwargs: "BULLISH")
+    monkeypatch.setattr(trading_logic, "is_asian_session_start", lambda now_utc: True)
+    monkeypatch.setattr(trading_logic, "get_stop_loss_level", lambda *args, **kwargs: 17980.0)
+    monkeypatch.setattr(trading_logic, "get_take_profit_level", lambda *args, **kwargs: 18040.0)
+    monkeypatch.setattr(trading_logic, "calculate_position_size", lambda *args: 0.5)
+    monkeypatch.setattr(main_bot, "client", ctrader_api.client)
+    monkeypatch.setattr(main_bot, "trade_taken_today", False)
+    monkeypatch.setattr(main_bot, "last_check_day", datetime.now(config.UTC).date())
+
+    sent = []
+    send_armed_order = ctrader_api.send_armed_order
+    def counting_send(*args, **kwargs):
+        ticket = send_armed_order(*args, **kwargs)
+        sent.append(ticket)
+        return ticket
+    monkeypatch.setattr(ctrader_api, "send_armed_order", counting_send)
+
+    mock_connection.drop_rate = 1.0 # Ордер уходит, но событий исполнения нет
+    main_bot.run_trading_cycle()
+    main_bot.run_trading_cycle() # Следующее пробуждение в окне входа
+
+    assert len(sent) == 1
+    assert sent[0].outcome['status'] == "TIMEOUT"
+    assert main_bot.trade_taken_today
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Проверки пакетных функций trading_logic против скалярных: python -m pytest -q test_batch_levels.py"""
+
+import numpy as np
+import config
+import analysis
+import trading_logic
+from test_swing_tracker import random_bars
+
+SEED = 17
+
+
+def _as_nan(value):
+    return np.nan if value is None else value
+
+
+def _random_entries(rng, bars, count):
+    directions = rng.choice(["BUY", "SELL"], size=count)
+    entries = np.round(rng.uniform(bars['low'].min() - 20, bars['high'].max() + 20, size=count))
+    return directions, entries
+
+
+def test_stop_loss_levels_match_scalar():
+    rng = np.random.default_rng(SEED)
+    for length in (5, 60, 500):
+        bars = random_bars(rng, length)
+        analysis.clear_analysis_cache()
+        swing_highs, swing_lows = analysis.find_swing_points(bars, config.SWING_POINTS_LOOKBACK_H1)
+        directions, entries = _random_entries(rng, bars, 200)
+        batch = trading_logic.get_stop_loss_levels(directions, entries, swing_highs.to_numpy(), swing_lows.to_numpy())
+        expected = [_as_nan(trading_logic.get_stop_loss_level(direction, bars, entry))
+                    for direction, entry in zip(directions, entries)]
+        np.testing.assert_array_equal(batch, expected)
+
+
+def test_stop_loss_levels_use_last_swing_before_entry():
+    rng = np.random.default_rng(SEED + 1)
+    swing_times = np.sort(rng.choice(1000, size=30, replace=False))
+    swing_lows = np.round(rng.uniform(17900, 18000, size=30))
+    swing_highs = swing_lows + 100
+    entry_times = rng.integers(0, 1100, size=300)
+    entries = np.full(300, 18050.0)
+    directions = rng.choice(["BUY", "SELL"], size=300)
+    batch = trading_logic.get_stop_loss_levels(directions, entries, swing_highs, swing_lows,
+                                               swing_times, swing_times, entry_times, offset_points=2.0)
+    for direction, entry, entry_time, sl in zip(directions, entries, entry_times, batch):
+        before = np.flatnonzero(swing_times <= entry_time)
+        if not len(before):
+            assert np.isnan(sl)
+            continue
+        last = before[-1]
+        if direction == "BUY":
+            expected = swing_lows[last] - 2.0 if swing_lows[last] < entry else np.nan
+        else:
+            expected = swing_highs[last] + 2.0 if swing_highs[last] > entry else np.nan
+        np.testing.assert_equal(sl, expected)
+
+
+def test_take_profit_levels_match_scalar():
+    rng = np.random.default_rng(SEED + 2)
+    for length in (5, 60, 500):
+        bars = random_bars(rng, length)
+        analysis.clear_analysis_cache()
+        fractal_up, fractal_down = analysis.find_h1_fractals(bars, config.FRACTAL_LOOKBACK_H1)
+        directions, entries = _random_entries(rng, bars, 200)
+        sl_prices = np.where(rng.random(200) < 0.2, np.nan, entries + np.where(directions == "BUY", -30.0, 30.0))
+        batch = trading_logic.get_take_profit_levels(directions, entries, sl_prices,
+                                                     fractal_up['high'].to_numpy(), fractal_down['low'].to_numpy())
+        expected = [
+            _as_nan(trading_logic.get_take_profit_level(direction, entry, bars, None if np.isnan(sl) else sl))
+            for direction, entry, sl in zip(directions, entries, sl_prices)
+        ]
+        np.testing.assert_array_equal(batch, expected)
+
+
+def test_take_profit_levels_respect_time_bounds():
+    rng = np.random.default_rng(SEED + 3)
+    times = np.sort(rng.choice(2000, size=80, replace=False))
+    up = np.round(rng.uniform(18000, 18200, size=80))
+    down = up - 150
+    count = 400
+    directions, entries = rng.choice(["BUY", "SELL"], size=count), np.round(rng.uniform(17850, 18200, size=count))
+    after, before = rng.integers(0, 2000, size=count), rng.integers(0, 2000, size=count)
+    batch = trading_logic.get_take_profit_levels(directions, entries, entries, up, down, times, times, after, before)
+    for direction, entry, start, end, tp in zip(directions, entries, after, before, batch):
+        allowed = (times >= start) & (times < end)
+        if direction == "BUY":
+            found = np.flatnonzero(allowed & (up > entry))
+            expected = up[found[0]] if len(found) else np.nan
+        else:
+            found = np.flatnonzero(allowed & (down < entry))
+            expected = down[found[-1]] if len(found) else np.nan
+        np.testing.assert_equal(tp, expected)
+
+
+def test_position_size_batch_matches_scalar():
+    rng = np.random.default_rng(SEED + 4)
+    balances = np.round(rng.uniform(100, 100000, size=500), 2)
+    sl_pips = np.round(rng.uniform(-5, 300, size=500), 1)
+    pip_values = rng.choice([0.0, 0.5, 1.0, 10.0], size=500)
+    batch = trading_logic.calculate_position_size_batch(balances, 1.0, sl_pips, pip_values)
+    expected = [trading_logic.calculate_position_size(balance, 1.0, sl, pip)
+                for balance, sl, pip in zip(balances, sl_pips, pip_values)]
+    np.testing.assert_allclose(batch, expected, rtol=0, atol=1e-9)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Проверки FractalIndex против find_h1_fractals: python -m pytest -q test_fractal_index.py"""
+
+import numpy as np
+import pytest
+import analysis
+import trading_logic
+from test_swing_tracker import random_bars
+
+SEED = 16
+
+
+def _confirmed_fractals(bars, n):
+    """Фракталы find_h1_fractals без последних n (неподтвержденных) свечей."""
+    analysis.clear_analysis_cache()
+    up, down = analysis.find_h1_fractals(bars, n)
+    confirmed = len(bars) - n
+    return up[up.index < confirmed], down[down.index < confirmed]
+
+
+def _first_up_above(up, price, after):
+    candidates = up[(up['high'] > price) & ((up['timestamp'] >= after) if after is not None else True)]
+    return None if candidates.empty else (candidates['timestamp'].iloc[0], candidates['high'].iloc[0])
+
+
+def _last_down_below(down, price, after):
+    candidates = down[(down['low'] < price) & ((down['timestamp'] >= after) if after is not None else True)]
+    return None if candidates.empty else (candidates['timestamp'].iloc[-1], candidates['low'].iloc[-1])
+
+
+def _indexes(bars, n):
+    """Индекс, пополненный по свечам (с перестройкой дерева), и индекс, построенный по массивам."""
+    streamed = analysis.FractalIndex(n)
+    streamed.update_from_dataframe(bars)
+    built = analysis.FractalIndex.from_arrays(bars['high'].to_numpy(), bars['low'].to_numpy(),
+                                              list(bars['timestamp']), n)
+    return streamed, built
+
+
+@pytest.mark.parametrize("n", [1, 2, 3])
+def test_queries_match_brute_force(n):
+    rng = np.random.default_rng(SEED + n)
+    for length in (3, 40, 700):
+        bars = random_bars(rng, length)
+        up, down = _confirmed_fractals(bars, n)
+        low, high = bars['low'].min(), bars['high'].max()
+        for index in _indexes(bars, n):
+            assert (index.up_count, index.down_count) == (len(up), len(down))
+            for _ in range(150):
+                price = float(np.round(rng.uniform(low - 5, high + 5)))
+                after = None if rng.random() < 0.2 else bars['timestamp'].iloc[int(rng.integers(len(bars)))]
+                assert index.first_up_above(price, after) == _first_up_above(up, price, after)
+                assert index.last_down_below(price, after) == _last_down_below(down, price, after)
+
+
+def test_take_profit_with_index_matches_scan():
+    rng = np.random.default_rng(SEED)
+    n = 2
+    bars = random_bars(rng, 400)
+    up, down = _confirmed_fractals(bars, n)
+    index, _ = _indexes(bars, n)
+    window = bars.iloc[100:] # h1_data короче индекса: фракталы до ее начала не учитываются
+    after = window['timestamp'].iloc[0]
+    for _ in range(150):
+        entry = float(np.round(rng.uniform(bars['low'].min(), bars['high'].max())))
+        buy = _first_up_above(up, entry, after)
+        sell = _last_down_below(down, entry, after)
+        assert trading_logic.get_take_profit_level("BUY", entry, window, entry - 50, fractal_index=index) == \
+            (round(buy[1], 5) if buy else None)
+        assert trading_logic.get_take_profit_level("SELL", entry, window, entry + 50, fractal_index=index) == \
+            (round(sell[1], 5) if sell else None)
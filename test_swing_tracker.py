@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Проверки SwingTracker против find_swing_points: python -m pytest -q test_swing_tracker.py"""
+
+import numpy as np
+import pandas as pd
+import pytest
+import analysis
+
+SEED = 11
+
+
+def random_bars(rng, length):
+    """Свечи H1 со случайным блужданием; округление дает равные high/low в окне."""
+    close = 18000 + np.round(np.cumsum(rng.normal(scale=10, size=length)))
+    spread = np.round(rng.random(length) * 20)
+    return pd.DataFrame({
+        'timestamp': pd.date_range("2026-01-01", periods=length, freq="h", tz="UTC"),
+        'open': close, 'high': close + spread, 'low': close - spread, 'close': close,
+    })
+
+
+@pytest.mark.parametrize("n", [1, 2, 5, 8])
+def test_matches_find_swing_points(n):
+    rng = np.random.default_rng(SEED + n)
+    for length in (1, n, n + 1, 2 * n + 1, 50, 500):
+        bars = random_bars(rng, length)
+        tracker = analysis.SwingTracker(n)
+        tracker.update_from_dataframe(bars)
+        tracker_highs, tracker_lows = tracker.to_series()
+
+        analysis.clear_analysis_cache()
+        swing_highs, swing_lows = analysis.find_swing_points(bars, n)
+        # Последние n свечей трекер еще не подтвердил
+        confirmed = len(bars) - n
+        expected_highs = swing_highs[swing_highs.index < confirmed]
+        expected_lows = swing_lows[swing_lows.index < confirmed]
+        assert tracker_highs.index.tolist() == expected_highs.index.tolist()
+        assert tracker_lows.index.tolist() == expected_lows.index.tolist()
+        np.testing.assert_array_equal(tracker_highs.to_numpy(), expected_highs.to_numpy())
+        np.testing.assert_array_equal(tracker_lows.to_numpy(), expected_lows.to_numpy())
+
+
+def test_incremental_updates_match_single_pass():
+    rng = np.random.default_rng(SEED)
+    bars = random_bars(rng, 300)
+    whole = analysis.SwingTracker(5)
+    whole.update_from_dataframe(bars)
+    chunked = analysis.SwingTracker(5)
+    for end in range(7, len(bars) + 7, 7):
+        chunked.update_from_dataframe(bars.iloc[:end]) # Каждый раз весь префикс - берутся только новые свечи
+    assert list(chunked.swing_highs) == list(whole.swing_highs)
+    assert list(chunked.swing_lows) == list(whole.swing_lows)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Проверки walk_forward: запуск python -m pytest -q test_walk_forward.py"""
+
+import numpy as np
+import pandas as pd
+import walk_forward
+
+START = pd.Timestamp("2026-01-01", tz="UTC")
+
+
+def _h1_bars(days):
+    times = pd.date_range(START, periods=days * 24, freq="h")
+    return pd.DataFrame({'timestamp': times, 'open': 1.0, 'high': 1.0, 'low': 1.0, 'close': 1.0})
+
+
+def _trades(*rows):
+    """Сделки (вход, выход в днях от START, pnl) в формате Backtester.run."""
+    return pd.DataFrame({
+        'entry_time': [START + pd.Timedelta(days=entry) for entry, _, _ in rows],
+        'exit_time': [START + pd.Timedelta(days=exit_) for _, exit_, _ in rows],
+        'exit_reason': 'TP',
+        'pnl': [pnl for _, _, pnl in rows],
+    })
+
+
+def test_trade_straddling_split_is_not_scored_in_sample():
+    edges = walk_forward.block_edges(_h1_bars(30), block_days=10)
+    # Вход в блоке 0, выход в блоке 1: итог известен только после границы edges[1]
+    aggregates = walk_forward.block_aggregates(_trades((8, 12, 500.0)), edges)
+    prefix = np.concatenate([np.zeros((1, aggregates.shape[0], 1)), np.cumsum(aggregates[None], axis=2)], axis=2)
+
+    in_sample = walk_forward._window_statistics(prefix, 0, 1)
+    out_of_sample = walk_forward._window_statistics(prefix, 1, 2)
+    assert in_sample['trades'][0] == 0
+    assert in_sample['total_pnl'][0] == 0.0
+    assert out_of_sample['trades'][0] == 1
+    assert out_of_sample['total_pnl'][0] == 500.0
+
+
+def test_straddling_trade_does_not_choose_parameters():
+    h1 = _h1_bars(30)
+    edges = walk_forward.block_edges(h1, block_days=10)
+    grid = {'swing_n_h1': [3, 4]}
+    combinations = walk_forward.param_sweep.parameter_combinations(grid)
+    trades = {
+        3: _trades((2, 4, 10.0)),    # Небольшая прибыль, закрыта in-sample
+        4: _trades((8, 12, 500.0)),  # Крупная прибыль, закрыта уже out-of-sample
+    }
+    aggregates = np.stack([walk_forward.block_aggregates(trades[params['swing_n_h1']], edges) for params in combinations])
+
+    result = walk_forward.run_walk_forward(h1, None, grid=grid, block_days=10, in_sample_blocks=1,
+                                           out_of_sample_blocks=1, min_trades=1, aggregates=aggregates)
+    first_window = result['windows'].iloc[0]
+    assert first_window['swing_n_h1'] == 3
+    assert first_window['is_total_pnl'] == 10.0
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import numpy as np
 import config # Импортируем конфигурацию
 import analysis # Импортируем функции анализа
 
@@ -20,9 +21,11 @@ def calculate_position_size(balance, risk_percent, sl_pips, pip_value):
     # Минимальный лот - обычно 0.01
     return max(position_size_lots, 0.01)
 
-def get_stop_loss_level(direction, h1_data, current_price):
+def get_stop_loss_level(direction, h1_data, current_price, symbol=None):
     """Определяет уровень SL за последним свингом H1."""
-    h1_swing_highs, h1_swing_lows = analysis.find_swing_points(h1_data, n=config.SWING_POINTS_LOOKBACK_H1)
+    h1_swing_highs, h1_swing_lows = analysis.find_swing_points(
+        h1_data, n=config.SWING_POINTS_LOOKBACK_H1, symbol=symbol, timeframe=config.TIMEFRAME_CONTEXT_H1
+    )
 
     last_low_series = h1_swing_lows.dropna()
     last_high_series = h1_swing_highs.dropna()
@@ -59,9 +62,18 @@ def get_stop_loss_level(direction, h1_data, current_price):
 
     return sl_price
 
-def get_take_profit_level(direction, entry_price, h1_data, sl_price):
-    """Определяет уровень TP на ближайшем H1 фрактале."""
-    fractal_up_points, fractal_down_points = analysis.find_h1_fractals(h1_data, n=config.FRACTAL_LOOKBACK_H1)
+def get_take_profit_level(direction, entry_price, h1_data, sl_price, symbol=None, fractal_index=None):
+    """
+    Определяет уровень TP на ближайшем H1 фрактале.
+    fractal_index (analysis.FractalIndex) - поиск по индексу подтвержденных фракталов за O(log n)
+    в пределах периода h1_data вместо пересчета и сортировки всех фракталов.
+    """
+    if fractal_index is not None:
+        return _get_take_profit_level_indexed(direction, entry_price, h1_data, sl_price, fractal_index)
+
+    fractal_up_points, fractal_down_points = analysis.find_h1_fractals(
+        h1_data, n=config.FRACTAL_LOOKBACK_H1, symbol=symbol, timeframe=config.TIMEFRAME_CONTEXT_H1
+    )
 
     tp_price = None
     if direction == "BUY":
@@ -94,20 +106,170 @@ def get_take_profit_level(direction, entry_price, h1_data, sl_price):
             #     tp_price = entry_price - sl_distance
             #     print(f"Установлен TP по умолчанию (1:1 R:R): {tp_price:.5f}")
 
-    # Округление TP до нужного количества знаков после запятой
-    if tp_price is not None:
-         # Проверка, чтобы TP был дальше SL от цены входа
-        if direction == "BUY" and sl_price is not None and tp_price <= entry_price:
-             print(f"Предупреждение: Рассчитанный TP ({tp_price:.5f}) для BUY не выше цены входа ({entry_price:.5f}). TP не установлен.")
-             tp_price = None
-        elif direction == "SELL" and sl_price is not None and tp_price >= entry_price:
-             print(f"Предупреждение: Рассчитанный TP ({tp_price:.5f}) для SELL не ниже цены входа ({entry_price:.5f}). TP не установлен.")
-             tp_price = None
+    return _validate_take_profit(direction, entry_price, sl_price, tp_price)
+
+def _get_take_profit_level_indexed(direction, entry_price, h1_data, sl_price, fractal_index):
+    """get_take_profit_level по FractalIndex: те же правила выбора фрактала и проверки TP."""
+    after = h1_data['timestamp'].iloc[0] if h1_data is not None and not h1_data.empty else None
+    tp_price = None
+    if direction == "BUY":
+        # Самый первый по времени фрактал вверх выше входа
+        fractal = fractal_index.first_up_above(entry_price, after)
+        if fractal is not None:
+            tp_price = fractal[1]
+            print(f"TP для Long: Ближайший H1 фрактал вверх ({tp_price:.5f})")
         else:
-            tp_price = round(tp_price, 5)
+            print("Не найден подходящий фрактал вверх для TP.")
+    elif direction == "SELL":
+        # Самый последний по времени фрактал вниз ниже входа
+        fractal = fractal_index.last_down_below(entry_price, after)
+        if fractal is not None:
+            tp_price = fractal[1]
+            print(f"TP для Short: Ближайший H1 фрактал вниз ({tp_price:.5f})")
+        else:
+            print("Не найден подходящий фрактал вниз для TP.")
+
+    return _validate_take_profit(direction, entry_price, sl_price, tp_price)
+
+def _validate_take_profit(direction, entry_price, sl_price, tp_price):
+    """Общая проверка TP обоих путей: TP должен быть по направлению сделки от цены входа; округление."""
+    if tp_price is None:
+        return None
+    # Проверка, чтобы TP был дальше SL от цены входа
+    if direction == "BUY" and sl_price is not None and tp_price <= entry_price:
+         print(f"Предупреждение: Рассчитанный TP ({tp_price:.5f}) для BUY не выше цены входа ({entry_price:.5f}). TP не установлен.")
+         return None
+    if direction == "SELL" and sl_price is not None and tp_price >= entry_price:
+         print(f"Предупреждение: Рассчитанный TP ({tp_price:.5f}) для SELL не ниже цены входа ({entry_price:.5f}). TP не установлен.")
+         return None
+    # Округление TP до нужного количества знаков после запятой
+    return round(tp_price, 5)
+
+# --- Пакетные (векторные) версии для исследований риска и бэктестов ---
+# Без print: некорректные результаты возвращаются как NaN (для лотов - 0, как в calculate_position_size).
+
+def _direction_signs(directions):
+    """Направления "BUY"/"SELL" или +1/-1 в массив знаков (+1 - покупка, -1 - продажа, 0 - неизвестно)."""
+    directions = np.asarray(directions)
+    if directions.dtype.kind in 'UO':
+        return np.where(directions == "BUY", 1, np.where(directions == "SELL", -1, 0))
+    return np.sign(directions).astype(np.int64)
+
+def calculate_position_size_batch(balances, risk_percent, sl_pips, pip_value):
+    """
+    calculate_position_size для массивов (аргументы транслируются по правилам NumPy).
+    Лоты округляются вниз до 0.01, минимум 0.01; при некорректном SL или стоимости пункта - 0.
+    """
+    balances = np.asarray(balances, dtype=np.float64)
+    sl_pips = np.asarray(sl_pips, dtype=np.float64)
+    pip_value = np.asarray(pip_value, dtype=np.float64)
+    risk_amount = balances * (np.asarray(risk_percent, dtype=np.float64) / 100.0)
+    sl_cost_per_lot = sl_pips * pip_value
+    valid = (sl_pips > 0) & (pip_value > 0) & (sl_cost_per_lot > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        position_size_lots = np.trunc(risk_amount / sl_cost_per_lot / 0.01) * 0.01
+    return np.where(valid, np.maximum(position_size_lots, 0.01), 0.0)
+
+def _last_level_before(level_prices, level_times, query_times):
+    """Последний уровень с временем <= query_time (NaN, если такого нет); без времен - последний уровень."""
+    level_prices = np.asarray(level_prices, dtype=np.float64)
+    if level_times is None or query_times is None:
+        last = level_prices[-1] if len(level_prices) else np.nan
+        return np.full(np.shape(query_times) if query_times is not None else (), last)
+    positions = np.searchsorted(np.asarray(level_times), np.asarray(query_times), side='right') - 1
+    padded = np.append(level_prices, np.nan) # Позиция -1 указывает на NaN
+    return padded[positions]
+
+def get_stop_loss_levels(directions, entry_prices, swing_high_prices, swing_low_prices,
+                         swing_high_times=None, swing_low_times=None, entry_times=None,
+                         offset_points=config.SL_OFFSET_POINTS):
+    """
+    get_stop_loss_level для массива входов: SL за последним свингом с отступом, округление до 5 знаков.
+    Свинги передаются отсортированными по времени. С entry_times для каждого входа берется последний свинг
+    с временем <= времени входа (передавайте время подтверждения свинга, чтобы не заглядывать в будущее);
+    без времен - последний свинг, как в get_stop_loss_level. NaN - SL не найден или не за ценой входа.
+    """
+    signs = _direction_signs(directions)
+    entry_prices = np.asarray(entry_prices, dtype=np.float64)
+    signs, entry_prices = np.broadcast_arrays(signs, entry_prices)
+    query_times = None if entry_times is None else np.broadcast_to(np.asarray(entry_times), entry_prices.shape)
+
+    last_low = np.broadcast_to(_last_level_before(swing_low_prices, swing_low_times, query_times), entry_prices.shape)
+    last_high = np.broadcast_to(_last_level_before(swing_high_prices, swing_high_times, query_times), entry_prices.shape)
+    # Для GER40 1 пункт = 1.0
+    sl_prices = np.where(signs > 0, last_low - offset_points / 1.0, last_high + offset_points / 1.0)
+    valid = np.where(signs > 0, last_low < entry_prices, (signs < 0) & (last_high > entry_prices))
+    return np.where(valid, np.round(sl_prices, 5), np.nan)
+
+def _first_above(values, starts, thresholds):
+    """
+    Для каждого запроса - первая позиция j >= start с values[j] > threshold (len(values), если нет).
+    Двоичный подъем по разреженной таблице максимумов: log2(n) векторных шагов на все запросы сразу.
+    """
+    length = len(values)
+    positions = np.asarray(starts, dtype=np.int64).copy()
+    if length == 0:
+        return positions
+    tables = [np.asarray(values, dtype=np.float64)]
+    while (1 << len(tables)) <= length:
+        previous, step = tables[-1], 1 << (len(tables) - 1)
+        tables.append(np.maximum(previous[:-step], previous[step:]))
+    for level in range(len(tables) - 1, -1, -1):
+        table = tables[level]
+        in_range = positions < len(table)
+        skip = in_range.copy()
+        skip[in_range] = table[positions[in_range]] <= thresholds[in_range]
+        positions[skip] += 1 << level
+    return np.minimum(positions, length)
+
+def get_take_profit_levels(directions, entry_prices, sl_prices,
+                           fractal_up_prices, fractal_down_prices,
+                           fractal_up_times=None, fractal_down_times=None, after_times=None, before_times=None):
+    """
+    get_take_profit_level для массива входов (фракталы отсортированы по времени).
+    BUY - самый ранний фрактал вверх с high выше входа, SELL - самый поздний фрактал вниз с low ниже входа;
+    учитываются фракталы с after_time <= время < before_time (after - как начало h1_data,
+    before - чтобы в бэктесте не брать еще не подтвержденные фракталы).
+    NaN - фрактал не найден или TP не за ценой входа. Округление до 5 знаков.
+    """
+    signs = _direction_signs(directions)
+    entry_prices = np.asarray(entry_prices, dtype=np.float64)
+    sl_prices = np.asarray(sl_prices, dtype=np.float64)
+    signs, entry_prices, sl_prices = np.broadcast_arrays(signs, entry_prices, sl_prices)
+    flat_signs, flat_entries = signs.ravel(), entry_prices.ravel()
+    up_prices = np.asarray(fractal_up_prices, dtype=np.float64)
+    down_prices = np.asarray(fractal_down_prices, dtype=np.float64)
+
+    def position_bounds(times, count):
+        """Диапазон позиций фракталов [start, end) для каждого входа."""
+        starts = np.zeros(flat_entries.shape, dtype=np.int64)
+        ends = np.full(flat_entries.shape, count, dtype=np.int64)
+        if times is not None and after_times is not None:
+            query = np.broadcast_to(np.asarray(after_times), entry_prices.shape).ravel()
+            starts = np.searchsorted(np.asarray(times), query, side='left')
+        if times is not None and before_times is not None:
+            query = np.broadcast_to(np.asarray(before_times), entry_prices.shape).ravel()
+            ends = np.searchsorted(np.asarray(times), query, side='left')
+        return starts, ends
+
+    # BUY: первая позиция >= start с high > входа
+    up_starts, up_ends = position_bounds(fractal_up_times, len(up_prices))
+    up_positions = _first_above(up_prices, up_starts, flat_entries)
+    up_positions = np.where(up_positions < up_ends, up_positions, len(up_prices))
+    buy_tp = np.append(up_prices, np.nan)[up_positions]
 
+    # SELL: последняя позиция < end с low < входа - тот же поиск по развернутому ряду -low
+    down_starts, down_ends = position_bounds(fractal_down_times, len(down_prices))
+    count = len(down_prices)
+    reversed_positions = _first_above(-down_prices[::-1], count - down_ends, -flat_entries)
+    down_positions = count - 1 - reversed_positions
+    down_positions = np.where((reversed_positions < count) & (down_positions >= down_starts), down_positions, count)
+    sell_tp = np.append(down_prices, np.nan)[down_positions]
 
-    return tp_price
+    tp_prices = np.where(flat_signs > 0, buy_tp, np.where(flat_signs < 0, sell_tp, np.nan)).reshape(entry_prices.shape)
+    # Та же проверка, что в get_take_profit_level: TP должен быть за ценой входа
+    invalid = ~np.isnan(sl_prices) & (((signs > 0) & (tp_prices <= entry_prices)) | ((signs < 0) & (tp_prices >= entry_prices)))
+    return np.where(invalid, np.nan, np.round(tp_prices, 5))
 
 def is_asian_session_start(current_time_utc):
     """Проверяет, находится ли время в первом часу Азиатской сессии (UTC)."""
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Walk-forward оптимизация: параметры выбираются на окне in-sample и проверяются на следующем окне out-of-sample,
+окна сдвигаются по всей истории.
+
+Каждая комбинация параметров прогоняется один раз на всей истории (Backtester с прогретым
+состоянием структуры, как у живого бота), сделки сворачиваются в агрегаты по блокам времени выхода
+(количество, прибыльные, PnL, валовая прибыль/убыток): сделка попадает в окно, только если в нем
+закрылась, поэтому сделка, закрытая после конца окна in-sample, не влияет на выбор параметров.
+По префиксным суммам агрегатов любое окно
+оценивается за O(1) на комбинацию, поэтому число окон не умножает стоимость прогона.
+"""
+
+import os
+import time
+import numpy as np
+import pandas as pd
+import config # Импортируем конфигурацию
+import backtester # Прогон стратегии
+import param_sweep # Сетка параметров и пул процессов над общей памятью
+import bar_archive # Загрузка истории из архива
+
+BLOCK_DAYS = 30 # Длина блока агрегации сделок (дней)
+IN_SAMPLE_BLOCKS = 12 # Длина окна оптимизации (блоков)
+OUT_OF_SAMPLE_BLOCKS = 3 # Длина окна проверки (блоков), на столько же сдвигаются окна
+MIN_IN_SAMPLE_TRADES = 20 # Комбинации с меньшим числом сделок in-sample не выбираются
+# Агрегаты сделок по блокам: количество, прибыльные, PnL, валовая прибыль, валовой убыток
+_AGGREGATES = ('trades', 'wins', 'pnl', 'gross_profit', 'gross_loss')
+
+
+def block_edges(h1_data, block_days=BLOCK_DAYS):
+    """Границы блоков (int64 нс UTC) от первой до последней свечи H1."""
+    times = backtester._bars_to_arrays(h1_data)['time']
+    step = block_days * backtester.MINUTES_PER_DAY * backtester.NS_PER_MINUTE
+    return np.arange(times[0], times[-1] + step, step, dtype=np.int64)
+
+
+def block_aggregates(trades, edges):
+    """
+    Агрегаты закрытых сделок по блокам времени выхода: массив (len(_AGGREGATES), число блоков).
+    PnL известен только после выхода - по времени входа в окно in-sample попадали бы цены после его конца.
+    """
+    blocks_count = len(edges) - 1
+    result = np.zeros((len(_AGGREGATES), blocks_count))
+    closed = trades[trades['exit_reason'] != 'OPEN'] if not trades.empty else trades
+    if closed.empty:
+        return result
+    exit_times = pd.DatetimeIndex(closed['exit_time']).as_unit('ns').asi8
+    blocks = np.clip(np.searchsorted(edges, exit_times, side='right') - 1, 0, blocks_count - 1)
+    pnl = closed['pnl'].to_numpy()
+    result[0] = np.bincount(blocks, minlength=blocks_count)
+    result[1] = np.bincount(blocks, weights=(pnl > 0).astype(np.float64), minlength=blocks_count)
+    result[2] = np.bincount(blocks, weights=pnl, minlength=blocks_count)
+    result[3] = np.bincount(blocks, weights=np.where(pnl > 0, pnl, 0.0), minlength=blocks_count)
+    result[4] = np.bincount(blocks, weights=np.where(pnl < 0, -pnl, 0.0), minlength=blocks_count)
+    return result
+
+
+def _run_combination_blocks(task):
+    """Воркер: полный прогон комбинации и агрегаты сделок по блокам."""
+    params, edges = task
+    trades, _ = param_sweep.worker_backtester().run(**params)
+    return block_aggregates(trades, edges)
+
+
+def _window_statistics(prefix, start, end):
+    """Статистика всех комбинаций на блоках [start, end) по префиксным суммам: dict массивов."""
+    totals = prefix[:, :, end] - prefix[:, :, start]
+    trades, wins, pnl, gross_profit, gross_loss = (totals[:, k] for k in range(len(_AGGREGATES)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'trades': trades,
+            'win_rate': np.where(trades > 0, wins / trades, 0.0),
+            'total_pnl': pnl,
+            'profit_factor': np.where(gross_loss > 0, gross_profit / gross_loss, np.inf),
+        }
+
+
+def run_walk_forward(h1_data, h4_data, m1_data=None, grid=None, block_days=BLOCK_DAYS,
+                     in_sample_blocks=IN_SAMPLE_BLOCKS, out_of_sample_blocks=OUT_OF_SAMPLE_BLOCKS,
+                     objective='total_pnl', min_trades=MIN_IN_SAMPLE_TRADES, processes=None,
+                     aggregates=None):
+    """
+    Walk-forward по сетке grid (как в param_sweep). objective - метрика выбора ('total_pnl' или 'profit_factor').
+    aggregates - результат предыдущего вызова (ключ 'aggregates') для тех же свечей, сетки и блоков:
+    прогоны не повторяются. Возвращает dict: 'windows' (DataFrame по окнам), 'summary' (итог out-of-sample),
+    'combinations', 'aggregates'.
+    """
+    combinations = param_sweep.parameter_combinations(grid or param_sweep.DEFAULT_GRID)
+    edges = block_edges(h1_data, block_days)
+    if aggregates is None:
+        tasks = [(params, edges) for params in combinations]
+        aggregates = np.stack(param_sweep.map_combinations(
+            h1_data, h4_data, m1_data, tasks, _run_combination_blocks, processes
+        ))
+    # Префиксные суммы по блокам: (комбинации, агрегаты, блоки + 1)
+    prefix = np.concatenate([np.zeros(aggregates.shape[:2] + (1,)), np.cumsum(aggregates, axis=2)], axis=2)
+
+    rows = []
+    blocks_count = len(edges) - 1
+    for start in range(0, blocks_count - in_sample_blocks - out_of_sample_blocks + 1, out_of_sample_blocks):
+        split, end = start + in_sample_blocks, start + in_sample_blocks + out_of_sample_blocks
+        in_sample = _window_statistics(prefix, start, split)
+        scores = np.where(in_sample['trades'] >= min_trades, in_sample[objective], -np.inf)
+        if np.all(scores == -np.inf):
+            continue # Ни одна комбинация не набрала min_trades сделок
+        best = int(np.argmax(scores))
+        out_of_sample = _window_statistics(prefix, split, end)
+        row = {
+            'in_sample_start': pd.to_datetime(edges[start], unit='ns', utc=True),
+            'out_of_sample_start': pd.to_datetime(edges[split], unit='ns', utc=True),
+            'out_of_sample_end': pd.to_datetime(edges[end], unit='ns', utc=True),
+        }
+        row.update(combinations[best])
+        row.update({f'is_{name}': values[best] for name, values in in_sample.items()})
+        row.update({f'oos_{name}': values[best] for name, values in out_of_sample.items()})
+        rows.append(row)
+
+    windows = pd.DataFrame(rows)
+    if windows.empty:
+        summary = {'windows': 0, 'oos_trades': 0, 'oos_total_pnl': 0.0, 'oos_win_rate': 0.0, 'is_total_pnl': 0.0}
+    else:
+        oos_trades = windows['oos_trades'].sum()
+        summary = {
+            'windows': len(windows),
+            'oos_trades': int(oos_trades),
+            'oos_total_pnl': float(windows['oos_total_pnl'].sum()),
+            'oos_win_rate': float((windows['oos_win_rate'] * windows['oos_trades']).sum() / oos_trades) if oos_trades else 0.0,
+            'is_total_pnl': float(windows['is_total_pnl'].sum()),
+        }
+    return {'windows': windows, 'summary': summary, 'combinations': combinations, 'aggregates': aggregates}
+
+
+if __name__ == "__main__":
+    print(f"Walk-forward {config.SYMBOL} по локальному архиву ({config.BAR_ARCHIVE_DIR})...")
+    h1_data = bar_archive.load_bars(config.SYMBOL, config.TIMEFRAME_CONTEXT_H1)
+    h4_data = bar_archive.load_bars(config.SYMBOL, config.TIMEFRAME_CONTEXT_H4)
+    m1_data = bar_archive.load_bars(config.SYMBOL, config.TIMEFRAME_ENTRY)
+    if h1_data.empty or h4_data.empty:
+        print("Ошибка: В архиве нет свечей H1/H4. Загрузите историю через ctrader_api.get_historical_range.")
+    else:
+        print(f"Процессов: {os.cpu_count()}, блок {BLOCK_DAYS} дн., окна {IN_SAMPLE_BLOCKS}/{OUT_OF_SAMPLE_BLOCKS} блоков")
+        started = time.perf_counter()
+        result = run_walk_forward(h1_data, h4_data, m1_data)
+        print(f"Walk-forward занял {time.perf_counter() - started:.1f} сек.")
+        print(result['windows'].to_string())
+        for name, value in result['summary'].items():
+            print(f"  {name}: {value}")